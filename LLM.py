@@ -1,22 +1,39 @@
 import os
-from groq import Groq
-from dotenv import load_dotenv
 import re
-from search import search_medicine_info
+import llm_gateway
+import llm_router
+import metrics
+import name_resolver
+import prompt_context
+from search import normalize_name, search_medicine_info
 
-def extract_medicine_name(text):
+# Fall back to the old capitalization heuristic when the lexicon finds
+# nothing; off by default so unreadable text never reaches search or the LLM
+NAME_HEURISTIC_FALLBACK = os.getenv('NAME_HEURISTIC_FALLBACK', '').lower() in ('1', 'true', 'yes')
+
+# Appended to an answer the LLM ran out of tokens for; such answers are
+# shown but never stored or cached
+TRUNCATED_NOTE = "\n\n(This answer was cut short. Check the package leaflet or ask a pharmacist for the rest.)"
+
+# Start of the texts returned instead of an answer
+FAILURES = ("Unable to generate response", "Could not identify a medicine name")
+
+class AnswerInterrupted(Exception):
     """
-    Extract the likely medicine name from the OCR text.
+    Raised by `stream_llm` when the answer fails after part of it was
+    yielded, so that callers can tell a partial answer from a complete one.
+    """
+
+def guess_medicine_name(text):
+    """
+    Guess the medicine name from capitalization and position alone.
     
     Args:
         text (str): The OCR extracted text
         
     Returns:
-        str: The extracted medicine name or empty string if none found
+        str: The guessed medicine name or empty string if none found
     """
-    # Look for common medicine name patterns
-    # This is a simple implementation - consider using NLP or more robust methods
-    
     # Try to find the medicine name - usually one of the prominent words
     # Often, medicine names are in ALL CAPS or appear at the beginning of the text
     lines = text.strip().split('\n')
@@ -37,45 +54,61 @@ def extract_medicine_name(text):
     # Fallback - return nothing
     return ""
 
-def query_llm(input_text):
+def medicine_name_candidates(text, words=None, limit=5):
     """
-    Process extracted text, search for medicine info, and generate a structured response.
+    Rank the medicine names found in the OCR output.
     
     Args:
-        input_text (str): The text extracted from the medicine image
+        text (str): The OCR extracted text
+        words (list): OCR word boxes with confidences, if available
+        limit (int): Maximum number of candidates
         
     Returns:
-        str: Structured information about the medicine
+        list: Candidate dicts from `name_resolver.resolve`, best first
     """
-    try:
-        # Load environment variables from .env file
-        load_dotenv()
-        
-        # Get the API key from environment variables
-        groq_api_key = os.getenv('GROQ_API_KEY')
-        
-        if not groq_api_key:
-            return "Unable to generate response. API key missing."
-        
-        # Extract medicine name from the OCR text
-        medicine_name = extract_medicine_name(input_text)
-        
-        if not medicine_name:
-            return "Could not identify a medicine name in the image. Please try again with a clearer image."
-            
-        # Search for medicine information online
-        search_results = search_medicine_info(medicine_name)
+    return name_resolver.resolve(text, words, limit)
+
+def identify_medicine(text, words=None):
+    """
+    Resolve the medicine name and its ranked alternatives.
+    
+    Args:
+        text (str): The OCR extracted text
+        words (list): OCR word boxes with confidences, if available
         
-        # Initialize the Groq client with API key
-        client = Groq(api_key=groq_api_key)
+    Returns:
+        dict: 'medicine_name' (empty when nothing resolves) and
+        'medicine_candidates' (ranked alternatives)
+    """
+    with metrics.span('name'):
+        candidates = medicine_name_candidates(text, words)
+    if candidates:
+        medicine_name = candidates[0]['name']
+    elif NAME_HEURISTIC_FALLBACK:
+        medicine_name = guess_medicine_name(text)
+    else:
+        medicine_name = ""
+    return {'medicine_name': medicine_name, 'medicine_candidates': candidates}
+
+def extract_medicine_name(text, words=None):
+    """
+    Extract the likely medicine name from the OCR text.
+    
+    Args:
+        text (str): The OCR extracted text
+        words (list): OCR word boxes with confidences, if available
         
-        # Create a chat completion using the Groq API with a medicine-focused prompt
-        chat_completion = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": """You are a helpful medical information assistant. 
+    Returns:
+        str: The extracted medicine name or empty string if none found
+    """
+    candidates = medicine_name_candidates(text, words, limit=1)
+    if candidates:
+        return candidates[0]['name']
+    if NAME_HEURISTIC_FALLBACK:
+        return guess_medicine_name(text)
+    return ""
+
+SYSTEM_PROMPT = """You are a helpful medical information assistant. 
                     Your task is to provide clear, factual information about medications based on reliable sources.
                     Structure your response in these sections:
                     1. Medicine Name: The identified medication
@@ -84,13 +117,31 @@ def query_llm(input_text):
                     4. Common Side Effects: The most frequently reported side effects
                     5. Precautions: Important warnings or contraindications
                     6. Important Note: Always remind users to consult healthcare professionals and follow their prescribed dosage.
+                    Keep each section to two or three short sentences.
                     
                     Be factual and avoid speculating. If information is unclear or missing, acknowledge this rather than guessing.
                     IMPORTANT: Never provide medical advice - only factual information about the medicine."""
-                },
-                {
-                    "role": "user", 
-                    "content": f"""I need information about a medication. 
+
+def build_messages(input_text, medicine_name, search_results):
+    """
+    Build the chat messages sent to the LLM.
+    
+    Args:
+        input_text (str): The text extracted from the medicine image
+        medicine_name (str): The identified medicine name
+        search_results (str): Compiled search results for the medicine
+        
+    Returns:
+        list: Chat messages for the completion API
+    """
+    return [
+        {
+            "role": "system", 
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user", 
+            "content": f"""I need information about a medication. 
                     Here is text extracted from a medicine package/label: 
                     
                     {input_text}
@@ -102,15 +153,173 @@ def query_llm(input_text):
                     {search_results}
                     
                     Please provide structured information about this medication."""
-                }
-            ],
-            temperature=0.3,  # Lower temperature for more factual responses
-            max_tokens=1500
-        )
+        }
+    ]
+
+def compact_messages(input_text, medicine_name, search_results, words=None, decision=None):
+    """
+    Build the chat messages from the compacted label text and search results.
+    
+    Args:
+        input_text (str): The text extracted from the medicine image
+        medicine_name (str): The identified medicine name
+        search_results (str): Compiled search results for the medicine
+        words (list): OCR word boxes with confidences, if available
+        decision (dict): Routing decision, whose generic names help rank snippets
+        
+    Returns:
+        tuple: (chat messages, max_tokens for the completion)
+    """
+    names = decision['generic'] if decision is not None else []
+    context = prompt_context.build(input_text, medicine_name, search_results, words, names)
+    messages = build_messages(context['label'], medicine_name, context['search'])
+    prompt_context.report(medicine_name, build_messages(input_text, medicine_name, search_results),
+                          messages, context['max_tokens'])
+    return messages, context['max_tokens']
+
+def _prepare(input_text, medicine_name=None, search_results=None):
+    """
+    Resolve the medicine name and search results for a request.
+    
+    Returns:
+        tuple: (True, medicine name, search results), or
+        (False, error message, None) when the request cannot go ahead
+    """
+    if not os.getenv('GROQ_API_KEY'):
+        return False, "Unable to generate response. API key missing.", None
+    
+    # Extract medicine name from the OCR text
+    if medicine_name is None:
+        medicine_name = extract_medicine_name(input_text)
+    
+    if not medicine_name:
+        return False, "Could not identify a medicine name in the image. Please try again with a clearer image.", None
+        
+    # Search for medicine information online
+    if search_results is None:
+        search_results = search_medicine_info(medicine_name)
+    
+    return True, medicine_name, search_results
+
+def query_llm(input_text, medicine_name=None, search_results=None, raise_errors=False, candidates=None, words=None):
+    """
+    Process extracted text, search for medicine info, and generate a structured response.
+    
+    The router serves medicines answered before from its store and picks
+    the model for the rest, which gets a compacted prompt. Concurrent
+    calls for the same medicine and search results share one completion
+    through the LLM gateway.
+    
+    Args:
+        input_text (str): The text extracted from the medicine image
+        medicine_name (str): Medicine name if already known, otherwise it is
+            extracted from the text
+        search_results (str): Search results if already fetched, otherwise
+            they are searched for
+        candidates (list): Ranked name candidates from `identify_medicine`,
+            used for routing; resolved from the text if not given
+        words (list): OCR word boxes with confidences, used to clean the
+            label text; the text is cleaned on its own without them
+        raise_errors (bool): Raise API errors, and `llm_gateway.LLMTruncated`
+            for a cut off answer, instead of returning them as text, e.g. so
+            that callers caching the answer skip failures
+        
+    Returns:
+        str: Structured information about the medicine; an answer the LLM
+        ran out of tokens for ends with TRUNCATED_NOTE and is not stored
+    """
+    try:
+        ready, medicine_name, search_results = _prepare(input_text, medicine_name, search_results)
+        if not ready:
+            return medicine_name
+        
+        router = llm_router.get_router()
+        if candidates is None:
+            candidates = medicine_name_candidates(input_text)
+        decision = router.route(medicine_name, candidates, search_results, input_text)
+        if decision['answer'] is not None:
+            router.finish(decision)
+            return decision['answer']
+        
+        # Create a chat completion using the Groq API with a medicine-focused prompt
+        messages, max_tokens = compact_messages(input_text, medicine_name, search_results, words, decision)
+        try:
+            answer = llm_gateway.get_gateway().complete(
+                messages,
+                key=llm_gateway.coalesce_key(normalize_name(medicine_name), search_results, model=decision['model']),
+                model=decision['model'],
+                temperature=0.3,  # Lower temperature for more factual responses
+                max_tokens=max_tokens
+            )
+        except llm_gateway.LLMTruncated as e:
+            router.finish(decision)
+            if raise_errors:
+                raise
+            return e.text + TRUNCATED_NOTE
+        router.finish(decision, answer)
+        return answer
+    
+    except Exception as e:
+        if raise_errors:
+            raise
+        # Return a user-friendly error message without exposing API details
+        return f"Unable to generate response: {str(e)}"
+
+def stream_llm(input_text, medicine_name=None, search_results=None, candidates=None, words=None):
+    """
+    Same as `query_llm`, but yield the response piece by piece as the LLM
+    generates it. A stored answer comes back as a single piece.
+    
+    Args:
+        input_text (str): The text extracted from the medicine image
+        medicine_name (str): Medicine name if already known
+        search_results (str): Search results if already fetched
+        candidates (list): Ranked name candidates, used for routing
+        words (list): OCR word boxes with confidences, used to clean the label text
+        
+    Yields:
+        str: Consecutive chunks of the response
+        
+    Raises:
+        AnswerInterrupted: When the answer fails after its first chunk; the
+            chunks already yielded are partial and must not be kept
+    """
+    sent = False
+    try:
+        ready, medicine_name, search_results = _prepare(input_text, medicine_name, search_results)
+        if not ready:
+            yield medicine_name
+            return
+        
+        router = llm_router.get_router()
+        if candidates is None:
+            candidates = medicine_name_candidates(input_text)
+        decision = router.route(medicine_name, candidates, search_results, input_text)
+        if decision['answer'] is not None:
+            router.finish(decision)
+            yield decision['answer']
+            return
         
-        # Return the LLM's response
-        return chat_completion.choices[0].message.content
+        chunks = []
+        messages, max_tokens = compact_messages(input_text, medicine_name, search_results, words, decision)
+        try:
+            for chunk in llm_gateway.get_gateway().stream(
+                    messages,
+                    key=llm_gateway.coalesce_key(normalize_name(medicine_name), search_results, model=decision['model']),
+                    model=decision['model'],
+                    temperature=0.3,  # Lower temperature for more factual responses
+                    max_tokens=max_tokens):
+                chunks.append(chunk)
+                sent = True
+                yield chunk
+        except llm_gateway.LLMTruncated:
+            router.finish(decision)
+            yield TRUNCATED_NOTE
+            return
+        router.finish(decision, ''.join(chunks))
     
     except Exception as e:
+        if sent:
+            raise AnswerInterrupted(f"Unable to generate the rest of the response: {str(e)}") from e
         # Return a user-friendly error message without exposing API details
-        return f"Unable to generate response: {str(e)}"
\ No newline at end of file
+        yield f"Unable to generate response: {str(e)}"
@@ -1,14 +1,32 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context, url_for
 import os
+import threading
+import time
 import cv2
 import numpy as np
-import extraction
 import LLM
+import knowledge_store
+import llm_gateway
+import llm_router
+import prompt_context
+import search
+import cache
+import jobs
+import worker_pool
+import batch
+import extraction
+import live_scan
+import metrics
+import ocr_engine
 import logging
 from dotenv import load_dotenv
-import tempfile
 import base64
 
+try:
+    from flask_sock import Sock
+except ImportError:  # Live scanning is optional
+    Sock = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,127 +34,798 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Check for required API keys
 required_keys = ['GROQ_API_KEY', 'GOOGLE_API_KEY', 'GOOGLE_SEARCH_ENGINE_ID']
-missing_keys = [key for key in required_keys if not os.getenv(key)]
-if missing_keys:
-    logger.warning(f"Missing required API keys: {', '.join(missing_keys)}")
 
-# Create temp directory if it doesn't exist
-os.makedirs("temp", exist_ok=True)
+# Label read once at startup so engines, models and pools are loaded
+# before the first real request
+WARMUP_IMAGE = os.getenv('WARMUP_IMAGE', 'cap_img.jpg')
+
+# Set once this process has warmed up and can take traffic
+ready = threading.Event()
+warmup_error = None
+
+def check_config():
+    """
+    Log the required API keys that are not configured.
+
+    Returns:
+        list: Names of the missing keys
+    """
+    missing_keys = [key for key in required_keys if not os.getenv(key)]
+    if missing_keys:
+        logger.warning(f"Missing required API keys: {', '.join(missing_keys)}")
+    return missing_keys
+
+def _warmup_image():
+    if not WARMUP_IMAGE or not os.path.exists(WARMUP_IMAGE):
+        logger.warning(f"Warmup image {WARMUP_IMAGE!r} not found, skipping the warmup scan")
+        return None
+    with open(WARMUP_IMAGE, 'rb') as f:
+        return f.read()
+
+def preload():
+    """
+    Load the OpenCV/Tesseract stack and the drug lexicon by reading the
+    warmup image in this process.
+
+    Meant for a pre-forking server's master process: it starts no
+    threads, worker processes or connections, and closes the OCR engines
+    it used, so every forked worker starts from a clean, warm state.
+    """
+    image_bytes = _warmup_image()
+    if image_bytes is None:
+        return
+    started = time.perf_counter()
+    result = extraction.analyze(image_bytes)
+    LLM.identify_medicine(result['text'], result['words'])
+    for psm in (extraction.PRIMARY_PSM, extraction.FALLBACK_PSM):
+        ocr_engine.get_pool(psm).close()
+    logger.info(f"Preloaded the OCR stack in {time.perf_counter() - started:.2f}s")
+
+def warmup():
+    """
+    Start this process's worker pool, stores and clients, read the
+    warmup image through the pool and mark the process ready.
+
+    Failures leave the process unready, so a broken replica never gets
+    traffic; the error is reported by /readyz.
+    """
+    global warmup_error
+    started = time.perf_counter()
+    try:
+        image_bytes = _warmup_image()
+        if image_bytes is not None:
+            if worker_pool.WORKERS > 0:
+                worker_pool.get_pool().warm(image_bytes)
+            else:
+                worker_pool.run_extract(image_bytes)
+        get_result_cache()
+        knowledge_store.get_store()
+        search.get_client()
+        llm_gateway.get_gateway()
+    except Exception as e:
+        warmup_error = str(e)
+        logger.error(f"Warmup failed: {warmup_error}")
+        return
+    ready.set()
+    logger.info(f"Ready after a {time.perf_counter() - started:.2f}s warmup")
+
+# Cache of finished results, keyed by image bytes and perceptual hash
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """
+    Return this process's result cache, opening it on first use.
+
+    Its SQLite tier is opened in the process that uses it, not at import,
+    so a server that imports the app before forking shares no connection
+    between its workers.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = cache.ResultCache(
+                maxsize=int(os.getenv('RESULT_CACHE_SIZE', 256)),
+                ttl=float(os.getenv('RESULT_CACHE_TTL', 24 * 3600)),
+                db_path=os.getenv('RESULT_CACHE_DB') or None,
+                max_distance=int(os.getenv('RESULT_CACHE_MAX_DISTANCE', 4))
+            )
+        return _result_cache
+
+# Uploaded images and their word boxes, so the annotated image can be
+# drawn on demand instead of being sent with every response. Like the
+# job store below it lives in this process's memory, so a server with
+# several workers must route a client's follow-up requests back to the
+# worker that created the image or job (see serve.py)
+annotation_store = cache.TTLCache(
+    maxsize=int(os.getenv('ANNOTATION_CACHE_SIZE', 64)),
+    ttl=float(os.getenv('RESULT_CACHE_TTL', 24 * 3600))
+)
+
+def cacheable(response_data, search_results=None):
+    """
+    Only keep complete answers: OCR text, a resolved medicine name, and an
+    answer from the knowledge store or from an LLM call that had search
+    results to go on and finished without error.
+
+    Args:
+        response_data (dict): The response to cache
+        search_results (str): Search results the LLM was given, if any
+    """
+    if not response_data.get('extracted_text', '').strip() or not response_data.get('medicine_name'):
+        return False
+    if 'knowledge' in response_data:
+        return True
+    answer = response_data.get('llm_response', '')
+    return (
+        llm_router.searched(search_results)
+        and 'llm_error' not in response_data
+        and answer.strip() != ''
+        and not answer.startswith(LLM.FAILURES)
+        and not answer.endswith(LLM.TRUNCATED_NOTE)
+    )
+
+# Response fields that answer the scan, as opposed to reading the photo
+ANSWER_KEYS = ('medicine_name', 'search_ranking', 'knowledge', 'llm_response')
+
+def near_answer(cached, medicine_name):
+    """
+    The answer cached for a similar photo, if this scan reads as the same medicine.
+
+    Packs of different medicines from one maker can be within the dHash
+    distance of each other, so a near hit is only trusted once the fresh
+    OCR resolves to the name the cached answer is about.
+
+    Args:
+        cached (dict): Entry made by `cache_entry`, or None
+        medicine_name (str): Name resolved from this scan
+
+    Returns:
+        dict: The answer fields of the entry, marked as cached, or None
+    """
+    if cached is None or not medicine_name:
+        return None
+    if search.normalize_name(cached.get('medicine_name', '')) != search.normalize_name(medicine_name):
+        logger.info(f"Near cache hit for '{cached.get('medicine_name', '')}' skipped, this scan reads '{medicine_name}'")
+        return None
+    answer = {key: cached[key] for key in ANSWER_KEYS if key in cached}
+    answer['cached'] = True
+    return answer
+
+# Background scan jobs whose stage results are streamed to the client
+job_store = jobs.JobStore()
 
 # Initialize Flask app
 app = Flask(__name__, static_folder="static", template_folder="templates")
 
+REQUEST_SECONDS = metrics.histogram('scanner_request_seconds', 'Time to build the response of each endpoint')
+REQUESTS = metrics.counter('scanner_requests', 'Requests by endpoint and status')
+
+@app.before_request
+def start_timing():
+    """Start collecting the stage timings reported in Server-Timing."""
+    if metrics.ENABLED:
+        g.started = time.perf_counter()
+        g.timing_token = metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stages this request ran in a Server-Timing header."""
+    if metrics.ENABLED and 'timing_token' in g:
+        elapsed = time.perf_counter() - g.started
+        timings = metrics.finish_request(g.pop('timing_token'))
+        timings['total'] = elapsed
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
 @app.route('/')
 def index():
     """Render the main page."""
     return render_template('index.html')
 
+def compact_boxes(words):
+    """Word boxes as [left, top, width, height, confidence] rows."""
+    return [[word['left'], word['top'], word['width'], word['height'], int(round(word['conf']))] for word in words]
+
+def ocr_payload(result, image_bytes, image_id):
+    """
+    Build the OCR part of the API response from a worker result.
+
+    The word boxes are sent as compact coordinates for the client to
+    overlay; the annotated image itself is only sent when the worker
+    drew it, and is otherwise drawn on request from `annotated_url`.
+
+    Args:
+        result (dict): Output of `worker_pool.extract`
+        image_bytes (bytes): The encoded image the result was read from
+        image_id (str): Byte digest of the image
+
+    Returns:
+        dict: 'extracted_text', 'image_size', 'boxes', 'annotated_url',
+        'preprocessing' and, if requested, 'processed_image' (base64 JPEG)
+    """
+    boxes = compact_boxes(result['words'])
+    annotation_store.set(image_id, (image_bytes, boxes))
+    payload = {
+        'extracted_text': result['text'],
+        'image_size': result['image_size'],
+        'boxes': boxes,
+        'annotated_url': f'/api/annotated/{image_id}',
+        'preprocessing': {
+            'variant': result['variant'],
+            'confidence': result['confidence'],
+            'attempts': result['attempts'],
+            'passes': result['passes'],
+            'regions': result['regions'],
+            'scale': result['scale'],
+            'tiles': result['tiles'],
+            'geometry': result['geometry'],
+            'timings': result['timings']
+        }
+    }
+    if 'annotated_jpeg' in result:
+        # Convert processed image to base64 for sending to frontend
+        payload['processed_image'] = base64.b64encode(result['annotated_jpeg']).decode('utf-8')
+    return payload
+
+def cache_entry(response_data, image_id):
+    """
+    The response as cached: without the annotated image and its URL, which
+    only hold for the upload they were drawn from, but with its digest.
+    """
+    entry = {key: value for key, value in response_data.items() if key not in ('processed_image', 'annotated_url')}
+    entry['_image_id'] = image_id
+    return entry
+
+def exact_hit(cached, image_id):
+    """Whether a result cache entry was made from these very image bytes."""
+    return cached is not None and cached.get('_image_id') == image_id
+
+def replay_entry(cached, image_bytes, image_id):
+    """
+    The response for an upload answered from an exact result cache hit.
+
+    The cached boxes are this upload's, so the upload is stored again for
+    `annotated_url`: the annotation store keeps far fewer images than the
+    cache keeps results, and none across restarts.
+
+    Args:
+        cached (dict): Entry made by `cache_entry`
+        image_bytes (bytes): The encoded image just uploaded
+        image_id (str): Its byte digest
+
+    Returns:
+        dict: The response, marked as cached
+    """
+    response = {key: value for key, value in cached.items() if key != '_image_id'}
+    if 'boxes' in response:
+        annotation_store.set(image_id, (image_bytes, response['boxes']))
+        response['annotated_url'] = f'/api/annotated/{image_id}'
+    response['cached'] = True
+    return response
+
+def knowledge_payload(record):
+    """
+    Response fields for a medicine answered from the knowledge store.
+
+    Args:
+        record (dict): Output of `KnowledgeStore.find`
+
+    Returns:
+        dict: 'medicine_name', 'llm_response' and 'knowledge' with the
+        structured sections and the age of the record
+    """
+    return {
+        'medicine_name': record['name'],
+        'llm_response': record['answer'],
+        'knowledge': {
+            'generic': record['generic'],
+            'sections': record['sections'],
+            'updated': record['updated'],
+            'fresh': record['fresh']
+        }
+    }
+
+def run_pipeline(image_bytes, image_id, phash, include_image=False, near=None):
+    """
+    Run OCR, name extraction and the LLM on an encoded image, and cache
+    the result if it is complete.
+
+    OCR runs on the worker pool; this thread only waits for it and then
+    does the I/O-bound search and LLM calls, unless the knowledge store
+    already has a record of the medicine.
+
+    Args:
+        image_bytes (bytes): Encoded image
+        image_id (str): Byte digest of the image
+        phash (int): Perceptual hash for the result cache
+        include_image (bool): Send the annotated image along as base64
+        near (dict): Result cache entry of a similar photo, answered from
+            if this one reads as the same medicine
+
+    Returns:
+        dict: Response payload for the API
+    """
+    # Process the image
+    result = worker_pool.run_extract(image_bytes, annotate=include_image)
+    response_data = dict(success=True, **ocr_payload(result, image_bytes, image_id))
+    extracted_text = response_data['extracted_text']
+    
+    # Extract medicine name
+    response_data.update(LLM.identify_medicine(result['text'], result['words']))
+    answer = near_answer(near, response_data['medicine_name'])
+    if answer is not None:
+        response_data.update(answer)
+        return response_data
+    
+    # Only process with LLM if text was extracted
+    record, search_results = None, None
+    if extracted_text.strip():
+        record = knowledge_store.get_store().find(response_data['medicine_name'], extracted_text)
+    if record is not None:
+        response_data.update(knowledge_payload(record))
+    elif extracted_text.strip():
+        # Search the likeliest names at once and keep the best matching one
+        searched = search.search_candidates(response_data['medicine_candidates'], extracted_text)
+        if searched['medicine_name']:
+            response_data['medicine_name'] = searched['medicine_name']
+        response_data['search_ranking'] = searched['ranking']
+        search_results = searched['search_results']
+        
+        # Generate medicine information using LLM
+        llm_response = LLM.query_llm(extracted_text, response_data['medicine_name'], search_results,
+                                     candidates=response_data['medicine_candidates'], words=result['words'])
+        response_data['llm_response'] = llm_response
+    
+    if cacheable(response_data, search_results):
+        get_result_cache().set(image_id, phash, cache_entry(response_data, image_id))
+    return response_data
+
+def image_keys(image_bytes):
+    """
+    Compute the result cache keys of an encoded image.
+
+    Args:
+        image_bytes (bytes): Encoded image exactly as received
+
+    Returns:
+        tuple: (byte digest, perceptual hash), or None if the bytes are not an image
+    """
+    # A reduced grayscale decode is enough for the perceptual hash and far
+    # cheaper than a full decode; the worker decodes the full image
+    thumbnail = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if thumbnail is None:
+        return None
+    return cache.image_digest(image_bytes), cache.dhash(thumbnail)
+
+def process_bytes(image_bytes, include_image=False):
+    """
+    Answer from the cache or run the full pipeline on image bytes.
+
+    Args:
+        image_bytes (bytes): Encoded image exactly as received
+        include_image (bool): Send the annotated image along as base64
+
+    Returns:
+        tuple: (response payload, HTTP status)
+    """
+    keys = image_keys(image_bytes)
+    if keys is None:
+        return {'error': 'Could not decode image'}, 400
+    
+    # Answer straight from the cache for repeated images; a near-identical
+    # one still has to be read to know it shows the same medicine
+    digest, phash = keys
+    cached = get_result_cache().get(digest, phash)
+    if exact_hit(cached, digest):
+        return replay_entry(cached, image_bytes, digest), 200
+    
+    return run_pipeline(image_bytes, digest, phash, include_image, near=cached), 200
+
+def run_job(job, ocr_future, image_bytes, digest, phash, near=None):
+    """
+    Drive a scan job through its stages, publishing each result as it lands.
+
+    Events, in order: 'ocr', 'name', 'search', one 'llm_token' per chunk
+    of the streamed completion, 'llm_error' if the completion failed
+    part way, 'llm' and finally 'done' with the full response. Stages that
+    do not apply (no text, no name) are skipped.
+
+    Args:
+        job (jobs.Job): The job to publish to
+        ocr_future (concurrent.futures.Future): Admitted OCR job
+        image_bytes (bytes): The encoded image being read
+        digest (str): Byte digest for the result cache
+        phash (int): Perceptual hash for the result cache
+        near (dict): Result cache entry of a similar photo, see `answer_job`
+    """
+    try:
+        result = worker_pool.wait_extract(ocr_future)
+    except worker_pool.JobTimeout as e:
+        job.finish('error', {'error': str(e)})
+        return
+    answer_job(job, result, image_bytes, digest, phash, near=near)
+
+def answer_job(job, result, image_bytes, digest, phash, identified=None, near=None):
+    """
+    Publish an OCR result, then run the name, search and LLM stages of a job.
+
+    Args:
+        job (jobs.Job): The job to publish to
+        result (dict): Output of `worker_pool.extract`
+        image_bytes (bytes): The encoded image that was read
+        digest (str): Byte digest for the result cache
+        phash (int): Perceptual hash for the result cache
+        identified (dict): Name already resolved by the caller, in the
+            form of `LLM.identify_medicine`; resolved from `result` if None
+        near (dict): Result cache entry of a similar photo, answered from
+            if this one reads as the same medicine
+    """
+    payload = ocr_payload(result, image_bytes, digest)
+    job.result.update(success=True, **payload)
+    job.publish('ocr', payload)
+    extracted_text = payload['extracted_text']
+    
+    if identified is None:
+        identified = LLM.identify_medicine(result['text'], result['words'])
+    medicine_name = identified['medicine_name']
+    job.result.update(identified)
+    job.publish('name', identified)
+    
+    answer = near_answer(near, medicine_name)
+    if answer is not None:
+        job.result.update(answer)
+        job.publish('llm', {'llm_response': answer.get('llm_response', '')})
+        job.finish('done', job.result)
+        return
+    
+    record, search_results = None, None
+    if extracted_text.strip():
+        record = knowledge_store.get_store().find(medicine_name, extracted_text)
+    if record is not None:
+        # Known medicine: answer from its stored record, no search or LLM
+        answer = knowledge_payload(record)
+        job.result.update(answer)
+        job.publish('search', {'medicine_name': answer['medicine_name'], 'knowledge': answer['knowledge']})
+        job.publish('llm', {'llm_response': answer['llm_response']})
+    elif extracted_text.strip():
+        if medicine_name:
+            searched = search.search_candidates(identified['medicine_candidates'], extracted_text)
+            medicine_name = searched['medicine_name'] or medicine_name
+            search_results = searched['search_results'] or search.search_medicine_info(medicine_name)
+            job.result.update(medicine_name=medicine_name, search_ranking=searched['ranking'])
+            job.publish('search', {
+                'medicine_name': medicine_name,
+                'search_results': search_results,
+                'search_ranking': searched['ranking']
+            })
+        
+        chunks = []
+        try:
+            for token in LLM.stream_llm(extracted_text, medicine_name, search_results,
+                                        candidates=identified['medicine_candidates'], words=result['words']):
+                chunks.append(token)
+                job.publish('llm_token', {'token': token})
+        except LLM.AnswerInterrupted as e:
+            # The tokens sent so far are a partial answer, marked as such
+            job.result['llm_error'] = str(e)
+            job.publish('llm_error', {'error': str(e)})
+        job.result['llm_response'] = ''.join(chunks)
+        job.publish('llm', {'llm_response': job.result['llm_response']})
+    
+    if cacheable(job.result, search_results):
+        get_result_cache().set(digest, phash, cache_entry(job.result, digest))
+    job.finish('done', job.result)
+
+def replay_job(job, cached):
+    """Publish a result from `replay_entry` as if its stages had just run."""
+    job.result.update(cached)
+    ocr_keys = ('extracted_text', 'image_size', 'boxes', 'annotated_url', 'processed_image', 'preprocessing')
+    job.publish('ocr', {key: cached[key] for key in ocr_keys if key in cached})
+    job.publish('name', {key: cached.get(key, default) for key, default in (('medicine_name', ''), ('medicine_candidates', []))})
+    if 'llm_response' in cached:
+        job.publish('llm', {'llm_response': cached['llm_response']})
+    job.finish('done', job.result)
+
+def request_image_bytes():
+    """
+    Read the image from a raw binary body, a multipart upload or a JSON data URL.
+
+    Returns:
+        bytes: The encoded image, or None if the request has none
+    """
+    if request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+        return request.get_data() or None
+    file = request.files.get('image')
+    if file is not None and file.filename != '':
+        return file.read()
+    data = request.get_json(silent=True) or {}
+    if data.get('image'):
+        # Remove data URL prefix
+        return base64.b64decode(data['image'].split(',')[-1])
+    return None
+
+def include_image_requested():
+    """Whether the client asked for the annotated image inline (?include_image=1)."""
+    return request.args.get('include_image') == '1'
+
+def busy_response(error):
+    """Build the 503 returned when the OCR workers are saturated."""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 @app.route('/api/process', methods=['POST'])
 def process_image():
-    """Process uploaded image and return the results."""
+    """Process an uploaded image (multipart or raw binary body) and return the results."""
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image provided'}), 400
-            
-        # Get the uploaded file
-        file = request.files['image']
-        
-        if file.filename == '':
+        if 'image' in request.files and request.files['image'].filename == '':
             return jsonify({'error': 'No selected file'}), 400
-            
-        # Create a temporary file to save the uploaded image
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp:
-            temp_path = temp.name
-            file.save(temp_path)
-            
-        # Process the image
-        processed_image, extracted_text = extraction.extract_text(temp_path)
         
-        # Convert images to base64 for sending to frontend
-        _, img_encoded = cv2.imencode('.jpg', processed_image)
-        processed_image_b64 = base64.b64encode(img_encoded).decode('utf-8')
-        
-        # Extract medicine name
-        medicine_name = LLM.extract_medicine_name(extracted_text)
-        
-        response_data = {
-            'success': True,
-            'extracted_text': extracted_text,
-            'processed_image': processed_image_b64,
-            'medicine_name': medicine_name
-        }
-        
-        # Only process with LLM if text was extracted
-        if extracted_text.strip():
-            # Generate medicine information using LLM
-            llm_response = LLM.query_llm(extracted_text)
-            response_data['llm_response'] = llm_response
-        
-        # Clean up the temporary file
-        os.unlink(temp_path)
+        image_bytes = request_image_bytes()
+        if not image_bytes:
+            return jsonify({'error': 'No image provided'}), 400
         
-        return jsonify(response_data)
+        response_data, status = process_bytes(image_bytes, include_image_requested())
+        return jsonify(response_data), status
         
+    except worker_pool.PoolSaturated as e:
+        return busy_response(e)
+    except worker_pool.JobTimeout as e:
+        logger.error(f"Error processing image: {str(e)}")
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 @app.route('/api/process_camera', methods=['POST'])
 def process_camera_image():
-    """Process image from camera and return the results."""
+    """Process a camera frame (raw binary body or JSON data URL) and return the results."""
     try:
-        # Get base64 image from request
-        data = request.json
-        if 'image' not in data:
+        image_bytes = request_image_bytes()
+        if not image_bytes:
             return jsonify({'error': 'No image provided'}), 400
-            
-        # Decode base64 image
-        image_data = data['image'].split(',')[1]  # Remove data URL prefix
-        image_bytes = base64.b64decode(image_data)
-        
-        # Convert to numpy array
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
         
-        # Save to temporary file
-        temp_path = "temp_camera.jpg"
-        cv2.imwrite(temp_path, img)
+        response_data, status = process_bytes(image_bytes, include_image_requested())
+        return jsonify(response_data), status
         
-        # Process the image
-        processed_image, extracted_text = extraction.extract_text(temp_path)
+    except worker_pool.PoolSaturated as e:
+        return busy_response(e)
+    except worker_pool.JobTimeout as e:
+        logger.error(f"Error processing camera image: {str(e)}")
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        logger.error(f"Error processing camera image: {str(e)}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Start a scan job and return its id straight away."""
+    try:
+        image_bytes = request_image_bytes()
+        if not image_bytes:
+            return jsonify({'error': 'No image provided'}), 400
         
-        # Convert processed image to base64
-        _, img_encoded = cv2.imencode('.jpg', processed_image)
-        processed_image_b64 = base64.b64encode(img_encoded).decode('utf-8')
+        keys = image_keys(image_bytes)
+        if keys is None:
+            return jsonify({'error': 'Could not decode image'}), 400
+        digest, phash = keys
         
-        # Extract medicine name
-        medicine_name = LLM.extract_medicine_name(extracted_text)
+        cached = get_result_cache().get(digest, phash)
+        if exact_hit(cached, digest):
+            job = job_store.start(replay_job, replay_entry(cached, image_bytes, digest))
+        else:
+            # Admit the OCR work now so a saturated pool is reported immediately
+            ocr_future = worker_pool.submit_extract(image_bytes, annotate=include_image_requested())
+            job = job_store.start(run_job, ocr_future, image_bytes, digest, phash, near=cached)
         
-        response_data = {
-            'success': True,
-            'extracted_text': extracted_text,
-            'processed_image': processed_image_b64,
-            'medicine_name': medicine_name
-        }
+        return jsonify({
+            'job_id': job.id,
+            'events_url': url_for('job_events', job_id=job.id),
+            'status_url': url_for('job_status', job_id=job.id)
+        }), 202
         
-        # Only process with LLM if text was extracted
-        if extracted_text.strip():
-            # Generate medicine information using LLM
-            llm_response = LLM.query_llm(extracted_text)
-            response_data['llm_response'] = llm_response
+    except worker_pool.PoolSaturated as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return the state of a job and the results collected so far."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's stage results as Server-Sent Events."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    # Resume after the last event the client saw when it reconnects
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    start = int(last_id) + 1 if last_id and last_id.isdigit() else 0
+    
+    response = Response(stream_with_context(job.stream(start)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/annotated/<image_id>', methods=['GET'])
+def annotated_image(image_id):
+    """Draw the word boxes on a recently scanned image and return it as JPEG."""
+    entry = annotation_store.get(image_id)
+    if entry is None:
+        return jsonify({'error': 'Unknown or expired image'}), 404
+    image_bytes, boxes = entry
+    
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    words = [{'left': x, 'top': y, 'width': w, 'height': h, 'conf': conf} for x, y, w, h, conf in boxes]
+    _, annotated = cv2.imencode('.jpg', extraction.draw_boxes({'image': image, 'words': words}),
+                                [cv2.IMWRITE_JPEG_QUALITY, 85])
+    
+    response = Response(annotated.tobytes(), mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+def live_resolved(session):
+    """Answer a resolved live scan with a regular job the page can follow."""
+    result, frame_bytes = session.best
+    digest, phash = image_keys(frame_bytes)
+    job = job_store.start(answer_job, result, frame_bytes, digest, phash, session.identified())
+    return {'job_id': job.id, 'events_url': url_for('job_events', job_id=job.id)}
+
+if Sock is not None:
+    sock = Sock(app)
+    
+    @sock.route('/api/live')
+    def live_scan_socket(ws):
+        """Continuous scan: frames stream in until a medicine name resolves."""
+        live_scan.serve(ws, on_resolved=live_resolved)
+else:
+    logger.info("flask-sock is not installed, live scanning is disabled")
+
+@app.route('/api/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Process many images, or zip archives of images, in one request.
+
+    Search and the LLM run once per unique medicine across the batch.
+    Clients that accept text/event-stream get per-image and per-medicine
+    progress as Server-Sent Events; others get the final summary as JSON.
+    """
+    try:
+        files = [f for f in request.files.getlist('images') + request.files.getlist('image') if f.filename]
+        if not files:
+            return jsonify({'error': 'No images provided'}), 400
+        include_images = request.args.get('include_images') == '1'
         
-        # Clean up
-        os.remove(temp_path)
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            events = batch.run_batch(batch.iter_uploads(batch.spool_uploads(files)), include_images=include_images)
+            
+            def stream():
+                try:
+                    for index, (event, data) in enumerate(events):
+                        yield jobs.format_event(index, event, data)
+                except Exception as e:
+                    logger.error(f"Error processing batch: {str(e)}")
+                    yield jobs.format_event(-1, 'error', {'error': f'An error occurred: {str(e)}'})
+            
+            response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
         
-        return jsonify(response_data)
+        for event, data in batch.run_batch(batch.iter_uploads(files), include_images=include_images):
+            if event == 'done':
+                return jsonify(data)
         
     except Exception as e:
-        logger.error(f"Error processing camera image: {str(e)}")
+        logger.error(f"Error processing batch: {str(e)}")
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the process has warmed up and can take scans."""
+    body = {
+        'ready': ready.is_set(),
+        'missing_keys': [key for key in required_keys if not os.getenv(key)],
+        'ocr_backend': ocr_engine.backend()
+    }
+    if warmup_error is not None:
+        body['error'] = warmup_error
+    if worker_pool.WORKERS > 0 and ready.is_set():
+        body['ocr'] = worker_pool.get_pool().stats()
+    return jsonify(body), 200 if body['ready'] else 503
+
+@app.route('/api/knowledge', methods=['GET'])
+def knowledge_lookup():
+    """Look up stored medicine records by name (?name=) or by full text (?q=)."""
+    store = knowledge_store.get_store()
+    name = request.args.get('name', '').strip()
+    query = request.args.get('q', '').strip()
+    if name:
+        record = store.get(name)
+        records = [record] if record is not None else []
+    elif query:
+        limit = request.args.get('limit', '10').strip()
+        if not limit.isdigit() or int(limit) < 1:
+            return jsonify({'error': 'limit must be a positive whole number'}), 400
+        records = store.search(query, limit=min(int(limit), 50))
+    else:
+        return jsonify({'error': 'Pass a name or a q parameter'}), 400
+    return jsonify({'records': [{key: value for key, value in record.items() if key != 'label_text'} for record in records]})
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """Return hit/miss counters of the result and search caches, LLM routing, prompt sizes and the knowledge store."""
+    return jsonify({
+        'results': get_result_cache().stats(),
+        'search': search.get_client().stats(),
+        'llm': llm_gateway.get_gateway().stats(),
+        'routing': llm_router.get_router().stats(),
+        'prompt': prompt_context.stats(),
+        'knowledge': knowledge_store.get_store().stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose stage histograms, request counters and cache statistics to Prometheus."""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    
+    search_stats = search.get_client().stats()
+    caches = (('results', get_result_cache().stats()), ('search', search_stats))
+    for name, stats in caches:
+        for key in ('hits', 'misses'):
+            metrics.counter(f'scanner_cache_{key}', f'Cache {key}').set(stats[key], cache=name)
+        metrics.gauge('scanner_cache_hit_ratio', 'Share of cache lookups that hit').set(stats['hit_ratio'], cache=name)
+        metrics.gauge('scanner_cache_size', 'Entries held in the in-memory cache').set(stats['size'], cache=name)
+    
+    metrics.counter('scanner_search_api_calls', 'Custom Search API calls made').set(search_stats['api_calls'])
+    metrics.counter('scanner_search_coalesced', 'Searches that shared an in-flight API call').set(search_stats['coalesced'])
+    
+    llm_stats = llm_gateway.get_gateway().stats()
+    for key in ('calls', 'coalesced', 'retried', 'hedged', 'errors'):
+        metrics.counter(f'scanner_llm_{key}', f'LLM completions {key}').set(llm_stats[key])
+    
+    knowledge_stats = knowledge_store.get_store().stats()
+    for key in ('hits', 'stale_served', 'misses', 'refreshed', 'refresh_failures'):
+        metrics.counter(f'scanner_knowledge_{key}', f'Knowledge store lookups and refreshes: {key}').set(knowledge_stats[key])
+    metrics.gauge('scanner_knowledge_records', 'Medicine records in the knowledge store').set(knowledge_stats['records'])
+    
+    if worker_pool.WORKERS > 0:
+        pool_stats = worker_pool.get_pool().stats()
+        metrics.gauge('scanner_ocr_in_flight', 'OCR jobs admitted and not finished').set(pool_stats['in_flight'])
+        metrics.counter('scanner_ocr_rejected', 'OCR jobs refused because the pool was full').set(pool_stats['rejected'])
+        metrics.counter('scanner_ocr_timeouts', 'OCR jobs that missed their deadline').set(pool_stats['timeouts'])
+    
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/worker_stats', methods=['GET'])
+def worker_stats():
+    """Return load counters of the OCR worker pool."""
+    if worker_pool.WORKERS <= 0:
+        return jsonify({'workers': 0})
+    return jsonify(worker_pool.get_pool().stats())
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    check_config()
+    threading.Thread(target=warmup, daemon=True, name='warmup').start()
+    # The reloader would start a second copy of the worker pool
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False, port=5000, threaded=True)
 
     
\ No newline at end of file
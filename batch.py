@@ -0,0 +1,235 @@
+import os
+import time
+import base64
+import contextlib
+import shutil
+import tempfile
+import zipfile
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from werkzeug.datastructures import FileStorage
+import knowledge_store
+import LLM
+import search
+import worker_pool
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+ZIP_MIMETYPES = ('application/zip', 'application/x-zip-compressed')
+
+# Limits on what one batch may contain
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 200))
+BATCH_MAX_IMAGE_BYTES = int(os.getenv('BATCH_MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+
+# Concurrent search + LLM calls for the unique medicines of a batch
+BATCH_LLM_THREADS = int(os.getenv('BATCH_LLM_THREADS', 4))
+
+
+def is_zip(filename, mimetype=None):
+    return (filename or '').lower().endswith('.zip') or mimetype in ZIP_MIMETYPES
+
+
+def spool_uploads(files):
+    """
+    Copy uploads into temporary files owned by the caller.
+
+    Flask closes a request's uploads when the view returns, before a
+    streamed response body runs, so a streaming view hands the batch
+    these copies instead. Small uploads stay in memory.
+
+    Args:
+        files (list): werkzeug FileStorage objects from the request
+
+    Returns:
+        list: FileStorage objects backed by the copies
+    """
+    spooled = []
+    for file in files:
+        stream = tempfile.SpooledTemporaryFile(max_size=BATCH_MAX_IMAGE_BYTES)
+        shutil.copyfileobj(file.stream, stream)
+        stream.seek(0)
+        spooled.append(FileStorage(stream=stream, filename=file.filename, content_type=file.content_type))
+    return spooled
+
+
+def iter_uploads(files):
+    """
+    Yield the images of a batch one at a time.
+
+    Zip archives are read member by member, so only one image is held in
+    memory at a time however large the archive is.
+
+    Args:
+        files (list): werkzeug FileStorage objects, images or zip archives
+
+    Yields:
+        tuple: (filename, image bytes); bytes is None for skipped entries
+    """
+    count = 0
+    for file in files:
+        with contextlib.closing(file):
+            if is_zip(file.filename, file.mimetype):
+                with zipfile.ZipFile(file.stream) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                            continue
+                        count += 1
+                        if count > BATCH_MAX_IMAGES:
+                            return
+                        if info.file_size > BATCH_MAX_IMAGE_BYTES:
+                            yield info.filename, None
+                            continue
+                        yield info.filename, archive.read(info)
+            else:
+                count += 1
+                if count > BATCH_MAX_IMAGES:
+                    return
+                yield file.filename, file.read(BATCH_MAX_IMAGE_BYTES + 1)
+
+
+def _submit(image_bytes, pending, annotate=False):
+    """
+    Admit an OCR job, or wait for room when other requests fill the pool.
+
+    Returns:
+        concurrent.futures.Future: The job's future, or None if the pool was
+        full and the caller should collect finished jobs and try again
+    """
+    try:
+        return worker_pool.submit_extract(image_bytes, annotate)
+    except worker_pool.PoolSaturated as e:
+        if pending:
+            wait(pending, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(min(1.0, e.retry_after))
+        return None
+
+
+def _item_result(item, result, include_images):
+    identified = LLM.identify_medicine(result['text'], result['words'])
+    item.update(
+        success=True,
+        extracted_text=result['text'],
+        preprocessing={'variant': result['variant'], 'confidence': result['confidence'],
+                       'geometry': result['geometry']},
+        **identified
+    )
+    if include_images:
+        item['processed_image'] = base64.b64encode(result['annotated_jpeg']).decode('utf-8')
+    item['_confidence'] = result['confidence']
+    item['_words'] = result['words']
+
+
+def run_batch(uploads, include_images=False):
+    """
+    Process a batch of images, deduplicating search and LLM work by medicine.
+
+    OCR runs on the worker pool with at most one of this batch's images
+    per worker in flight, so images are pulled from `uploads` only as
+    workers free up and the pool's queue stays free for interactive scans.
+    Once every image is read, search and the LLM run once per unique
+    resolved medicine.
+
+    Args:
+        uploads (iterable): (filename, image bytes) pairs, see `iter_uploads`
+        include_images (bool): Return the annotated image for every item
+
+    Yields:
+        tuple: (event, data) progress events: 'item' when an image has been
+        read, 'medicine' when a medicine's answer is ready, and a final
+        'done' with 'items' (per image) and 'summary' (per medicine)
+    """
+    items = []
+    pending = {}
+    if worker_pool.WORKERS > 0:
+        # Keeping the workers busy is enough; queueing more would only take
+        # admission slots from interactive requests, which then get a 503
+        window = worker_pool.get_pool().workers
+    else:
+        window = 1
+
+    def collect(futures):
+        for future in futures:
+            item = items[pending.pop(future)]
+            try:
+                _item_result(item, worker_pool.wait_extract(future), include_images)
+            except Exception as e:
+                item.update(success=False, error=f'An error occurred: {str(e)}')
+            yield 'item', {key: value for key, value in item.items() if not key.startswith('_')}
+
+    for filename, image_bytes in uploads:
+        item = {'index': len(items), 'filename': filename}
+        items.append(item)
+        if image_bytes is None or len(image_bytes) > BATCH_MAX_IMAGE_BYTES:
+            item.update(success=False, error='Image is too large')
+            yield 'item', dict(item)
+            continue
+
+        while len(pending) >= window:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from collect(done)
+
+        future = _submit(image_bytes, pending, include_images)
+        while future is None:
+            yield from collect([f for f in pending if f.done()])
+            future = _submit(image_bytes, pending, include_images)
+        pending[future] = item['index']
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        yield from collect(done)
+
+    # Group the images by resolved medicine
+    groups = {}
+    for item in items:
+        if item.get('success') and item.get('medicine_name'):
+            key = search.normalize_name(item['medicine_name'])
+            groups.setdefault(key, []).append(item)
+
+    def answer(group):
+        # The most confidently read image gives the LLM the best label text
+        best = max(group, key=lambda item: item['_confidence'])
+        medicine_name = best['medicine_name']
+        generic = best['medicine_candidates'][0]['generic'] if best['medicine_candidates'] else []
+        images = [item['index'] for item in group]
+        record = knowledge_store.get_store().find(medicine_name, best['extracted_text'])
+        if record is not None:
+            return {'medicine_name': record['name'], 'generic': record['generic'], 'images': images,
+                    'llm_response': record['answer']}
+        search_results = search.search_medicine_info(medicine_name)
+        return {
+            'medicine_name': medicine_name,
+            'generic': generic,
+            'images': images,
+            'llm_response': LLM.query_llm(best['extracted_text'], medicine_name, search_results,
+                                          candidates=best['medicine_candidates'], words=best['_words']),
+        }
+
+    medicines = []
+    if groups:
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_LLM_THREADS, len(groups)))) as executor:
+            futures = [executor.submit(answer, group) for group in groups.values()]
+            for future in as_completed(futures):
+                medicine = future.result()
+                medicines.append(medicine)
+                yield 'medicine', medicine
+
+    for item in items:
+        item.pop('_confidence', None)
+        item.pop('_words', None)
+    medicines.sort(key=lambda medicine: medicine['images'][0])
+    yield 'done', {
+        'success': True,
+        'items': items,
+        'summary': {
+            'images': len(items),
+            'succeeded': sum(1 for item in items if item.get('success')),
+            'failed': sum(1 for item in items if not item.get('success')),
+            'unresolved': sum(1 for item in items if item.get('success') and not item.get('medicine_name')),
+            'unique_medicines': len(medicines),
+            'medicines': medicines,
+        },
+    }
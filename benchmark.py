@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from stubs import StubServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ('extract_text', 'extract_medicine_name', 'search_medicine_info', 'query_llm')
+
+SEED_IMAGES = ('cap_img.jpg', 'captured_image.jpg')
+
+# Differences smaller than this are noise, whatever the relative change
+MIN_REGRESSION_MS = 5.0
+
+
+def _rotate(image, angle):
+    h, w = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def _motion_blur(image, length):
+    kernel = np.zeros((length, length), np.float32)
+    kernel[length // 2, :] = 1.0 / length
+    return cv2.filter2D(image, -1, kernel)
+
+
+def _high_res(image, long_side):
+    scale = long_side / float(max(image.shape[:2]))
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+
+VARIANTS = {
+    'original': lambda image: image,
+    'rotated_7': lambda image: _rotate(image, 7),
+    'rotated_90': lambda image: cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE),
+    'gaussian_blur': lambda image: cv2.GaussianBlur(image, (0, 0), 2.0),
+    'motion_blur': lambda image: _motion_blur(image, 9),
+    'high_res': lambda image: _high_res(image, 4000),
+}
+
+
+def build_corpus(paths=SEED_IMAGES, extra_dir=None):
+    """
+    Build the benchmark corpus from the seed label images.
+
+    Every seed image is used as is and in each synthetic variant; images
+    found in `extra_dir` are added unchanged. The variants are
+    deterministic, so the corpus is identical between runs.
+
+    Args:
+        paths (tuple): Seed image files
+        extra_dir (str): Directory of additional label images, or None
+
+    Returns:
+        list: (name, JPEG bytes) pairs
+    """
+    corpus = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            logger.warning(f"Skipping unreadable seed image {path}")
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for variant, transform in VARIANTS.items():
+            _, encoded = cv2.imencode('.jpg', transform(image), [cv2.IMWRITE_JPEG_QUALITY, 92])
+            corpus.append((f"{stem}:{variant}", encoded.tobytes()))
+
+    if extra_dir:
+        for filename in sorted(os.listdir(extra_dir)):
+            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp')):
+                with open(os.path.join(extra_dir, filename), 'rb') as f:
+                    corpus.append((filename, f.read()))
+    return corpus
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds."""
+    values = np.array(samples) * 1000.0
+    return {
+        'count': len(values),
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+def run_pipeline(image_bytes):
+    """
+    Run the four scan stages on one image.
+
+    Returns:
+        tuple: (seconds spent in each stage plus 'total', OCR passes)
+    """
+    import extraction
+    import LLM
+    import search
+
+    timings = {}
+    started = time.perf_counter()
+
+    # What extract_text does, keeping the result to count its OCR passes
+    mark = time.perf_counter()
+    result = extraction.analyze(image_bytes)
+    extraction.draw_boxes(result)
+    text = result['text']
+    timings['extract_text'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    medicine_name = LLM.extract_medicine_name(text)
+    timings['extract_medicine_name'] = time.perf_counter() - mark
+
+    # The remaining stages only run for labels that resolve to a name,
+    # as in the app
+    if medicine_name:
+        mark = time.perf_counter()
+        search_results = search.search_medicine_info(medicine_name)
+        timings['search_medicine_info'] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        LLM.query_llm(text, medicine_name, search_results)
+        timings['query_llm'] = time.perf_counter() - mark
+
+    timings['total'] = time.perf_counter() - started
+    return timings, result['passes']
+
+
+def run_benchmark(corpus, iterations=3, warmup=1, concurrency=1, warm_cache=False):
+    """
+    Time every stage over the corpus.
+
+    Args:
+        corpus (list): Output of `build_corpus`
+        iterations (int): Timed passes over the corpus
+        warmup (int): Untimed passes run first to load engines and clients
+        concurrency (int): Images processed at once
+        warm_cache (bool): Keep the search and answer caches between images;
+            by default they are cleared so every image pays for the full pipeline
+
+    Returns:
+        dict: Per stage latency summaries, pipeline latency, throughput,
+        OCR passes per image and peak RSS
+    """
+    import knowledge_store
+    import search
+
+    def run(item):
+        if not warm_cache:
+            search.get_client().memory.clear()
+            knowledge_store.get_store().clear()
+        return run_pipeline(item[1])
+
+    for _ in range(warmup):
+        for item in corpus:
+            run(item)
+
+    samples = {stage: [] for stage in STAGES + ('total',)}
+    passes = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for (name, _), (timings, ocr_passes) in zip(corpus * iterations, executor.map(run, corpus * iterations)):
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            passes[name] = ocr_passes
+    elapsed = time.perf_counter() - started
+
+    return {
+        'stages': {stage: summarize(samples[stage]) for stage in STAGES if samples[stage]},
+        'pipeline': summarize(samples['total']),
+        'throughput': round(len(samples['total']) / elapsed, 3),
+        'ocr_passes': {
+            'mean': round(float(np.mean(list(passes.values()))), 2),
+            'max': max(passes.values()),
+            'per_image': passes,
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Find regressions of a report against a baseline.
+
+    A latency regresses when its p50 or p95 grows by more than `threshold`
+    (a fraction) and by at least MIN_REGRESSION_MS; throughput, OCR
+    passes per image and peak RSS regress when they get worse by more
+    than `threshold`.
+
+    Returns:
+        list: Human readable descriptions of every regression
+    """
+    regressions = []
+    sections = dict(report['stages'], pipeline=report['pipeline'])
+    base_sections = dict(baseline['stages'], pipeline=baseline['pipeline'])
+    for name, current in sections.items():
+        base = base_sections.get(name)
+        if base is None:
+            continue
+        for key in ('p50', 'p95'):
+            if current[key] > base[key] * (1 + threshold) and current[key] - base[key] >= MIN_REGRESSION_MS:
+                regressions.append(f"{name} {key}: {base[key]:.1f} ms -> {current[key]:.1f} ms")
+
+    if 'ocr_passes' in report and 'ocr_passes' in baseline:
+        if report['ocr_passes']['mean'] > baseline['ocr_passes']['mean'] * (1 + threshold):
+            regressions.append(f"OCR passes per image: {baseline['ocr_passes']['mean']:.2f} -> "
+                               f"{report['ocr_passes']['mean']:.2f}")
+
+    if report['throughput'] < baseline['throughput'] * (1 - threshold):
+        regressions.append(f"throughput: {baseline['throughput']:.2f} -> {report['throughput']:.2f} images/s")
+
+    if report.get('peak_rss_mb') and baseline.get('peak_rss_mb'):
+        if report['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"peak RSS: {baseline['peak_rss_mb']:.0f} MiB -> {report['peak_rss_mb']:.0f} MiB")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'stage':<24}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for name, row in list(report['stages'].items()) + [('pipeline', report['pipeline'])]:
+        print(f"{name:<24}{row['count']:>6}{row['p50']:>11.1f}{row['p95']:>11.1f}{row['p99']:>11.1f}{row['max']:>11.1f}")
+    print(f"throughput: {report['throughput']:.2f} images/s")
+    print(f"OCR passes per image: mean {report['ocr_passes']['mean']:.2f}, max {report['ocr_passes']['max']}")
+    if 'meta' in report:
+        print(f"OCR engine: {report['meta']['ocr_engine']}")
+    if report['peak_rss_mb'] is not None:
+        print(f"peak RSS: {report['peak_rss_mb']:.0f} MiB")
+    print(f"stub API calls: {report['api_requests']}")
+    prompt = report.get('prompt')
+    if prompt and prompt['prompts']:
+        print(f"prompt tokens: {prompt['mean_tokens_before']:.0f} -> {prompt['mean_tokens_after']:.0f} "
+              f"(saved {prompt['saved_ratio']:.0%}), max_tokens {prompt['mean_max_tokens']:.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the medicine scan pipeline against local API stubs.")
+    parser.add_argument('--iterations', type=int, default=3, help="timed passes over the corpus")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed passes run first")
+    parser.add_argument('--concurrency', type=int, default=1, help="images processed at once")
+    parser.add_argument('--corpus', help="directory of extra label images to include")
+    parser.add_argument('--warm-cache', action='store_true', help="keep the search and answer caches between images")
+    parser.add_argument('--groq-latency', type=float, default=0.8, help="stub chat completion latency in seconds")
+    parser.add_argument('--search-latency', type=float, default=0.25, help="stub search latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.1, help="stub latency spread as a fraction")
+    parser.add_argument('--output', help="write the report to this JSON file")
+    parser.add_argument('--save-baseline', help="write the report as the new baseline")
+    parser.add_argument('--baseline', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="allowed relative regression before failing (default 0.15)")
+    args = parser.parse_args(argv)
+
+    stub = StubServer(groq_latency=args.groq_latency, search_latency=args.search_latency, jitter=args.jitter).start()
+    # Must happen before the pipeline modules read their configuration
+    stub.configure_env()
+    os.environ.setdefault('SEARCH_RATE', '1000')
+    # Keep benchmark answers out of the real knowledge store
+    os.environ.setdefault('KNOWLEDGE_DB', ':memory:')
+    os.environ.setdefault('KNOWLEDGE_REFRESH', '0')
+
+    import ocr_engine
+    import prompt_context
+
+    corpus = build_corpus(extra_dir=args.corpus)
+    if not corpus:
+        parser.error("the benchmark corpus is empty")
+    logger.info(f"Benchmarking {len(corpus)} images x {args.iterations} iterations")
+
+    try:
+        report = run_benchmark(corpus, args.iterations, args.warmup, args.concurrency, args.warm_cache)
+    finally:
+        stub.stop()
+
+    report['api_requests'] = dict(stub.requests)
+    report['prompt'] = prompt_context.stats()
+    report['meta'] = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'ocr_engine': ocr_engine.backend(),
+        'images': len(corpus),
+        'iterations': args.iterations,
+        'concurrency': args.concurrency,
+        'warm_cache': args.warm_cache,
+        'groq_latency': args.groq_latency,
+        'search_latency': args.search_latency,
+    }
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Wrote report to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
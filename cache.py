@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries also expire after a TTL.
+
+    Args:
+        maxsize (int): Maximum number of entries kept before the least
+            recently used one is evicted
+        ttl (float): Seconds an entry stays valid, or None to never expire
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self._data),
+        }
+
+
+class SQLiteStore:
+    """
+    Small persistent key/value store with a TTL, kept in a SQLite file.
+
+    Values are stored as JSON so anything the API returns can be cached.
+    Each table can carry an extra integer column, used by `ResultCache`
+    for the perceptual hash of the image.
+
+    Args:
+        path (str): Path of the SQLite database file
+        table (str): Table name, so several caches can share one file
+        ttl (float): Seconds an entry stays valid, or None to never expire
+    """
+
+    def __init__(self, path, table='cache', ttl=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "tag INTEGER, created REAL NOT NULL)")
+
+    def _fresh(self, created):
+        return self.ttl is None or created + self.ttl > time.time()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or not self._fresh(row[1]):
+            return default
+        return json.loads(row[0])
+
+    def get_with_age(self, key):
+        """
+        Return a stored value along with its age, ignoring the TTL.
+
+        Returns:
+            tuple: (value, age in seconds), or (None, None) if missing
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), time.time() - row[1]
+
+    def set(self, key, value, tag=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, tag, created) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), tag, time.time()))
+
+    def tags(self, limit=1000):
+        """Return (key, tag) pairs of the newest fresh entries that have a tag."""
+        oldest = time.time() - self.ttl if self.ttl else 0
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT key, tag FROM {self.table} WHERE tag IS NOT NULL AND created > ? "
+                "ORDER BY created DESC LIMIT ?", (oldest, limit)).fetchall()
+
+    def purge(self):
+        """Delete expired entries."""
+        if self.ttl is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.ttl,))
+
+
+def image_digest(data):
+    """
+    Return the SHA-256 hex digest of raw image bytes.
+
+    Args:
+        data (bytes): Encoded image bytes exactly as uploaded
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image, hash_size=8):
+    """
+    Compute the difference hash of an image.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale
+    thumbnail and each bit records whether a pixel is brighter than its
+    right neighbour, so re-encoded or slightly shifted frames of the same
+    scene end up a few bits apart.
+
+    Args:
+        image (numpy.ndarray): Grayscale or BGR image
+        hash_size (int): Side length of the hash grid
+
+    Returns:
+        int: The hash as a hash_size * hash_size bit integer
+    """
+    # Imported here so that modules needing only the caches load without OpenCV
+    import cv2
+    import numpy as np
+
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+def hamming(a, b):
+    """Return the number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class ResultCache:
+    """
+    Cache of finished scan results keyed by the uploaded image.
+
+    Lookups first try the exact byte digest and then fall back to the
+    nearest perceptual hash within `max_distance` bits, so retried uploads
+    and near-identical frames of the same box both hit. An optional SQLite
+    tier keeps results across restarts.
+
+    Args:
+        maxsize (int): Entries kept in memory
+        ttl (float): Seconds a result stays valid
+        db_path (str): SQLite file for the persistent tier, or None
+        max_distance (int): Largest dHash distance treated as the same image
+    """
+
+    def __init__(self, maxsize=256, ttl=24 * 3600, db_path=None, max_distance=4):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteStore(db_path, table='results', ttl=ttl) if db_path else None
+        self.max_distance = max_distance
+        self.hits = 0
+        self.near_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._hashes = TTLCache(maxsize=maxsize * 4, ttl=ttl)
+        self._lock = threading.Lock()
+        if self.disk is not None:
+            for key, tag in self.disk.tags(limit=maxsize * 4):
+                self._hashes.set(key, tag & ((1 << 64) - 1))
+
+    def _nearest(self, phash):
+        best_key, best_distance = None, self.max_distance + 1
+        with self._hashes._lock:
+            candidates = list(self._hashes._data.items())
+        for key, (other, _) in candidates:
+            distance = hamming(phash, other)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def _load(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+        return value
+
+    def get(self, digest, phash=None):
+        """
+        Look up a result by exact digest, then by perceptual hash.
+
+        Args:
+            digest (str): Byte digest from `image_digest`
+            phash (int): Perceptual hash from `dhash`, or None
+
+        Returns:
+            dict: The cached result, or None on a miss
+        """
+        value = self._load(digest)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        if phash is not None and self.max_distance >= 0:
+            near_key = self._nearest(phash)
+            if near_key is not None:
+                value = self._load(near_key)
+                if value is not None:
+                    with self._lock:
+                        self.hits += 1
+                        self.near_hits += 1
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, digest, phash, value):
+        """
+        Store a result under its digest and perceptual hash.
+
+        Args:
+            digest (str): Byte digest from `image_digest`
+            phash (int): Perceptual hash from `dhash`, or None
+            value (dict): JSON serializable result
+        """
+        self.memory.set(digest, value)
+        if phash is not None:
+            self._hashes.set(digest, phash)
+        if self.disk is not None:
+            try:
+                self.disk.set(digest, value, tag=_to_signed(phash) if phash is not None else None)
+            except Exception as e:
+                logger.warning(f"Could not write result cache entry to disk: {str(e)}")
+
+    def stats(self):
+        """Return hit/miss counters for all tiers."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self.memory),
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+
+    The first caller for a key runs the function; callers arriving while
+    it is in flight wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run `fn()` once for all concurrent callers of `key`.
+
+        Args:
+            key: Hashable identifier of the work
+            fn (callable): Function producing the result
+
+        Returns:
+            The result of `fn()`
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
@@ -1,90 +1,242 @@
-import pytesseract
 import cv2
 import numpy as np
-import platform
 import os
+import time
+import uuid
+import contextvars
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import geometry
+import ocr_engine
+import text_regions
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Set Tesseract path based on operating system
-if platform.system() == 'Windows':
-    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-# For macOS (Homebrew installation)
-elif platform.system() == 'Darwin':
-    if os.path.exists("/usr/local/bin/tesseract"):
-        pytesseract.pytesseract.tesseract_cmd = r"/usr/local/bin/tesseract"
-    elif os.path.exists("/opt/homebrew/bin/tesseract"):
-        pytesseract.pytesseract.tesseract_cmd = r"/opt/homebrew/bin/tesseract"
-# For Linux
-elif platform.system() == 'Linux':
-    pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"
-
-# Create temp directory if it doesn't exist
-os.makedirs("temp", exist_ok=True)
+# Intermediate images are only written to disk when debugging is enabled,
+# each call getting its own directory so concurrent requests never collide
+DEBUG_ARTIFACTS = os.getenv('EXTRACTION_DEBUG', '').lower() in ('1', 'true', 'yes')
+DEBUG_DIR = os.getenv('EXTRACTION_DEBUG_DIR', 'temp')
 
 # Configuration for OCR - optimized for medicine labels
 # PSM 6: Assume a single uniform block of text
 # PSM 3: Fully automatic page segmentation, but no OSD (use this if PSM 6 fails)
-# OEM 3: Default, based on LSTM neural network
-myconfig = r"--psm 6 --oem 3"
+PRIMARY_PSM = 6
+FALLBACK_PSM = 3
 
-def preprocess_image(image_path):
+# Preprocessing variants, tried in order from cheapest to most expensive.
+# The cascade stops at the first one whose mean word confidence reaches
+# CONFIDENCE_TARGET, or once a variant gains less than MIN_CONFIDENCE_GAIN
+# on the best so far. OCR_MAX_PASSES caps the passes per image or crop,
+# the PSM fallback and reading sideways text both ways included, so hard
+# images cost at most one pass more than reading every image once and
+# then falling back.
+CASCADE = ('otsu', 'sharp', 'adaptive', 'nlmeans_sharp')
+CONFIDENCE_TARGET = float(os.getenv('OCR_CONFIDENCE_TARGET', 75))
+MIN_CONFIDENCE_GAIN = float(os.getenv('OCR_MIN_CONFIDENCE_GAIN', 3))
+OCR_MAX_PASSES = max(2, int(os.getenv('OCR_MAX_PASSES', 3)))
+MIN_TEXT_LENGTH = 10
+
+# Noise levels (estimated sigma on the original frame) that pick the denoiser
+NOISE_NONE = 2.0
+NOISE_MEDIAN = 5.0
+NOISE_BILATERAL = 10.0
+
+# Read only the detected text regions instead of the whole upscaled frame,
+# unless they cover more than MAX_REGION_COVERAGE of it anyway
+ROI_OCR = os.getenv('ROI_OCR', '1').lower() in ('1', 'true', 'yes')
+MAX_REGION_COVERAGE = 0.6
+
+# Turn rotated labels upright and straighten tilted ones before reading,
+# so they are read in one pass instead of failing every PSM mode
+GEOMETRY_CORRECTION = os.getenv('GEOMETRY_CORRECTION', '1').lower() in ('1', 'true', 'yes')
+
+# Full frames are scaled so their median text line is TARGET_TEXT_HEIGHT
+# tall; this scale is used when no text lines can be measured
+DEFAULT_SCALE = 2.0
+
+# Most pixels one cascade may work on after scaling. The cascade keeps up
+# to eight one-byte buffers of that size, so this caps its memory at about
+# 8 bytes per pixel; larger images are read in overlapping tiles.
+OCR_MAX_PIXELS = int(os.getenv('OCR_MAX_PIXELS', 8000000))
+
+# Tiles are at least TILE_MIN_LINES text lines tall and overlap by
+# TILE_OVERLAP_LINES, so every line lies whole inside some tile
+TILE_MIN_LINES = 12
+TILE_OVERLAP_LINES = 3
+
+SHARPEN_KERNEL = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+
+def load_image(source):
+    """
+    Load an image from a path, encoded bytes or an already decoded array.
+
+    Args:
+        source (str | bytes | numpy.ndarray): Path to the image file, raw
+            encoded image bytes (JPEG, PNG, ...) or a decoded BGR/grayscale image
+
+    Returns:
+        numpy.ndarray: The decoded image (arrays are returned as-is, not copied)
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image bytes")
+        return img
+    img = cv2.imread(source)
+    if img is None:
+        raise ValueError(f"Could not read image at {source}")
+    return img
+
+def _debug_dir(debug):
+    """Return a fresh directory for this call's debug images, or None."""
+    if not (DEBUG_ARTIFACTS if debug is None else debug):
+        return None
+    path = os.path.join(DEBUG_DIR, uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _dump(debug_dir, name, image):
+    if debug_dir is not None:
+        cv2.imwrite(os.path.join(debug_dir, f"{name}.png"), image)
+
+def estimate_noise(gray):
+    """
+    Estimate the standard deviation of Gaussian noise in a grayscale image.
+
+    Uses Immerkaer's fast method: a single 3x3 convolution that cancels
+    image structure and leaves mostly noise.
+
+    Args:
+        gray (numpy.ndarray): Grayscale image
+
+    Returns:
+        float: Estimated noise sigma in gray levels
+    """
+    height, width = gray.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(gray.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    return float(np.sqrt(np.pi / 2) * np.abs(response).sum() / (6 * (width - 2) * (height - 2)))
+
+class PreprocessCascade:
+    """
+    Lazily computed preprocessing variants of one image.
+
+    Every intermediate (upscaled grayscale, denoised, sharpened, ...) is
+    computed the first time a variant needs it and then reused, and the
+    time spent in each stage is recorded in `timings`.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR or grayscale image
+        debug_dir (str): Directory to write intermediate images to, or None
+        scale (float): Resize factor applied to the grayscale image
+    """
+
+    def __init__(self, image, debug_dir=None, scale=2.0):
+        self.original = image
+        self.debug_dir = debug_dir
+        self.scale = scale
+        self.timings = {}
+        self._cache = {}
+        self._nested = 0.0
+
+    def _stage(self, name, compute):
+        if name not in self._cache:
+            # Stages call each other lazily; only count this stage's own time
+            outer, self._nested = self._nested, 0.0
+            start = time.perf_counter()
+            self._cache[name] = compute()
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed - self._nested
+            self._nested = outer + elapsed
+            _dump(self.debug_dir, name, self._cache[name])
+        return self._cache[name]
+
+    def gray(self):
+        # Convert before resizing so only one channel is resized, then
+        # resize for better OCR accuracy - medicine labels often have small text
+        def compute():
+            img = self.original
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            if self.scale == 1.0:
+                return img
+            interpolation = cv2.INTER_CUBIC if self.scale > 1.0 else cv2.INTER_AREA
+            return cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=interpolation)
+        return self._stage('gray', compute)
+
+    @property
+    def noise(self):
+        if 'noise' not in self._cache:
+            start = time.perf_counter()
+            img = self.original
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self._cache['noise'] = estimate_noise(img)
+            self.timings['noise'] = time.perf_counter() - start
+        return self._cache['noise']
+
+    def denoised(self):
+        # Pick the cheapest denoiser the estimated noise level allows
+        def compute():
+            gray = self.gray()
+            if self.noise < NOISE_NONE:
+                return gray
+            if self.noise < NOISE_MEDIAN:
+                return cv2.medianBlur(gray, 3)
+            if self.noise < NOISE_BILATERAL:
+                return cv2.bilateralFilter(gray, 5, 50, 50)
+            return self.nlmeans()
+        return self._stage('denoised', compute)
+
+    def nlmeans(self):
+        return self._stage('nlmeans', lambda: cv2.fastNlMeansDenoising(self.gray(), h=10))
+
+    def variant(self, name):
+        """
+        Return a binarized variant by name, computing it on first use.
+
+        Args:
+            name (str): One of CASCADE
+
+        Returns:
+            numpy.ndarray: Binary image ready for OCR
+        """
+        def otsu(img):
+            return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+        builders = {
+            'otsu': lambda: otsu(self.denoised()),
+            'sharp': lambda: otsu(cv2.filter2D(self.denoised(), -1, SHARPEN_KERNEL)),
+            'adaptive': lambda: cv2.adaptiveThreshold(
+                self.denoised(), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2),
+            'nlmeans_sharp': lambda: otsu(cv2.filter2D(self.nlmeans(), -1, SHARPEN_KERNEL)),
+        }
+        return self._stage(f"thresh_{name}", builders[name])
+
+def preprocess_image(image, debug_dir=None):
     """
     Preprocess the image for optimal OCR text extraction from medicine labels.
-    
+
     Args:
-        image_path (str): Path to the image file
-        
+        image (str | bytes | numpy.ndarray): Image path, encoded bytes or decoded image
+        debug_dir (str): Directory to write intermediate images to, or None
+
     Returns:
         tuple: (original image, preprocessed image)
     """
     try:
-        # Load image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not read image at {image_path}")
-            
-        # Keep a copy of original image
-        original = img.copy()
-        
-        # Resize for better OCR accuracy - medicine labels often have small text
-        scale_percent = 200  # Increase size by 200%
-        width = int(img.shape[1] * scale_percent / 100)
-        height = int(img.shape[0] * scale_percent / 100)
-        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Try multiple preprocessing techniques and store them
-        # 1. Basic denoising
-        denoised = cv2.fastNlMeansDenoising(gray, h=10)
-        
-        # 2. Adaptive thresholding
-        thresh_adaptive = cv2.adaptiveThreshold(
-            denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-        
-        # 3. Otsu's thresholding
-        _, thresh_otsu = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # 4. Edge enhancement
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        sharpened = cv2.filter2D(denoised, -1, kernel)
-        _, thresh_sharp = cv2.threshold(sharpened, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Save intermediate images for debugging
-        cv2.imwrite("temp/gray.png", gray)
-        cv2.imwrite("temp/denoised.png", denoised)
-        cv2.imwrite("temp/thresh_adaptive.png", thresh_adaptive)
-        cv2.imwrite("temp/thresh_otsu.png", thresh_otsu)
-        cv2.imwrite("temp/thresh_sharp.png", thresh_sharp)
-        
+        # Load image; the original is never modified so no copy is needed
+        original = load_image(image)
+
         # Return original and the sharpened threshold image which often works best for text
-        return original, thresh_sharp
-        
+        return original, PreprocessCascade(original, debug_dir).variant('sharp')
+
     except Exception as e:
         logger.error(f"Error in preprocessing image: {str(e)}")
         # Return original image if available, or raise the exception
@@ -92,65 +244,391 @@ def preprocess_image(image_path):
             return original, original
         raise
 
-def extract_text(image_path):
+def mean_confidence(words):
+    """Return the mean confidence of the recognized words, 0 if there are none."""
+    if not words:
+        return 0.0
+    return sum(word['conf'] for word in words) / len(words)
+
+def _run_cascade(image, scale=2.0, debug_dir=None, fallback=True, max_passes=OCR_MAX_PASSES):
+    """
+    Run the preprocessing cascade and OCR on one image or crop.
+
+    Variants are tried cheapest first and the cascade stops as soon as one
+    reaches CONFIDENCE_TARGET, stops improving or `max_passes` is used
+    up; the most confident one wins.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR or grayscale image
+        scale (float): Resize factor applied before binarization
+        debug_dir (str): Directory to write intermediate images to, or None
+        fallback (bool): Hold out for MIN_TEXT_LENGTH characters and try
+            the PSM fallback on minimal text. Crops pass False: a brand name
+            is short, so only confidence counts and `analyze` checks the
+            length of the merged text instead
+        max_passes (int): OCR passes allowed, the fallback included; the
+            first variant is always read
+
+    Returns:
+        dict: 'text', 'words' (boxes in the coordinates of `image`),
+        'confidence', 'variant', 'psm', 'attempts' and 'timings'
+    """
+    cascade = PreprocessCascade(image, debug_dir, scale=scale)
+    attempts = []
+    best = None
+
+    for name in CASCADE:
+        preprocessed = cascade.variant(name)
+        start = time.perf_counter()
+        ocr = ocr_engine.recognize(preprocessed, psm=PRIMARY_PSM)
+        cascade.timings[f"ocr_{name}"] = time.perf_counter() - start
+
+        confidence = mean_confidence(ocr['words'])
+        attempts.append({'variant': name, 'psm': PRIMARY_PSM, 'confidence': confidence,
+                         'chars': len(ocr['text'].strip())})
+        previous = best['confidence'] if best is not None else None
+        if best is None or confidence > best['confidence']:
+            best = dict(ocr, confidence=confidence, variant=name, psm=PRIMARY_PSM, preprocessed=preprocessed)
+
+        if confidence >= CONFIDENCE_TARGET and (not fallback or len(ocr['text'].strip()) >= MIN_TEXT_LENGTH):
+            break
+        # Variants are ordered by strength; one that barely helped means the rest will not
+        if previous is not None and confidence < previous + MIN_CONFIDENCE_GAIN:
+            break
+        # Keep the last pass for the PSM fallback while the text is still minimal
+        short = fallback and len(best['text'].strip()) < MIN_TEXT_LENGTH
+        if len(attempts) >= max_passes - short:
+            break
+
+    # If text is minimal, try with different PSM mode
+    if fallback and len(best['text'].strip()) < MIN_TEXT_LENGTH and len(attempts) < max_passes:
+        logger.info("Initial OCR yielded minimal text, trying with different PSM mode")
+        start = time.perf_counter()
+        ocr = ocr_engine.recognize(best['preprocessed'], psm=FALLBACK_PSM)
+        cascade.timings[f"ocr_{best['variant']}_psm{FALLBACK_PSM}"] = time.perf_counter() - start
+        attempts.append({'variant': best['variant'], 'psm': FALLBACK_PSM,
+                         'confidence': mean_confidence(ocr['words']), 'chars': len(ocr['text'].strip())})
+        if len(ocr['text'].strip()) > len(best['text'].strip()):
+            best.update(ocr, confidence=mean_confidence(ocr['words']), psm=FALLBACK_PSM)
+
+    # Map word boxes back from the preprocessed resolution
+    del best['preprocessed']
+    for word in best['words']:
+        for key in ('left', 'top', 'width', 'height'):
+            word[key] = int(round(word[key] / scale))
+
+    best.update(attempts=attempts, timings=cascade.timings)
+    return best
+
+def _tile_spans(length, tile, overlap):
+    """
+    Split one axis into overlapping tiles.
+
+    Returns:
+        list: (start, end, keep_from, keep_to) per tile; words centred in
+        [keep_from, keep_to) belong to that tile, the seam being the middle
+        of each overlap
+    """
+    if tile >= length:
+        return [(0, length, 0, length)]
+    starts = list(range(0, length - tile, tile - overlap)) + [length - tile]
+    spans = []
+    for i, start in enumerate(starts):
+        keep_from = 0 if i == 0 else (start + starts[i - 1] + tile) // 2
+        keep_to = length if i == len(starts) - 1 else (starts[i + 1] + start + tile) // 2
+        spans.append((start, start + tile, keep_from, keep_to))
+    return spans
+
+def _run_tiles(image, scale, debug_dir=None, fallback=True, max_passes=OCR_MAX_PASSES):
+    """
+    Run the cascade over overlapping tiles of an image too large to read at once.
+
+    Tiles are full-width strips where possible so text lines stay whole,
+    and are read one after another so only one tile's buffers are alive at
+    any time. Words in the overlaps are kept from one tile only.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR or grayscale image
+        scale (float): Resize factor applied before binarization
+        debug_dir (str): Directory to write intermediate images to, or None
+        fallback (bool): See `_run_cascade`
+        max_passes (int): OCR passes allowed per tile, see `_run_cascade`
+
+    Returns:
+        dict: Same keys as `_run_cascade` plus 'tiles', the number of tiles
+        read; every word also holds the index of the 'tile' it was read in
+    """
+    height, width = image.shape[:2]
+    area = OCR_MAX_PIXELS / (scale * scale)  # Original pixels per tile
+    line = text_regions.TARGET_TEXT_HEIGHT / scale  # Text line height in original pixels
+    tile_width = int(min(width, area / min(height, TILE_MIN_LINES * line)))
+    tile_height = int(min(height, area / tile_width))
+    overlap = int(TILE_OVERLAP_LINES * line)
+
+    words, texts, attempts, timings, results = [], [], [], {}, []
+    for row, (y0, y1, keep_top, keep_bottom) in enumerate(_tile_spans(height, tile_height, overlap)):
+        for col, (x0, x1, keep_left, keep_right) in enumerate(_tile_spans(width, tile_width, overlap)):
+            tile_dir = None
+            if debug_dir is not None:
+                tile_dir = os.path.join(debug_dir, f"tile_{row}_{col}")
+                os.makedirs(tile_dir, exist_ok=True)
+            result = _run_cascade(image[y0:y1, x0:x1], scale, tile_dir, fallback, max_passes)
+
+            kept = []
+            for word in result['words']:
+                word['left'] += x0
+                word['top'] += y0
+                word['tile'] = len(results)
+                cx = word['left'] + word['width'] / 2.0
+                cy = word['top'] + word['height'] / 2.0
+                if keep_left <= cx < keep_right and keep_top <= cy < keep_bottom:
+                    kept.append(word)
+            words.extend(kept)
+            if kept:
+                texts.append(ocr_engine.words_to_text(kept))
+            attempts.extend(result['attempts'])
+            for stage, seconds in result['timings'].items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            results.append(result)
+
+    logger.info(f"Read {len(results)} tiles of {tile_width}x{tile_height} at scale {scale:.2f}")
+    return {
+        'text': ''.join(texts),
+        'words': words,
+        'confidence': mean_confidence(words),
+        'variant': results[0]['variant'],
+        'psm': results[0]['psm'],
+        'attempts': attempts,
+        'timings': timings,
+        'tiles': len(results),
+    }
+
+def _read(image, scale, debug_dir=None, fallback=True, max_passes=OCR_MAX_PASSES):
+    """Read an image or crop at `scale`, in tiles if it would exceed OCR_MAX_PIXELS."""
+    height, width = image.shape[:2]
+    if height * width * scale * scale <= OCR_MAX_PIXELS:
+        return dict(_run_cascade(image, scale, debug_dir, fallback, max_passes), tiles=1)
+    return _run_tiles(image, scale, debug_dir, fallback, max_passes)
+
+def _analyze_regions(image, regions, debug_dir=None):
+    """
+    OCR the detected text regions in parallel and merge the results.
+
+    Each crop stops on confidence alone, without the MIN_TEXT_LENGTH check
+    or PSM fallback; `analyze` applies those once, to the merged text.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR or grayscale image
+        regions (list): Output of `text_regions.detect_text_regions`
+        debug_dir (str): Directory to write intermediate images to, or None
+
+    Returns:
+        dict: Same keys as `_run_cascade` plus 'regions'; the text of the
+        most prominent region comes first, and every word also holds the
+        number of the 'region' it was read in, counted from 1
+    """
+    def read(index, region):
+        x, y, w, h = region['box']
+        region_dir = None
+        if debug_dir is not None:
+            region_dir = os.path.join(debug_dir, f"region_{index}")
+            os.makedirs(region_dir, exist_ok=True)
+        # Crops stop on confidence alone; the merged text gets the length check
+        result = _read(image[y:y + h, x:x + w], region['scale'], region_dir, fallback=False)
+        for word in result['words']:
+            word['left'] += x
+            word['top'] += y
+            word['region'] = index + 1
+        return result
+
+    workers = max(1, min(len(regions), ocr_engine.POOL_SIZE))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each crop runs in a copy of this context, so the OCR deadline holds there too
+        futures = [executor.submit(contextvars.copy_context().run, read, index, region)
+                   for index, region in enumerate(regions)]
+        results = [future.result() for future in futures]
+
+    words, texts, attempts, timings, summaries = [], [], [], {}, []
+    for region, result in zip(regions, results):
+        words.extend(result['words'])
+        if result['text'].strip():
+            texts.append(result['text'].strip())
+        attempts.extend(result['attempts'])
+        for stage, seconds in result['timings'].items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        summaries.append({
+            'box': region['box'],
+            'scale': region['scale'],
+            'tiles': result['tiles'],
+            'variant': result['variant'],
+            'confidence': result['confidence'],
+        })
+
+    text = '\n\n'.join(texts) + ('\n' if texts else '')
+    return {
+        'text': text,
+        'words': words,
+        'confidence': mean_confidence(words),
+        'variant': results[0]['variant'],
+        'psm': results[0]['psm'],
+        'attempts': attempts,
+        'timings': timings,
+        'regions': summaries,
+    }
+
+def analyze(image, debug=None, use_regions=None, correct_geometry=None):
+    """
+    Run text detection, the preprocessing cascade and OCR on a medicine label.
+
+    The label is first turned upright and straightened. When text regions
+    are found only those crops are read, each scaled to its own text
+    height; otherwise the whole frame is scaled to its median text height
+    and read. Anything that would exceed OCR_MAX_PIXELS after scaling is
+    read in tiles.
+
+    Args:
+        image (str | bytes | numpy.ndarray): Image path, encoded bytes or decoded image
+        debug (bool): Write intermediate images to disk; defaults to EXTRACTION_DEBUG
+        use_regions (bool): OCR detected regions only; defaults to ROI_OCR
+        correct_geometry (bool): Correct rotation and skew first; defaults to GEOMETRY_CORRECTION
+
+    Returns:
+        dict: 'image' (original), 'text', 'words' (boxes in original image
+        coordinates), 'confidence', 'variant', 'psm', 'attempts' (one entry
+        per OCR pass of the kept read), 'passes' (OCR passes in total,
+        including orientation reads and a region read that was given up),
+        'regions' (crops that
+        were read, empty for a full-frame read), 'scale' (of the full-frame
+        read, None for regions), 'tiles' (tiles read in total), 'geometry'
+        (the correction applied, see `geometry.correct`, None when
+        disabled) and 'timings' (seconds per stage); word and region boxes
+        are in original image coordinates whatever the correction
+    """
+    start = time.perf_counter()
+    original = load_image(image)
+    decode_time = time.perf_counter() - start
+    debug_dir = _debug_dir(debug)
+    result = None
+    detect_time = None
+    discarded_passes = 0
+    orientation_passes = 0
+
+    upright, matrix, report, geometry_time = original, None, None, None
+    if GEOMETRY_CORRECTION if correct_geometry is None else correct_geometry:
+        start = time.perf_counter()
+        # Orientation reads count against the image's passes, leaving one to read it
+        upright, matrix, report = geometry.correct(original, max_passes=OCR_MAX_PASSES - 1)
+        orientation_passes = report['passes']
+        geometry_time = time.perf_counter() - start
+        if matrix is not None:
+            _dump(debug_dir, "upright", upright)
+
+    if ROI_OCR if use_regions is None else use_regions:
+        start = time.perf_counter()
+        regions = text_regions.detect_text_regions(upright)
+        detect_time = time.perf_counter() - start
+
+        # Reading crops only pays off when they leave most of the frame out
+        if regions and text_regions.coverage(regions, upright.shape) < MAX_REGION_COVERAGE:
+            start = time.perf_counter()
+            result = _analyze_regions(upright, regions, debug_dir)
+            result['timings']['ocr_regions_wall'] = time.perf_counter() - start
+            # The length check and PSM fallback apply once, to the merged
+            # text: the full-frame read below runs both
+            if len(result['text'].strip()) < MIN_TEXT_LENGTH:
+                logger.info("Region OCR yielded minimal text, reading the full frame")
+                discarded_passes = len(result['attempts'])
+                result = None
+
+    if result is None:
+        # Scale to the text actually in the frame instead of a fixed factor,
+        # so large photos shrink and small ones grow
+        start = time.perf_counter()
+        text_height = text_regions.estimate_text_height(upright)
+        scale = text_regions.scale_for(text_height) if text_height else DEFAULT_SCALE
+        measure_time = time.perf_counter() - start
+        result = _read(upright, scale, debug_dir, max_passes=OCR_MAX_PASSES - orientation_passes)
+        result['timings']['measure_text'] = measure_time
+        result.update(regions=[], scale=scale)
+    else:
+        result.update(tiles=sum(region['tiles'] for region in result['regions']), scale=None)
+
+    result['timings']['decode'] = decode_time
+    if detect_time is not None:
+        result['timings']['detect_regions'] = detect_time
+    if geometry_time is not None:
+        result['timings']['geometry'] = geometry_time
+
+    if matrix is not None:
+        boxes = geometry.to_original(
+            [(word['left'], word['top'], word['width'], word['height']) for word in result['words']],
+            matrix, original.shape)
+        for word, (x, y, w, h) in zip(result['words'], boxes):
+            word.update(left=x, top=y, width=w, height=h)
+        boxes = geometry.to_original([region['box'] for region in result['regions']], matrix, original.shape)
+        for region, box in zip(result['regions'], boxes):
+            region['box'] = box
+    result['geometry'] = report
+    result['passes'] = len(result['attempts']) + discarded_passes + orientation_passes
+
+    logger.info(
+        f"OCR used variant '{result['variant']}' over {len(result['regions']) or 'full'} region(s) "
+        f"in {result['tiles']} tile(s) after {result['passes']} pass(es), confidence {result['confidence']:.1f}")
+    result.update(image=original, debug_dir=debug_dir)
+    return result
+
+def draw_boxes(result, min_conf=60):
+    """
+    Draw the recognized word boxes on a copy of the original image.
+
+    Args:
+        result (dict): Output of `analyze`
+        min_conf (float): Only draw words above this confidence
+
+    Returns:
+        numpy.ndarray: BGR image with green boxes around the words
+    """
+    img = result['image']
+
+    # Draw on a copy so the caller's image stays untouched
+    if img.ndim == 2:
+        result_img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    else:
+        result_img = img.copy()
+
+    # Draw boxes around text
+    for word in result['words']:
+        if word['conf'] > min_conf:  # Only consider text with confidence > 60%
+            (x, y, w, h) = (word['left'], word['top'], word['width'], word['height'])
+            # Draw green rectangle around text
+            cv2.rectangle(result_img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+    return result_img
+
+def extract_text(image, debug=None):
     """
     Extract text from an image of a medicine label.
-    
+
     Args:
-        image_path (str): Path to the image file
-        
+        image (str | bytes | numpy.ndarray): Image path, encoded bytes or decoded image
+        debug (bool): Write intermediate images to disk; defaults to EXTRACTION_DEBUG
+
     Returns:
         tuple: (processed image with text boxes, extracted text)
     """
     try:
-        # Preprocess the image
-        img, preprocessed_img = preprocess_image(image_path)
-        
-        # Create a copy for drawing
-        result_img = img.copy()
-        
-        # Run OCR with both preprocessing methods and combine results
-        text = pytesseract.image_to_string(preprocessed_img, config=myconfig)
-        
-        # If text is minimal, try with different PSM mode
-        if len(text.strip()) < 10:
-            logger.info("Initial OCR yielded minimal text, trying with different PSM mode")
-            text = pytesseract.image_to_string(
-                preprocessed_img, 
-                config=r"--psm 3 --oem 3"  # Try with auto page segmentation
-            )
-        
-        # Draw bounding boxes around detected text for visualization
-        boxes = pytesseract.image_to_data(preprocessed_img, config=myconfig, output_type=pytesseract.Output.DICT)
-        
-        # Resize result_img to match the size of preprocessed_img if needed
-        if result_img.shape[:2] != preprocessed_img.shape[:2]:
-            result_img = cv2.resize(
-                result_img, 
-                (preprocessed_img.shape[1], preprocessed_img.shape[0]), 
-                interpolation=cv2.INTER_CUBIC
-            )
-        
-        # Draw boxes around text
-        for i in range(len(boxes['text'])):
-            if int(boxes['conf'][i]) > 60:  # Only consider text with confidence > 60%
-                (x, y, w, h) = (
-                    boxes['left'][i], boxes['top'][i], 
-                    boxes['width'][i], boxes['height'][i]
-                )
-                # Draw green rectangle around text
-                cv2.rectangle(result_img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        
+        img = load_image(image)
+        result = analyze(img, debug)
+        result_img = draw_boxes(result)
+
         # Save the result image
-        cv2.imwrite("temp/text_boxes.png", result_img)
-        
-        logger.info(f"Extracted text length: {len(text)}")
-        return result_img, text
-        
+        _dump(result['debug_dir'], "text_boxes", result_img)
+
+        logger.info(f"Extracted text length: {len(result['text'])}")
+        return result_img, result['text']
+
     except Exception as e:
         logger.error(f"Error extracting text: {str(e)}")
         if 'img' in locals():
             return img, f"Error extracting text: {str(e)}"
         raise
-
-    
\ No newline at end of file
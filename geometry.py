@@ -0,0 +1,319 @@
+import cv2
+import numpy as np
+import os
+import logging
+import ocr_engine
+import text_regions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Crop the box face and flatten it when it is photographed at an angle
+GEOMETRY_PERSPECTIVE = os.getenv('GEOMETRY_PERSPECTIVE', '').lower() in ('1', 'true', 'yes')
+
+# When Tesseract OSD is asked which way up the text is: 'auto' only to
+# choose between 90 and 270 degrees for sideways text, 'always' also to
+# catch labels held upside down, 'off' never
+GEOMETRY_OSD = os.getenv('GEOMETRY_OSD', 'auto').lower()
+OSD_MIN_CONFIDENCE = float(os.getenv('GEOMETRY_OSD_CONFIDENCE', 2.0))
+
+# Geometry is measured on a copy no larger than this on its long side
+THUMBNAIL_SIDE = 1000
+
+# Words needed before the direction of the text lines is trusted
+MIN_WORDS = 5
+
+# Skew below this many degrees does not hurt Tesseract and is left alone
+MIN_SKEW = 1.0
+
+# A box face must cover at least this share of the frame
+MIN_FACE_AREA = 0.2
+
+# When OSD cannot tell 90 from 270 degrees, sideways text is read both
+# ways, one OCR pass each, and turned only if one reading is more
+# confident by this many points
+ORIENTATION_PSM = 6
+MIN_ORIENTATION_MARGIN = 10.0
+SIDEWAYS_PASSES = 2
+
+ROTATIONS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+def _thumbnail(image):
+    """Return a copy no larger than THUMBNAIL_SIDE and the factor it was resized by."""
+    height, width = image.shape[:2]
+    ratio = min(1.0, THUMBNAIL_SIDE / float(max(height, width)))
+    if ratio < 1.0:
+        image = cv2.resize(image, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+    return image, ratio
+
+def _weighted_median(values, weights):
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cumulative, cumulative[-1] / 2.0)])
+
+def estimate_text_direction(image):
+    """
+    Estimate which way the text lines of an image run.
+
+    Characters are merged into words and the long side of each word's
+    minimum area rectangle gives its direction; the words vote, weighted
+    by their length.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image, ideally a thumbnail
+
+    Returns:
+        dict: 'sideways' (the lines run top to bottom), 'skew' (degrees the
+        lines are turned clockwise from the nearest axis, within +-45),
+        'words' (words measured) and 'agreement' (share of the words'
+        weight on the winning axis), or None if too few words were found
+    """
+    mask, stats = text_regions.character_mask(image)
+    if len(stats) < MIN_WORDS:
+        return None
+
+    # Characters are taller than wide, whichever way the text is turned
+    char_height = float(np.median(np.maximum(stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT])))
+    size = max(3, int(round(char_height * 0.5)))
+    words = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+
+    contours, _ = cv2.findContours(words, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles, weights = [], []
+    for contour in contours:
+        rect = cv2.minAreaRect(contour)
+        long_side, short_side = max(rect[1]), min(rect[1])
+        if short_side < 1 or long_side < 2 * short_side or long_side < 1.5 * char_height:
+            continue
+        corners = cv2.boxPoints(rect)
+        edge = max(corners[1] - corners[0], corners[2] - corners[1], key=np.linalg.norm)
+        angles.append(np.degrees(np.arctan2(edge[1], edge[0])))
+        weights.append(long_side)
+    if len(angles) < MIN_WORDS:
+        return None
+
+    # Angles in [-90, 90), y pointing down, so positive is clockwise
+    angles = (np.array(angles) + 90) % 180 - 90
+    weights = np.array(weights)
+    vertical = np.abs(angles) > 45
+    sideways = weights[vertical].sum() > weights.sum() / 2.0
+    on_axis = vertical if sideways else ~vertical
+    folded = (angles[on_axis] + 45) % 90 - 45
+    return {
+        'sideways': bool(sideways),
+        'skew': _weighted_median(folded, weights[on_axis]),
+        'words': len(angles),
+        'agreement': float(weights[on_axis].sum() / weights.sum()),
+    }
+
+def _order_corners(points):
+    """Order four points as top-left, top-right, bottom-right, bottom-left."""
+    sums = points.sum(axis=1)
+    diffs = points[:, 1] - points[:, 0]
+    return np.float32([points[np.argmin(sums)], points[np.argmin(diffs)],
+                       points[np.argmax(sums)], points[np.argmax(diffs)]])
+
+def find_face(image):
+    """
+    Find the largest four-sided outline in an image, such as a box face.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image, ideally a thumbnail
+
+    Returns:
+        numpy.ndarray: Its corners (top-left, top-right, bottom-right,
+        bottom-left) in image coordinates, or None if there is none
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    edges = cv2.dilate(cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150), None)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = MIN_FACE_AREA * gray.shape[0] * gray.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        outline = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(outline) == 4 and cv2.isContourConvex(outline):
+            return _order_corners(outline.reshape(4, 2).astype(np.float32))
+    return None
+
+def _warp(image, matrix, corners, rotation=None):
+    """
+    Apply a 3x3 transform, shifted so the transformed corners fit the output.
+
+    Args:
+        image (numpy.ndarray): Image to transform
+        matrix (numpy.ndarray): 3x3 transform
+        corners (numpy.ndarray): Corners of the part of the image to keep
+        rotation (int): Clockwise degrees when the transform is a pure
+            quarter turn, which is done exactly
+
+    Returns:
+        tuple: (transformed image, the shifted 3x3 transform)
+    """
+    moved = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), matrix).reshape(-1, 2)
+    low, high = moved.min(axis=0), moved.max(axis=0)
+    matrix = np.array([[1, 0, -low[0]], [0, 1, -low[1]], [0, 0, 1]]) @ matrix
+    size = tuple(int(np.ceil(side)) + 1 for side in high - low)
+
+    if rotation is not None:
+        return cv2.rotate(image, ROTATIONS[rotation]), matrix
+    if np.allclose(matrix[2], [0, 0, 1]):
+        return cv2.warpAffine(image, matrix[:2], size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE), matrix
+    return cv2.warpPerspective(image, matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE), matrix
+
+def _rotation(degrees):
+    """3x3 matrix turning the image `degrees` counter-clockwise about the origin."""
+    return np.vstack([cv2.getRotationMatrix2D((0, 0), degrees, 1.0), [0, 0, 1]])
+
+def _corners(width, height):
+    return np.float32([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]])
+
+def read_sideways(thumbnail, skew=0.0):
+    """
+    Tell which way to turn sideways text by reading it both ways.
+
+    One OCR pass on the thumbnail turned each way (SIDEWAYS_PASSES in
+    all); text the right way up is read with clearly higher word
+    confidence than upside down.
+
+    Args:
+        thumbnail (numpy.ndarray): BGR or grayscale image with sideways text
+        skew (float): Degrees the text lines are turned from the vertical axis
+
+    Returns:
+        int: Clockwise degrees that make the text upright, 90 or 270, or
+        None if neither reading is more confident by MIN_ORIENTATION_MARGIN
+    """
+    gray = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY) if thumbnail.ndim == 3 else thumbnail
+    height, width = gray.shape[:2]
+    confidences = {}
+    for rotation in (90, 270):
+        turned, _ = _warp(gray, _rotation(skew - rotation), _corners(width, height), None if skew else rotation)
+        binary = cv2.threshold(turned, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        words = ocr_engine.recognize(binary, psm=ORIENTATION_PSM)['words']
+        confidences[rotation] = sum(word['conf'] for word in words) / len(words) if words else 0.0
+
+    best = max(confidences, key=confidences.get)
+    if confidences[best] - confidences[360 - best] < MIN_ORIENTATION_MARGIN:
+        logger.info(f"Could not tell which way the sideways text is up (confidence {confidences})")
+        return None
+    return best
+
+def correct(image, perspective=None, osd=None, max_passes=None):
+    """
+    Turn a label upright and straighten it before OCR.
+
+    The direction of the text lines, measured on a thumbnail, gives the
+    skew and whether the text runs sideways; Tesseract OSD on the
+    straightened thumbnail then settles which way up it is when asked to.
+    Sideways text OSD cannot settle is read both ways (`read_sideways`)
+    if `max_passes` allows, and left sideways if that does not settle it
+    either. Optionally the
+    box face is cropped and flattened first. All of it is applied to the
+    full image in a single resampling.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR or grayscale image
+        perspective (bool): Flatten the box face; defaults to GEOMETRY_PERSPECTIVE
+        osd (str): 'auto', 'always' or 'off'; defaults to GEOMETRY_OSD
+        max_passes (int): OCR passes the orientation reads may take, or
+            None for no limit
+
+    Returns:
+        tuple: (corrected image, 3x3 matrix from original to corrected
+        pixel coordinates or None if the image was left as it is, report)
+        where the report holds 'rotation' (clockwise degrees, a multiple
+        of 90), 'skew' (degrees straightened), 'perspective' (whether the
+        face was flattened), 'orientation' (what chose the rotation: 'osd',
+        'ocr' for `read_sideways`, 'unknown' for sideways text neither could
+        settle, or None when the text was not sideways and OSD was not
+        asked), 'passes' (OCR passes spent on orientation) and 'words'
+        (words measured)
+    """
+    perspective = GEOMETRY_PERSPECTIVE if perspective is None else perspective
+    osd = GEOMETRY_OSD if osd is None else osd
+    report = {'rotation': 0, 'skew': 0.0, 'perspective': False, 'orientation': None, 'passes': 0, 'words': 0}
+
+    height, width = image.shape[:2]
+    thumbnail, ratio = _thumbnail(image)
+    corners = _corners(width, height)
+    matrix = np.eye(3)
+
+    if perspective:
+        face = find_face(thumbnail)
+        if face is not None:
+            corners = face / ratio
+            face_width = max(np.linalg.norm(corners[1] - corners[0]), np.linalg.norm(corners[2] - corners[3]))
+            face_height = max(np.linalg.norm(corners[3] - corners[0]), np.linalg.norm(corners[2] - corners[1]))
+            target = _corners(face_width, face_height)
+            matrix = cv2.getPerspectiveTransform(corners, target)
+            thumbnail, _ = _warp(thumbnail, cv2.getPerspectiveTransform(face, target * ratio), face)
+            report['perspective'] = True
+
+    rotation, skew, sideways = 0, 0.0, False
+    direction = estimate_text_direction(thumbnail)
+    if direction is not None:
+        report['words'] = direction['words']
+        if abs(direction['skew']) >= MIN_SKEW:
+            skew = direction['skew']
+        sideways = direction['sideways']
+
+    # Sideways text is turned 90 degrees for OSD, which then says whether
+    # it needs another 180; whether that makes 90 or 270 is undecided until then
+    settled = not sideways
+    if osd == 'always' or (osd == 'auto' and sideways):
+        thumb_height, thumb_width = thumbnail.shape[:2]
+        base = 90 if sideways else 0
+        upright, _ = _warp(thumbnail, _rotation(skew - base), _corners(thumb_width, thumb_height))
+        found = ocr_engine.detect_orientation(upright)
+        if found is not None and found['confidence'] >= OSD_MIN_CONFIDENCE:
+            rotation = (base + found['rotate']) % 360
+            report['orientation'] = 'osd'
+            settled = True
+
+    if not settled:
+        rotation = None
+        if max_passes is None or max_passes >= SIDEWAYS_PASSES:
+            rotation = read_sideways(thumbnail, skew)
+            report['passes'] = SIDEWAYS_PASSES
+        else:
+            logger.info("No OCR passes left to tell which way the sideways text is up")
+        report['orientation'] = 'ocr' if rotation is not None else 'unknown'
+        rotation = rotation or 0
+
+    if not rotation and not skew and not report['perspective']:
+        return image, None, report
+
+    exact = rotation if rotation and not skew and not report['perspective'] else None
+    corrected, matrix = _warp(image, _rotation(skew - rotation) @ matrix, corners, exact)
+    report.update(rotation=rotation, skew=round(skew, 2))
+    logger.info(
+        f"Turned the image {rotation} degrees and straightened {skew:.1f} degrees"
+        f"{' after flattening the box face' if report['perspective'] else ''}")
+    return corrected, matrix, report
+
+def to_original(boxes, matrix, shape):
+    """
+    Map boxes from corrected back to original image coordinates.
+
+    Args:
+        boxes (list): (x, y, w, h) boxes in the corrected image
+        matrix (numpy.ndarray): Transform returned by `correct`
+        shape (tuple): Shape of the original image
+
+    Returns:
+        list: (x, y, w, h) boxes bounding the mapped boxes, clipped to the image
+    """
+    if not boxes:
+        return []
+    boxes = np.array(boxes, dtype=np.float64)
+    x0, y0 = boxes[:, 0], boxes[:, 1]
+    x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+    corners = np.stack([x0, y0, x1, y0, x1, y1, x0, y1], axis=1).reshape(-1, 1, 2)
+    mapped = cv2.perspectiveTransform(corners, np.linalg.inv(matrix)).reshape(-1, 4, 2)
+
+    height, width = shape[:2]
+    low = np.floor(mapped.min(axis=1)).clip(0, [width - 1, height - 1]).astype(int)
+    high = np.ceil(mapped.max(axis=1)).clip(0, [width, height]).astype(int)
+    return [(int(x), int(y), int(right - x), int(bottom - y)) for (x, y), (right, bottom) in zip(low, high)]
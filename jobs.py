@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Finished jobs are kept this long so clients can reconnect and replay them
+JOB_TTL = float(os.getenv('JOB_TTL', 600))
+
+# Threads that drive jobs through the I/O-bound stages (search, LLM)
+JOB_THREADS = int(os.getenv('JOB_THREADS', 16))
+
+# How often an idle event stream sends a keep-alive comment
+KEEPALIVE_SECONDS = 15
+
+
+def format_event(index, event, data):
+    """Format one Server-Sent Event."""
+    return f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Job:
+    """
+    A background scan whose stage results are published as events.
+
+    Events are kept in order so a client can (re)connect at any time and
+    replay everything from a given index.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self.result = {}
+        self._condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def publish(self, event, data=None):
+        """
+        Append an event and wake up every listener.
+
+        Args:
+            event (str): Event name, e.g. 'ocr', 'name', 'llm_token'
+            data (dict): JSON serializable payload
+        """
+        with self._condition:
+            self.events.append((event, data or {}))
+            self._condition.notify_all()
+
+    def finish(self, event='done', data=None):
+        """Publish the final event and mark the job as finished."""
+        with self._condition:
+            self.events.append((event, data or {}))
+            self.finished = time.time()
+            self._condition.notify_all()
+
+    def wait_events(self, start=0, timeout=KEEPALIVE_SECONDS):
+        """
+        Return the events after `start`, waiting up to `timeout` for new ones.
+
+        Returns:
+            list: (index, event, data) tuples, empty if none arrived in time
+        """
+        with self._condition:
+            if start >= len(self.events) and not self.done:
+                self._condition.wait(timeout)
+            return [(i, event, data) for i, (event, data) in enumerate(self.events[start:], start)]
+
+    def stream(self, start=0):
+        """
+        Yield the job's events formatted as Server-Sent Events.
+
+        Args:
+            start (int): Index of the first event to send, e.g. one past
+                the client's Last-Event-ID after a reconnect
+        """
+        index = start
+        while True:
+            events = self.wait_events(index)
+            if not events:
+                if self.done:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for i, event, data in events:
+                yield format_event(i, event, data)
+                index = i + 1
+            if self.done and index >= len(self.events):
+                return
+
+    def snapshot(self):
+        return {
+            'job_id': self.id,
+            'status': 'done' if self.done else 'running',
+            'events': len(self.events),
+            'result': self.result,
+        }
+
+
+class JobStore:
+    """
+    Registry of running and recently finished jobs.
+
+    Args:
+        ttl (float): Seconds a finished job is kept
+        threads (int): Size of the thread pool that runs the jobs
+    """
+
+    def __init__(self, ttl=JOB_TTL, threads=JOB_THREADS):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job')
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished > self.ttl:
+                del self._jobs[job_id]
+
+    def start(self, fn, *args):
+        """
+        Create a job and run `fn(job, *args)` in the background.
+
+        Unhandled exceptions end the job with an 'error' event.
+
+        Returns:
+            Job: The new job
+        """
+        job = Job()
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+
+        def run():
+            try:
+                fn(job, *args)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}")
+                job.finish('error', {'error': f'An error occurred: {str(e)}'})
+            else:
+                if not job.done:
+                    job.finish('done', job.result)
+
+        self._executor.submit(run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
@@ -0,0 +1,410 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+import metrics
+from search import normalize_name
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_DB = os.getenv('KNOWLEDGE_DB', os.path.join('data', 'knowledge.db'))
+
+# Records are served as they are for KNOWLEDGE_TTL seconds; older ones are
+# still served but queued for a background refresh, up to KNOWLEDGE_MAX_AGE
+KNOWLEDGE_TTL = float(os.getenv('KNOWLEDGE_TTL', 30 * 24 * 3600))
+KNOWLEDGE_MAX_AGE = float(os.getenv('KNOWLEDGE_MAX_AGE', 180 * 24 * 3600))
+
+# Background refresh of stale records, most requested first
+KNOWLEDGE_REFRESH = os.getenv('KNOWLEDGE_REFRESH', '1').lower() in ('1', 'true', 'yes')
+KNOWLEDGE_REFRESH_INTERVAL = float(os.getenv('KNOWLEDGE_REFRESH_INTERVAL', 600))
+KNOWLEDGE_REFRESH_BATCH = int(os.getenv('KNOWLEDGE_REFRESH_BATCH', 5))
+
+# Without a resolved name, a label word answers from the store only when
+# it is a stored name or synonym, or a misreading of one: at least this
+# similar and no more than this many letters longer or shorter. Related
+# drugs share long stems (levocetirizine, cetirizine), so anything looser
+# would serve the answer for a different medicine.
+FUZZY_MIN_SIMILARITY = 0.9
+FUZZY_MAX_LENGTH_DIFFERENCE = 1
+
+# Sections of the structured answer, as asked for by LLM.SYSTEM_PROMPT
+SECTIONS = (
+    ('name', 'Medicine Name'),
+    ('uses', 'Primary Uses'),
+    ('dosage', 'Dosage Information'),
+    ('side_effects', 'Common Side Effects'),
+    ('precautions', 'Precautions'),
+    ('note', 'Important Note'),
+)
+
+
+def parse_sections(answer):
+    """
+    Split a structured LLM answer into its sections.
+
+    Args:
+        answer (str): Answer following the numbered layout of the system prompt
+
+    Returns:
+        dict: Section text keyed by the names in SECTIONS; sections the
+        answer does not contain are left out
+    """
+    starts = []
+    for key, title in SECTIONS:
+        # Tolerate numbering, markdown emphasis and headings around the title
+        match = re.search(rf'^[\s#*]*(?:\d+\.)?[\s*]*{re.escape(title)}[\s*]*:?[\s*]*', answer,
+                          re.IGNORECASE | re.MULTILINE)
+        if match:
+            starts.append((match.start(), match.end(), key))
+    starts.sort()
+
+    sections = {}
+    for i, (_, end, key) in enumerate(starts):
+        stop = starts[i + 1][0] if i + 1 < len(starts) else len(answer)
+        text = answer[end:stop].strip()
+        if text:
+            sections[key] = text
+    return sections
+
+
+def _trigrams(word):
+    return [word[i:i + 3] for i in range(len(word) - 2)]
+
+
+class KnowledgeStore:
+    """
+    Canonical medicine records kept in SQLite with a full-text index.
+
+    Each record holds the structured answer for one medicine, keyed by
+    its normalized name, along with its generic names and the label text
+    it was generated from. Records are found by name, or fuzzily from OCR
+    text through an FTS5 trigram index; without FTS5 a LIKE scan over the
+    names is used instead. Generic names are indexed for full-text search
+    only: a combination product shares them with every single-ingredient
+    medicine, so they never resolve to a record on their own.
+
+    Args:
+        path (str): SQLite database file, or ':memory:'
+    """
+
+    def __init__(self, path=KNOWLEDGE_DB):
+        self.path = path
+        self.hits = 0
+        self.stale_served = 0
+        self.misses = 0
+        self.refreshed = 0
+        self.refresh_failures = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            if path != ':memory:':
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS medicines ("
+                "key TEXT PRIMARY KEY, name TEXT NOT NULL, generic TEXT NOT NULL, "
+                "sections TEXT NOT NULL, answer TEXT NOT NULL, model TEXT, label_text TEXT, "
+                "created REAL NOT NULL, updated REAL NOT NULL, checked REAL NOT NULL, "
+                "requests INTEGER NOT NULL DEFAULT 0)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS aliases ("
+                "alias TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (alias, key))")
+            # Older databases also listed generic names as aliases
+            self._conn.execute("DELETE FROM aliases WHERE alias != key")
+            self.fts = self._create_index()
+
+    def _create_index(self):
+        """Create the full-text index, trigram tokenized where supported."""
+        for tokenize in ('trigram', 'unicode61'):
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS medicines_fts USING fts5("
+                    f"key UNINDEXED, names, body, tokenize='{tokenize}')")
+                return tokenize
+            except sqlite3.OperationalError:
+                continue
+        logger.warning("SQLite has no FTS5, knowledge lookups fall back to LIKE")
+        return None
+
+    def _record(self, row):
+        record = dict(row)
+        record['generic'] = json.loads(record['generic'])
+        record['sections'] = json.loads(record['sections'])
+        age = time.time() - record['updated']
+        record['age'] = age
+        record['fresh'] = age < KNOWLEDGE_TTL
+        return record
+
+    def put(self, name, generic, answer, model=None, label_text=None):
+        """
+        Store or replace the record of a medicine.
+
+        Args:
+            name (str): Medicine name the answer is about
+            generic (list): Generic names of the medicine
+            answer (str): Structured answer from the LLM
+            model (str): Model that wrote the answer
+            label_text (str): OCR text the answer was generated from
+
+        Returns:
+            dict: The stored record
+        """
+        key = normalize_name(name)
+        sections = parse_sections(answer)
+        # Generic names only help full-text ranking, see the class docstring
+        names = sorted({key, *(normalize_name(g) for g in generic)} - {''})
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO medicines (key, name, generic, sections, answer, model, label_text, "
+                "created, updated, checked) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET name = excluded.name, generic = excluded.generic, "
+                "sections = excluded.sections, answer = excluded.answer, model = excluded.model, "
+                "label_text = COALESCE(excluded.label_text, medicines.label_text), "
+                "updated = excluded.updated, checked = excluded.checked",
+                (key, name, json.dumps(generic), json.dumps(sections), answer, model, label_text, now, now, now))
+            self._conn.execute("INSERT OR IGNORE INTO aliases (alias, key) VALUES (?, ?)", (key, key))
+            if self.fts:
+                self._conn.execute("DELETE FROM medicines_fts WHERE key = ?", (key,))
+                self._conn.execute(
+                    "INSERT INTO medicines_fts (key, names, body) VALUES (?, ?, ?)",
+                    (key, ' '.join(names), answer))
+            row = self._conn.execute("SELECT * FROM medicines WHERE key = ?", (key,)).fetchone()
+        return self._record(row)
+
+    def get(self, name):
+        """
+        Return the record of a medicine by its canonical name.
+
+        A generic name does not return the brand or combination products
+        containing it.
+
+        Returns:
+            dict: The record with 'fresh' and 'age' added, or None
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT m.* FROM medicines m JOIN aliases a ON a.key = m.key WHERE a.alias = ? "
+                "ORDER BY m.requests DESC LIMIT 1", (key,)).fetchone()
+        return self._record(row) if row is not None else None
+
+    def match_text(self, text):
+        """
+        Find the record whose name matches a word of OCR text.
+
+        A word that is a stored name matches outright. Otherwise label
+        words are compared to the stored names by their trigrams, so a
+        misread letter still matches, but only a name at least
+        FUZZY_MIN_SIMILARITY similar and within FUZZY_MAX_LENGTH_DIFFERENCE
+        letters of the word's length.
+
+        Returns:
+            dict: The record, or None
+        """
+        words = {normalize_name(word) for word in re.findall(r'[A-Za-z][A-Za-z-]{3,}', text or '')}
+        words.discard('')
+        if not words:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT a.key FROM aliases a JOIN medicines m ON m.key = a.key WHERE a.alias IN ("
+                + ', '.join('?' for _ in words) + ") ORDER BY m.requests DESC LIMIT 1", sorted(words)).fetchone()
+        if row is not None:
+            return self.get(row['key'])
+
+        with self._lock:
+            if self.fts == 'trigram':
+                grams = sorted({gram for word in words for gram in _trigrams(word)})
+                query = 'names : (' + ' OR '.join(f'"{gram}"' for gram in grams) + ')'
+                keys = [row['key'] for row in self._conn.execute(
+                    "SELECT key FROM medicines_fts WHERE medicines_fts MATCH ? "
+                    "ORDER BY bm25(medicines_fts) LIMIT 20", (query,))]
+            else:
+                keys = [row['key'] for row in self._conn.execute(
+                    "SELECT DISTINCT key FROM aliases WHERE "
+                    + ' OR '.join('alias LIKE ?' for _ in words) + " LIMIT 50",
+                    [f'%{word[:4]}%' for word in words])]
+            # Compare against the names themselves, never the generics the index ranked by
+            rows = self._conn.execute(
+                "SELECT key, group_concat(alias, ' ') AS names FROM aliases WHERE key IN ("
+                + ', '.join('?' for _ in keys) + ") GROUP BY key", keys).fetchall() if keys else []
+
+        best, best_similarity = None, FUZZY_MIN_SIMILARITY
+        for row in rows:
+            for alias in row['names'].split():
+                for word in words:
+                    if abs(len(word) - len(alias)) > FUZZY_MAX_LENGTH_DIFFERENCE:
+                        continue
+                    similarity = difflib.SequenceMatcher(None, word, alias).ratio()
+                    if similarity >= best_similarity:
+                        best, best_similarity = row['key'], similarity
+        return self.get(best) if best is not None else None
+
+    def find(self, medicine_name='', text=''):
+        """
+        Look a medicine up for a scan, by name first and by label text if
+        no name was resolved.
+
+        Records past KNOWLEDGE_MAX_AGE count as missing; stale ones are
+        returned and left for the background refresh.
+
+        Args:
+            medicine_name (str): Resolved medicine name, may be empty
+            text (str): OCR text of the label
+
+        Returns:
+            dict: The record, or None on a miss
+        """
+        with metrics.span('knowledge'):
+            record = self.get(medicine_name) if medicine_name else self.match_text(text)
+        if record is None or record['age'] > KNOWLEDGE_MAX_AGE:
+            self.misses += 1
+            return None
+
+        if record['fresh']:
+            self.hits += 1
+        else:
+            self.stale_served += 1
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE medicines SET requests = requests + 1 WHERE key = ?", (record['key'],))
+        return record
+
+    def search(self, query, limit=10):
+        """
+        Full-text search over the names and answers of all records.
+
+        Returns:
+            list: Matching records, best first
+        """
+        terms = [term for term in re.findall(r'\w+', query.lower()) if len(term) >= 3]
+        if not terms:
+            return []
+        with self._lock:
+            if self.fts:
+                rows = self._conn.execute(
+                    "SELECT m.* FROM medicines_fts f JOIN medicines m ON m.key = f.key "
+                    "WHERE medicines_fts MATCH ? ORDER BY bm25(medicines_fts) LIMIT ?",
+                    (' AND '.join(f'"{term}"' for term in terms), limit)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM medicines WHERE " + ' AND '.join('(key || answer) LIKE ?' for _ in terms)
+                    + " ORDER BY requests DESC LIMIT ?", [f'%{term}%' for term in terms] + [limit]).fetchall()
+        return [self._record(row) for row in rows]
+
+    def claim_due(self, limit=KNOWLEDGE_REFRESH_BATCH):
+        """
+        Claim stale records that have not been tried recently, most requested first.
+
+        Every server worker runs a refresh thread over the same database.
+        A record is claimed by marking it checked only if no other process
+        did so first, so each stale record is regenerated, and paid for,
+        by one process.
+
+        Returns:
+            list: The records this process claimed
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT * FROM medicines WHERE updated < ? AND checked < ? "
+                "ORDER BY requests DESC LIMIT ?",
+                (now - KNOWLEDGE_TTL, now - KNOWLEDGE_REFRESH_INTERVAL, limit)).fetchall()
+            claimed = [row for row in rows if self._conn.execute(
+                "UPDATE medicines SET checked = ? WHERE key = ? AND checked < ?",
+                (now, row['key'], now - KNOWLEDGE_REFRESH_INTERVAL)).rowcount]
+        return [self._record(row) for row in claimed]
+
+    def clear(self):
+        """Delete every record."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM medicines")
+            self._conn.execute("DELETE FROM aliases")
+            if self.fts:
+                self._conn.execute("DELETE FROM medicines_fts")
+
+    def stats(self):
+        with self._lock:
+            records, fresh = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(updated >= ?), 0) FROM medicines",
+                (time.time() - KNOWLEDGE_TTL,)).fetchone()
+        total = self.hits + self.stale_served + self.misses
+        return {
+            'records': records,
+            'fresh': fresh,
+            'hits': self.hits,
+            'stale_served': self.stale_served,
+            'misses': self.misses,
+            'hit_ratio': (self.hits + self.stale_served) / total if total else 0.0,
+            'refreshed': self.refreshed,
+            'refresh_failures': self.refresh_failures,
+            'index': self.fts or 'like',
+        }
+
+
+def refresh_record(store, record):
+    """
+    Regenerate one record with a live search and LLM call.
+
+    The record should have been claimed with `KnowledgeStore.claim_due`.
+
+    Returns:
+        bool: Whether the record was updated
+    """
+    # Imported here since LLM itself stores answers through this module
+    import LLM
+
+    search_results = LLM.search_medicine_info(record['name'])
+    candidates = [{'name': record['name'], 'generic': record['generic'], 'score': 1.0}]
+    try:
+        LLM.query_llm(record['label_text'] or record['name'], record['name'], search_results,
+                      raise_errors=True, candidates=candidates)
+    except Exception as e:
+        logger.warning(f"Refreshing '{record['name']}' failed: {str(e)}")
+        store.refresh_failures += 1
+        return False
+
+    updated = store.get(record['key'])
+    if updated is None or updated['updated'] <= record['updated']:
+        store.refresh_failures += 1
+        return False
+    store.refreshed += 1
+    return True
+
+
+def _refresh_loop(store):
+    while True:
+        time.sleep(KNOWLEDGE_REFRESH_INTERVAL)
+        try:
+            for record in store.claim_due():
+                refresh_record(store, record)
+        except Exception as e:
+            logger.error(f"Knowledge refresh failed: {str(e)}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared knowledge store, starting its refresh thread on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore(KNOWLEDGE_DB)
+            if KNOWLEDGE_REFRESH:
+                threading.Thread(target=_refresh_loop, args=(_store,), daemon=True,
+                                 name='knowledge-refresh').start()
+        return _store
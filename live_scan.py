@@ -0,0 +1,236 @@
+import cv2
+import numpy as np
+import json
+import os
+import time
+import logging
+import cache
+import LLM
+import worker_pool
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Frames whose Laplacian variance is below this are too blurry to read
+LIVE_MIN_SHARPNESS = float(os.getenv('LIVE_MIN_SHARPNESS', 60))
+
+# dHash distance to the previous frame above which the camera is still moving
+LIVE_STABLE_DISTANCE = int(os.getenv('LIVE_STABLE_DISTANCE', 10))
+
+# dHash distance to the last OCR'd frame at or below which a frame adds nothing new
+LIVE_DUPLICATE_DISTANCE = int(os.getenv('LIVE_DUPLICATE_DISTANCE', 3))
+
+# At most one full OCR pass per this many seconds, on the best frame seen
+LIVE_OCR_INTERVAL = float(os.getenv('LIVE_OCR_INTERVAL', 1.0))
+
+# Share of one core a connection may keep busy with OCR
+LIVE_CPU_SHARE = float(os.getenv('LIVE_CPU_SHARE', 0.5))
+
+# A name resolves once its score summed over frames reaches this and it
+# holds this share of all the votes, or at once on a near-certain read;
+# a label held perfectly still yields one read, as repeats are skipped
+LIVE_RESOLVE_SCORE = float(os.getenv('LIVE_RESOLVE_SCORE', 1.5))
+LIVE_RESOLVE_SHARE = 0.6
+LIVE_CERTAIN_SCORE = float(os.getenv('LIVE_CERTAIN_SCORE', 0.9))
+
+LIVE_MAX_FRAME_BYTES = int(os.getenv('LIVE_MAX_FRAME_BYTES', 2 * 1024 * 1024))
+
+# Connections are closed after this long without a resolved name
+LIVE_MAX_SECONDS = float(os.getenv('LIVE_MAX_SECONDS', 120))
+
+
+def sharpness(gray):
+    """Variance of the Laplacian, a cheap focus measure; higher is sharper."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class LiveScanSession:
+    """
+    State of one continuous camera scan.
+
+    Frames are gated cheaply on arrival: blurry frames, frames taken while
+    the camera moves and frames identical to the last one read are
+    dropped. Of the rest, the sharpest frame of each interval gets a full
+    OCR pass on the worker pool. Name candidates are accumulated across
+    passes until one clearly wins.
+
+    Args:
+        cpu_share (float): Share of one core this session may use for OCR
+        interval (float): Minimum seconds between OCR passes
+    """
+
+    def __init__(self, cpu_share=LIVE_CPU_SHARE, interval=LIVE_OCR_INTERVAL):
+        self.cpu_share = cpu_share
+        self.interval = interval
+        self.frames = 0
+        self.passes = 0
+        self.votes = {}
+        self.generics = {}
+        self.best = None
+        self.resolved = None
+        self._previous_hash = None
+        self._read_hash = None
+        self._candidate = None
+        self._future = None
+        self._pass_frame = None
+        self._pass_started = None
+        self._next_pass = time.monotonic()
+
+    def offer(self, frame_bytes):
+        """
+        Gate an incoming frame.
+
+        Returns:
+            dict: 'frame' message with the frame's 'status' ('blurry',
+            'moving', 'duplicate' or 'candidate') and 'sharpness'
+        """
+        self.frames += 1
+        if len(frame_bytes) > LIVE_MAX_FRAME_BYTES:
+            return {'type': 'frame', 'status': 'too_large'}
+
+        # Gate on a half size grayscale decode, far cheaper than a full one
+        gray = cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        if gray is None:
+            return {'type': 'frame', 'status': 'invalid'}
+
+        focus = sharpness(gray)
+        phash = cache.dhash(gray)
+        previous, self._previous_hash = self._previous_hash, phash
+
+        if focus < LIVE_MIN_SHARPNESS:
+            status = 'blurry'
+        elif previous is not None and cache.hamming(phash, previous) > LIVE_STABLE_DISTANCE:
+            status = 'moving'
+        elif self._read_hash is not None and cache.hamming(phash, self._read_hash) <= LIVE_DUPLICATE_DISTANCE:
+            status = 'duplicate'
+        else:
+            status = 'candidate'
+            if self._candidate is None or focus > self._candidate[0]:
+                self._candidate = (focus, phash, frame_bytes)
+        return {'type': 'frame', 'status': status, 'sharpness': round(focus, 1)}
+
+    def _start_pass(self):
+        focus, phash, frame_bytes = self._candidate
+        try:
+            self._future = worker_pool.submit_extract(frame_bytes)
+        except worker_pool.PoolSaturated as e:
+            # Try again with a fresh frame once the pool has drained a bit
+            self._candidate = None
+            self._next_pass = time.monotonic() + e.retry_after
+            return {'type': 'busy', 'retry_after': e.retry_after}
+        self._candidate = None
+        self._read_hash = phash
+        self._pass_frame = frame_bytes
+        self._pass_started = time.monotonic()
+        return None
+
+    def _finish_pass(self):
+        future, self._future = self._future, None
+        try:
+            result = worker_pool.wait_extract(future)
+        except Exception as e:
+            logger.warning(f"Live scan OCR failed: {str(e)}")
+            self._next_pass = time.monotonic() + self.interval
+            return {'type': 'error', 'error': str(e)}
+
+        # Keep this connection under its CPU share: after t seconds of
+        # OCR, wait until t / share seconds have passed since it started
+        busy = result['timings'].get('total', time.monotonic() - self._pass_started)
+        self._next_pass = max(self._pass_started + self.interval, self._pass_started + busy / self.cpu_share)
+        self.passes += 1
+
+        identified = LLM.identify_medicine(result['text'], result['words'])
+        for candidate in identified['medicine_candidates']:
+            self.votes[candidate['name']] = self.votes.get(candidate['name'], 0.0) + candidate['score']
+            self.generics[candidate['name']] = candidate['generic']
+        if self.best is None or result['confidence'] > self.best[0]['confidence']:
+            self.best = (result, self._pass_frame)
+
+        ranking = self.ranking()
+        total = sum(self.votes.values())
+        candidates = identified['medicine_candidates']
+        if candidates and candidates[0]['score'] >= LIVE_CERTAIN_SCORE and candidates[0]['name'] == ranking[0]['name']:
+            self.resolved = ranking[0]['name']
+        elif ranking and ranking[0]['score'] >= LIVE_RESOLVE_SCORE and ranking[0]['score'] >= LIVE_RESOLVE_SHARE * total:
+            self.resolved = ranking[0]['name']
+
+        return {
+            'type': 'ocr',
+            'passes': self.passes,
+            'frames': self.frames,
+            'confidence': result['confidence'],
+            'candidates': ranking[:3],
+            'resolved': self.resolved is not None,
+        }
+
+    def poll(self):
+        """
+        Advance the OCR pipeline without blocking.
+
+        Returns:
+            list: Messages to send to the client
+        """
+        messages = []
+        if self._future is not None and self._future.done():
+            messages.append(self._finish_pass())
+        if (self._future is None and self.resolved is None and self._candidate is not None
+                and time.monotonic() >= self._next_pass):
+            message = self._start_pass()
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def ranking(self):
+        """Accumulated name scores, best first."""
+        ranked = sorted(self.votes.items(), key=lambda item: item[1], reverse=True)
+        return [{'name': name, 'generic': self.generics[name], 'score': round(score, 3)} for name, score in ranked]
+
+    def identified(self):
+        """The accumulated names in the form returned by `LLM.identify_medicine`."""
+        total = sum(self.votes.values()) or 1.0
+        return {
+            'medicine_name': self.resolved or '',
+            'medicine_candidates': [dict(entry, score=entry['score'] / total) for entry in self.ranking()],
+        }
+
+    def close(self):
+        if self._future is not None:
+            self._future.cancel()
+
+
+def serve(ws, on_resolved=None):
+    """
+    Run a live scan over a WebSocket.
+
+    The client sends encoded frames as binary messages and gets JSON
+    messages back: 'frame' (gating verdict), 'ocr' (accumulated candidates
+    after each pass), 'busy', 'error' and finally 'resolved'.
+
+    Args:
+        ws: flask-sock WebSocket
+        on_resolved (callable): Called with the session once a name
+            resolves; returns a dict merged into the 'resolved' message
+    """
+    session = LiveScanSession()
+    started = time.monotonic()
+    try:
+        while time.monotonic() - started < LIVE_MAX_SECONDS:
+            message = ws.receive(timeout=0.1)
+            if isinstance(message, (bytes, bytearray)):
+                ws.send(json.dumps(session.offer(bytes(message))))
+            for update in session.poll():
+                ws.send(json.dumps(update))
+
+            if session.resolved is not None:
+                result, _ = session.best
+                resolved = dict(session.identified(), type='resolved', extracted_text=result['text'])
+                if on_resolved is not None:
+                    resolved.update(on_resolved(session))
+                ws.send(json.dumps(resolved))
+                break
+        else:
+            ws.send(json.dumps({'type': 'timeout'}))
+    finally:
+        session.close()
+        logger.info(f"Live scan ended after {session.frames} frames and {session.passes} OCR passes")
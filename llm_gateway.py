@@ -0,0 +1,379 @@
+import hashlib
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from dotenv import load_dotenv
+import cache
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables once, not on every call
+load_dotenv()
+
+LLM_MODEL = os.getenv('LLM_MODEL', "llama3-70b-8192")
+
+# Deadline for one completion, retries and hedges included, in seconds
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 3.05))
+
+# Retries after a transient failure, with full-jitter exponential backoff
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', 2))
+LLM_BACKOFF = float(os.getenv('LLM_BACKOFF', 0.5))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 4))
+
+# Hedging: if a completion is slower than the recent p95, send a second
+# identical request and take whichever answers first. Off by default
+# since a hedge costs a second completion.
+LLM_HEDGE = os.getenv('LLM_HEDGE', '').lower() in ('1', 'true', 'yes')
+LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', 8))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 32))
+
+
+class LLMTimeout(Exception):
+    """Raised when a completion does not finish within its deadline."""
+
+
+class LLMTruncated(Exception):
+    """
+    Raised when a completion stopped at max_tokens instead of finishing.
+
+    Args:
+        text (str): The text generated up to the cut; streams have already
+            sent it chunk by chunk
+    """
+
+    def __init__(self, text):
+        super().__init__("The LLM answer was cut off at max_tokens")
+        self.text = text
+
+
+def is_retryable(error):
+    """Whether an API error is transient and worth another attempt."""
+    import groq
+
+    if isinstance(error, groq.APIConnectionError):  # Includes timeouts
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def coalesce_key(medicine_name, search_results, **params):
+    """
+    Key under which concurrent completions for the same medicine share one call.
+
+    Args:
+        medicine_name (str): Normalized medicine name
+        search_results (str): Search results given to the LLM
+        **params: Completion parameters that change the answer, e.g. model
+
+    Returns:
+        tuple: Hashable key
+    """
+    digest = hashlib.sha256((search_results or '').encode('utf-8')).hexdigest()
+    return (medicine_name, digest) + tuple(sorted(params.items()))
+
+
+class _Broadcast:
+    """Chunks of one streamed completion, replayed to every subscriber."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def push(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.error = error
+            self.done = True
+            self._condition.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMGateway:
+    """
+    Long-lived access point for chat completions.
+
+    One Groq client with a pooled HTTP connection is shared by every
+    request. Each completion gets a deadline, transient failures are
+    retried with jittered backoff, slow calls can be hedged, and
+    concurrent calls with the same key share one upstream completion.
+
+    Args:
+        timeout (float): Default deadline per completion in seconds
+        retries (int): Retries after a transient failure
+        hedge (bool): Send a second request when the first is slower than the recent p95
+    """
+
+    def __init__(self, timeout=LLM_TIMEOUT, retries=LLM_RETRIES, hedge=LLM_HEDGE):
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self._client = None
+        self._api_key = None
+        self._client_lock = threading.Lock()
+        self._flight = cache.SingleFlight()
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix='llm') if hedge else None
+        self.calls = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.stream_coalesced = 0
+        self.errors = 0
+        self.truncated = 0
+
+    @property
+    def client(self):
+        """The shared Groq client, rebuilt only if the API key changes."""
+        # The SDK takes a while to import, so it is loaded on first use
+        import groq
+        import httpx
+
+        api_key = os.getenv('GROQ_API_KEY')
+        with self._client_lock:
+            if self._client is None or api_key != self._api_key:
+                http_client = groq.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE))
+                # Retries are handled here, under the call's deadline
+                self._client = groq.Groq(api_key=api_key, max_retries=0, http_client=http_client)
+                self._api_key = api_key
+            return self._client
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging: the p95 of recent completions."""
+        if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DELAY
+        latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _timeout(self, deadline):
+        import httpx
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeout(f"LLM did not answer within {self.timeout:g} seconds")
+        return httpx.Timeout(remaining, connect=min(LLM_CONNECT_TIMEOUT, remaining))
+
+    def _attempt(self, messages, params, deadline):
+        started = time.monotonic()
+        completion = self.client.with_options(timeout=self._timeout(deadline)).chat.completions.create(
+            messages=messages, **params)
+        self._latencies.append(time.monotonic() - started)
+        choice = completion.choices[0]
+        if choice.finish_reason == 'length':
+            raise LLMTruncated(choice.message.content)
+        return choice.message.content
+
+    def _hedged(self, messages, params, deadline):
+        """Run one attempt, racing a second one if the first is slow."""
+        if not self.hedge:
+            return self._attempt(messages, params, deadline)
+
+        first = self._executor.submit(self._attempt, messages, params, deadline)
+        try:
+            return first.result(timeout=min(self.hedge_delay(), max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            pass
+
+        self.hedged += 1
+        second = self._executor.submit(self._attempt, messages, params, deadline)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise LLMTimeout(f"LLM did not answer within {self.timeout:g} seconds")
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _complete(self, messages, params, deadline):
+        for attempt in range(self.retries + 1):
+            try:
+                return self._hedged(messages, params, deadline)
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                backoff = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** attempt))
+                if time.monotonic() + backoff >= deadline:
+                    raise
+                logger.warning(f"LLM call failed ({str(e)}), retrying in {backoff:.2f}s")
+                self.retried += 1
+                time.sleep(backoff)
+
+    def complete(self, messages, key=None, timeout=None, **params):
+        """
+        Return the content of a chat completion.
+
+        Args:
+            messages (list): Chat messages
+            key: Calls with the same key that overlap in time share one
+                completion; None to always call the API
+            timeout (float): Deadline in seconds, defaults to the gateway's
+            **params: Completion parameters such as temperature and max_tokens
+
+        Returns:
+            str: The completion text
+
+        Raises:
+            LLMTimeout: If no answer arrived before the deadline
+            LLMTruncated: If the answer was cut off at max_tokens
+            groq.APIError: If the API failed and retries did not help
+        """
+        params.setdefault('model', LLM_MODEL)
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        def call():
+            self.calls += 1
+            try:
+                with metrics.span('llm'):
+                    return self._complete(messages, params, deadline)
+            except LLMTruncated:
+                self.truncated += 1
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+
+        if key is None:
+            return call()
+        return self._flight.do(key, call)
+
+    def _produce(self, broadcast, key, messages, params, deadline):
+        """Stream a completion into `broadcast`, retrying until the first chunk arrives."""
+        started = time.monotonic()
+        truncated = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    stream = self.client.with_options(timeout=self._timeout(deadline)).chat.completions.create(
+                        messages=messages, stream=True, **params)
+                    for chunk in stream:
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            if not broadcast.chunks:
+                                metrics.record('llm.first_token', time.monotonic() - started)
+                            broadcast.push(token)
+                        if chunk.choices and chunk.choices[0].finish_reason == 'length':
+                            truncated = True
+                    break
+                except Exception as e:
+                    # Once text has been sent a retry would repeat it
+                    if broadcast.chunks or attempt == self.retries or not is_retryable(e):
+                        raise
+                    backoff = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** attempt))
+                    if time.monotonic() + backoff >= deadline:
+                        raise
+                    self.retried += 1
+                    time.sleep(backoff)
+            metrics.record('llm', time.monotonic() - started)
+            if truncated:
+                self.truncated += 1
+                broadcast.finish(LLMTruncated(''.join(broadcast.chunks)))
+            else:
+                broadcast.finish()
+        except Exception as e:
+            self.errors += 1
+            broadcast.finish(e)
+        finally:
+            if key is not None:
+                with self._streams_lock:
+                    if self._streams.get(key) is broadcast:
+                        del self._streams[key]
+
+    def stream(self, messages, key=None, timeout=None, **params):
+        """
+        Stream a chat completion chunk by chunk.
+
+        The completion is read in a background thread, so a client that
+        disconnects does not stall others sharing the same key; late
+        subscribers first get every chunk sent so far.
+
+        Args:
+            messages (list): Chat messages
+            key: Calls with the same key that overlap in time share one stream
+            timeout (float): Deadline in seconds, defaults to the gateway's
+            **params: Completion parameters such as temperature and max_tokens
+
+        Yields:
+            str: Consecutive chunks of the completion
+
+        Raises:
+            LLMTruncated: After the last chunk, if the answer was cut off at max_tokens
+        """
+        params.setdefault('model', LLM_MODEL)
+        with self._streams_lock:
+            broadcast = self._streams.get(key) if key is not None else None
+            if broadcast is not None:
+                self.stream_coalesced += 1
+            else:
+                broadcast = _Broadcast()
+                if key is not None:
+                    self._streams[key] = broadcast
+                self.calls += 1
+                deadline = time.monotonic() + (timeout or self.timeout)
+                threading.Thread(target=self._produce, args=(broadcast, key, messages, params, deadline),
+                                 daemon=True).start()
+        yield from broadcast
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self._flight.coalesced + self.stream_coalesced,
+            'retried': self.retried,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'errors': self.errors,
+            'truncated': self.truncated,
+            'hedge_delay': self.hedge_delay() if self.hedge else None,
+        }
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Return the shared LLM gateway, creating it on first use."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import logging
+import knowledge_store
+import llm_gateway
+import metrics
+from search import normalize_name
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Clear, unambiguous labels go to the small model, the rest to the large one
+LLM_SMALL_MODEL = os.getenv('LLM_SMALL_MODEL', "llama3-8b-8192")
+LLM_LARGE_MODEL = llm_gateway.LLM_MODEL
+
+# The small model is used only when the name scores at least this high ...
+ROUTE_MIN_SCORE = float(os.getenv('LLM_ROUTE_MIN_SCORE', 0.75))
+
+# ... and every unrelated name scores below this share of it
+ROUTE_MAX_RIVAL = float(os.getenv('LLM_ROUTE_MAX_RIVAL', 0.7))
+
+# Search outcomes that leave the LLM without reference material
+SEARCH_FAILURES = (
+    "No information found",
+    "Google Search API configuration is missing",
+    "Search is temporarily unavailable",
+    "Error searching",
+)
+
+ROUTES = metrics.counter('scanner_llm_routes', 'LLM routing decisions by tier and reason')
+
+
+def searched(search_results):
+    """Whether a search returned reference material for the LLM."""
+    return bool(search_results) and not search_results.startswith(SEARCH_FAILURES)
+
+
+class LLMRouter:
+    """
+    Picks how a medicine information request is answered.
+
+    A medicine with a fresh record in the knowledge store is answered from
+    it without calling the LLM. Otherwise a clearly identified medicine
+    with search results goes to the small model, and low-confidence or
+    conflicting names go to the large one; the answer then becomes the
+    medicine's record. Each decision is logged with its latency.
+
+    Args:
+        store (KnowledgeStore): Where answers are kept, the shared store by default
+    """
+
+    def __init__(self, store=None):
+        self.store = store or knowledge_store.get_store()
+        self.counts = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def cached(self, key):
+        """Return the fresh stored answer for a canonical medicine name, or None."""
+        record = self.store.get(key)
+        return record['answer'] if record is not None and record['fresh'] else None
+
+    def route(self, medicine_name, candidates, search_results, label_text=None):
+        """
+        Decide how to answer a request.
+
+        Args:
+            medicine_name (str): Name the answer is about
+            candidates (list): Ranked name candidates from `LLM.identify_medicine`
+            search_results (str): Search results given to the LLM
+            label_text (str): OCR text, kept with a stored answer
+
+        Returns:
+            dict: 'tier' ('cache', 'small' or 'large'), 'reason', 'model'
+            (None for the cache), 'key' (canonical name), 'answer' (cached
+            text or None), 'storable' (whether a fresh answer may be stored)
+            and what storing it needs
+        """
+        key = normalize_name(medicine_name)
+        chosen = next((candidate for candidate in candidates if normalize_name(candidate['name']) == key), None)
+        decision = {
+            'key': key,
+            'name': medicine_name,
+            'generic': chosen['generic'] if chosen is not None else [],
+            'label_text': label_text,
+            'answer': None,
+            'started': time.monotonic(),
+        }
+
+        found = searched(search_results)
+        # Only names from the lexicon with reference material are worth reusing
+        decision['storable'] = chosen is not None and found
+
+        answer = self.cached(key) if decision['storable'] else None
+        if answer is not None:
+            return dict(decision, tier='cache', reason='answered_before', model=None, answer=answer)
+
+        if chosen is None:
+            reason = 'unknown_name'
+        elif not found:
+            reason = 'no_search_results'
+        elif chosen['score'] < ROUTE_MIN_SCORE:
+            reason = 'low_confidence'
+        elif any(candidate['score'] >= ROUTE_MAX_RIVAL * chosen['score']
+                 and not set(candidate['generic']) & set(chosen['generic'])
+                 for candidate in candidates if candidate is not chosen):
+            reason = 'conflicting_names'
+        else:
+            return dict(decision, tier='small', reason='clear_label', model=LLM_SMALL_MODEL)
+        return dict(decision, tier='large', reason=reason, model=LLM_LARGE_MODEL)
+
+    def finish(self, decision, answer=None):
+        """
+        Record the outcome of a routed request.
+
+        Args:
+            decision (dict): Output of `route`
+            answer (str): Generated answer to store for the medicine, if any
+        """
+        elapsed = time.monotonic() - decision['started']
+        if answer and decision['tier'] != 'cache' and decision['storable']:
+            self.store.put(decision['name'], decision['generic'], answer, decision['model'], decision['label_text'])
+
+        tier = decision['tier']
+        with self._lock:
+            self.counts[tier] = self.counts.get(tier, 0) + 1
+            self.seconds[tier] = self.seconds.get(tier, 0.0) + elapsed
+        ROUTES.inc(tier=tier, reason=decision['reason'])
+        metrics.record(f'llm.{tier}', elapsed)
+        logger.info(f"LLM route '{tier}' ({decision['reason']}) for '{decision['key']}' "
+                    f"took {elapsed * 1000:.0f} ms")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'routes': dict(self.counts),
+                'mean_seconds': {tier: self.seconds[tier] / count for tier, count in self.counts.items()},
+            }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the shared LLM router, creating it on first use."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter()
+        return _router
@@ -0,0 +1,689 @@
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from benchmark import build_corpus, summarize
+from stubs import StubServer
+
+# psutil gives process metrics on every platform; without it they are
+# read from /proc, which only Linux has
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ('/api/process', '/api/process_camera')
+
+# Files that are safely written by several requests at once, since SQLite
+# and logging do their own locking
+SHARED_WRITE_OK = ('.db', '.db-wal', '.db-shm', '.db-journal', '.sqlite', '.log')
+
+# Growth between the first and last quarter of a run, after warm-up,
+# that counts as a leak
+LEAK_THRESHOLDS = {
+    'rss_mb': 32.0,
+    'traced_mb': 16.0,
+    'fds': 8,
+    'temp_files': 5,
+    'temp_mb': 1.0,
+}
+
+# Fewest samples after warm-up for a trend to mean anything
+MIN_TREND_SAMPLES = 8
+
+
+def parse_duration(value):
+    """Seconds in a duration such as '90', '90s', '30m' or '4h'."""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def process_tree(pid):
+    """The pid and those of all its descendants, such as the OCR workers."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return [pid] + [child.pid for child in process.children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            tasks = os.listdir(f"/proc/{current}/task")
+        except OSError:
+            continue
+        pids.append(current)
+        for task in tasks:
+            try:
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+    return pids
+
+
+def _open_files(pid):
+    """(path, writable) for the regular files a process has open."""
+    if psutil is not None:
+        try:
+            return [(f.path, 'r' != getattr(f, 'mode', 'r')) for f in psutil.Process(pid).open_files()]
+        except psutil.Error:
+            return []
+
+    files = []
+    try:
+        fds = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return files
+    for fd in fds:
+        try:
+            path = os.readlink(f"/proc/{pid}/fd/{fd}")
+            if not path.startswith('/'):
+                continue  # sockets, pipes and the like
+            with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+                flags = int(next(line for line in f if line.startswith('flags:')).split()[1], 8)
+        except (OSError, StopIteration, ValueError):
+            continue
+        files.append((path, flags & os.O_ACCMODE != os.O_RDONLY))
+    return files
+
+
+def _usage(pid):
+    """(RSS in MiB, open file descriptors or None) of one process."""
+    if psutil is not None:
+        process = psutil.Process(pid)
+        fds = process.num_fds() if hasattr(process, 'num_fds') else None  # not on Windows
+        return process.memory_info().rss / (1024.0 * 1024.0), fds
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return rss / (1024.0 * 1024.0), len(os.listdir(f"/proc/{pid}/fd"))
+
+
+def process_stats(pid):
+    """
+    Resource usage of a process and its descendants.
+
+    Args:
+        pid (int): Process to measure
+
+    Returns:
+        dict: 'processes', 'rss_mb' and 'fds' summed over the tree (None
+        where the platform cannot tell), and 'shared_writes', the paths
+        currently open for writing more than once
+    """
+    stats = {'processes': 0, 'rss_mb': 0.0, 'fds': 0, 'shared_writes': []}
+    writers = {}
+    for current in process_tree(pid):
+        try:
+            rss, fds = _usage(current)
+        except Exception:
+            continue  # exited while sampling
+        stats['processes'] += 1
+        stats['rss_mb'] += rss
+        stats['fds'] = None if stats['fds'] is None or fds is None else stats['fds'] + fds
+        for path, writable in _open_files(current):
+            if writable and not path.endswith(SHARED_WRITE_OK):
+                writers[path] = writers.get(path, 0) + 1
+
+    if not stats['processes']:
+        return {'processes': 0, 'rss_mb': None, 'fds': None, 'shared_writes': []}
+    stats['rss_mb'] = round(stats['rss_mb'], 1)
+    stats['shared_writes'] = sorted(path for path, count in writers.items() if count > 1)
+    return stats
+
+
+def dir_usage(paths):
+    """Files and MiB under the given directories."""
+    files, size = 0, 0
+    for path in paths:
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                    files += 1
+                except OSError:
+                    pass  # removed while walking
+    return files, round(size / (1024.0 * 1024.0), 2)
+
+
+class WriteAudit:
+    """
+    Records which files this process opens for writing, and from which threads.
+
+    Uses a `sys.addaudithook` hook, so it sees every `open` and `os.open`
+    made from Python code, but not files written by C libraries such as
+    `cv2.imwrite`; those are caught by the open file scan in
+    `process_stats` instead. A file written from several request threads
+    is a fixed path shared between requests; writes from different
+    threads less than `overlap` seconds apart likely race.
+
+    Args:
+        overlap (float): Seconds within which two writes count as concurrent
+    """
+
+    def __init__(self, overlap=1.0):
+        self.overlap = overlap
+        self.paths = {}
+        self.active = False
+        self._lock = threading.Lock()
+
+    def install(self):
+        # Audit hooks cannot be removed again; `active` switches it off
+        sys.addaudithook(self._hook)
+        self.active = True
+        return self
+
+    def _hook(self, event, args):
+        if event != 'open' or not self.active:
+            return
+        try:
+            path, mode, flags = args
+            if path is None or isinstance(path, int):
+                return
+            if mode is not None:
+                writing = any(char in mode for char in 'wax+')
+            else:
+                writing = bool(flags & (os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT))
+            path = os.path.abspath(os.fsdecode(path))
+            # Unnamed temporary files (upload spooling) are opened by directory
+            if not writing or path.endswith(SHARED_WRITE_OK) or os.path.isdir(path):
+                return
+
+            now = time.monotonic()
+            thread = threading.get_ident()
+            with self._lock:
+                entry = self.paths.setdefault(path, {'writes': 0, 'threads': set(), 'overlaps': 0, 'last': {}})
+                entry['writes'] += 1
+                entry['threads'].add(thread)
+                recent = {other: seen for other, seen in entry['last'].items() if now - seen < self.overlap}
+                if any(other != thread for other in recent):
+                    entry['overlaps'] += 1
+                recent[thread] = now
+                entry['last'] = recent
+        except Exception:
+            pass  # never break the code under test
+
+    def report(self):
+        """Files written from more than one thread, the most concurrent first."""
+        with self._lock:
+            shared = [
+                {'path': path, 'writes': entry['writes'], 'threads': len(entry['threads']),
+                 'overlaps': entry['overlaps']}
+                for path, entry in self.paths.items() if len(entry['threads']) > 1
+            ]
+        return sorted(shared, key=lambda entry: (entry['overlaps'], entry['writes']), reverse=True)
+
+
+def find_leaks(samples, warmup):
+    """
+    Flag resources that keep growing once the server is warm.
+
+    A metric leaks when the median of the last quarter of the samples
+    after `warmup` exceeds that of the first quarter by its
+    LEAK_THRESHOLDS entry and is still rising: caches filling up to
+    their limit level off, leaks do not.
+
+    Args:
+        samples (list): Resource samples, each with 'elapsed' in seconds
+        warmup (float): Seconds at the start to leave out
+
+    Returns:
+        list: Dicts with 'metric', 'start', 'end' and 'per_hour' (the slope)
+    """
+    steady = [sample for sample in samples if sample['elapsed'] >= warmup]
+    if len(steady) < MIN_TREND_SAMPLES:
+        return []
+
+    leaks = []
+    quarter = len(steady) // 4
+    for metric, threshold in LEAK_THRESHOLDS.items():
+        points = [(sample['elapsed'], sample[metric]) for sample in steady if sample.get(metric) is not None]
+        if len(points) < MIN_TREND_SAMPLES:
+            continue
+        times, values = np.array(points, dtype=float).T
+        start = float(np.median(values[:quarter]))
+        before_end = float(np.median(values[-2 * quarter:-quarter]))
+        end = float(np.median(values[-quarter:]))
+        slope = float(np.polyfit(times, values, 1)[0]) * 3600
+        if end - start >= threshold and end - before_end >= threshold / 4.0 and slope > 0:
+            leaks.append({'metric': metric, 'start': round(start, 2), 'end': round(end, 2), 'per_hour': round(slope, 2)})
+    return leaks
+
+
+class LoadGenerator:
+    """
+    Sends scan requests to the app and records their outcome.
+
+    With a `rate` requests arrive at random (Poisson) intervals whatever
+    the response times, as real users would, and arrivals finding all
+    `concurrency` slots busy are dropped; without one every slot sends
+    its next request as soon as the last one returns.
+
+    Args:
+        base_url (str): Address of the app
+        corpus (list): (name, bytes) images to send
+        concurrency (int): Requests in flight at most
+        rate (float): Mean arrivals per second, or 0 for back to back requests
+        camera_share (float): Share of requests sent to /api/process_camera
+        repeat_share (float): Share of requests that resend an image unchanged,
+            which the result cache may answer; the rest are made unique
+        timeout (float): Seconds before a request is abandoned
+        seed (int): Seed for the arrivals and request mix
+    """
+
+    def __init__(self, base_url, corpus, concurrency=8, rate=0.0, camera_share=0.5,
+                 repeat_share=0.2, timeout=60.0, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.corpus = corpus
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.camera_share = camera_share
+        self.repeat_share = repeat_share
+        self.timeout = timeout
+        self.results = []
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _pick(self):
+        with self._lock:
+            name, image_bytes = self._random.choice(self.corpus)
+            endpoint = ENDPOINTS[1] if self._random.random() < self.camera_share else ENDPOINTS[0]
+            if self._random.random() >= self.repeat_share:
+                # Decoders stop at the end of image marker, so trailing bytes
+                # give a new digest for the same pixels
+                image_bytes += self._random.getrandbits(64).to_bytes(8, 'big')
+        return name, endpoint, image_bytes
+
+    def send(self):
+        """Send one request and record its endpoint, status, latency and error."""
+        name, endpoint, image_bytes = self._pick()
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            if endpoint == '/api/process_camera':
+                body = {'image': 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode('ascii')}
+                response = self._session().post(self.base_url + endpoint, json=body, timeout=self.timeout)
+            else:
+                files = {'image': (f"{name.replace(':', '_')}.jpg", image_bytes, 'image/jpeg')}
+                response = self._session().post(self.base_url + endpoint, files=files, timeout=self.timeout)
+            status = response.status_code
+            if status >= 400:
+                error = (response.json() if 'json' in response.headers.get('Content-Type', '') else {}).get(
+                    'error', response.reason)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        except ValueError as e:
+            error = f"Bad response body: {e}"
+        with self._lock:
+            self.results.append((time.monotonic(), endpoint, status, time.perf_counter() - started, error))
+
+    def _send_in_slot(self):
+        try:
+            self.send()
+        finally:
+            self._slots.release()
+
+    def run(self, duration, stop=None):
+        """
+        Generate load for `duration` seconds.
+
+        Args:
+            duration (float): Seconds to run for
+            stop (threading.Event): Ends the run early when set
+        """
+        stop = stop or threading.Event()
+        deadline = time.monotonic() + duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if self.rate > 0:
+                arrival = time.monotonic()
+                while not stop.is_set():
+                    arrival += self._random.expovariate(self.rate)
+                    if arrival >= deadline or stop.wait(max(0.0, arrival - time.monotonic())):
+                        break
+                    if not self._slots.acquire(blocking=False):
+                        with self._lock:
+                            self.dropped += 1
+                        continue
+                    executor.submit(self._send_in_slot)
+            else:
+                def loop():
+                    while not stop.is_set() and time.monotonic() < deadline:
+                        self.send()
+                for _ in range(self.concurrency):
+                    executor.submit(loop)
+
+    def summary(self, since=None):
+        """
+        Latency and error summary of the recorded requests.
+
+        Args:
+            since (float): Only requests finished after this `time.monotonic()`
+
+        Returns:
+            dict: 'requests', 'errors', 'error_rate', 'rejected' (503s, the
+            app shedding load), 'dropped', 'statuses' (count per status
+            code, 'error' for no response), 'errors_seen' (count per error
+            message, rejections left out) and 'latency' (per endpoint, of
+            successful requests only)
+        """
+        with self._lock:
+            results = [result for result in self.results if since is None or result[0] >= since]
+            dropped = self.dropped
+        statuses, errors_seen, latency = {}, {}, {}
+        for _, endpoint, status, seconds, error in results:
+            key = str(status) if status is not None else 'error'
+            statuses[key] = statuses.get(key, 0) + 1
+            if error is None:
+                latency.setdefault(endpoint, []).append(seconds)
+            elif status != 503:
+                errors_seen[str(error)[:120]] = errors_seen.get(str(error)[:120], 0) + 1
+        errors = sum(errors_seen.values())
+        return {
+            'requests': len(results),
+            'errors': errors,
+            'error_rate': round(errors / float(len(results)), 4) if results else 0.0,
+            'rejected': statuses.get('503', 0),
+            'dropped': dropped,
+            'statuses': statuses,
+            'errors_seen': errors_seen,
+            'latency': {endpoint: summarize(values) for endpoint, values in latency.items()},
+        }
+
+
+class ResourceMonitor:
+    """
+    Samples the server's resource usage in the background.
+
+    Every `interval` seconds records RSS and open file descriptors of the
+    server process tree, the files and MiB under the watched temp
+    directories, files open for writing more than once and, when the
+    server runs in this process with tracemalloc on, the traced Python
+    heap. Tracemalloc snapshots are kept for a line-level growth report.
+
+    Args:
+        pid (int): Server process, or None when only the temp dirs can be watched
+        temp_dirs (list): Directories whose growth is tracked
+        interval (float): Seconds between samples
+        generator (LoadGenerator): Progress is logged with its request counts
+    """
+
+    def __init__(self, pid, temp_dirs, interval=5.0, generator=None):
+        self.pid = pid
+        self.temp_dirs = temp_dirs
+        self.interval = interval
+        self.generator = generator
+        self.samples = []
+        self.shared_writes = {}
+        self.baseline_snapshot = None
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        elapsed = time.monotonic() - self.started
+        stats = process_stats(self.pid) if self.pid is not None else {'rss_mb': None, 'fds': None, 'shared_writes': []}
+        temp_files, temp_mb = dir_usage(self.temp_dirs)
+        sample = {
+            'elapsed': round(elapsed, 1),
+            'rss_mb': stats['rss_mb'],
+            'fds': stats['fds'],
+            'temp_files': temp_files,
+            'temp_mb': temp_mb,
+            'traced_mb': round(tracemalloc.get_traced_memory()[0] / (1024.0 * 1024.0), 2)
+            if tracemalloc.is_tracing() else None,
+        }
+        for path in stats['shared_writes']:
+            self.shared_writes[path] = self.shared_writes.get(path, 0) + 1
+        self.samples.append(sample)
+
+        progress = ''
+        if self.generator is not None:
+            summary = self.generator.summary()
+            progress = f"{summary['requests']} requests, {summary['errors']} errors, {summary['rejected']} rejected, "
+        logger.info(
+            f"{elapsed:.0f}s: {progress}RSS {sample['rss_mb']} MiB, {sample['fds']} fds, "
+            f"temp {temp_files} files / {temp_mb} MiB")
+        return sample
+
+    def mark_warm(self):
+        """Take the tracemalloc snapshot later growth is measured against."""
+        if tracemalloc.is_tracing():
+            self.baseline_snapshot = tracemalloc.take_snapshot()
+
+    def top_growth(self, limit=10):
+        """Source lines whose traced allocations grew most since `mark_warm`."""
+        if self.baseline_snapshot is None or not tracemalloc.is_tracing():
+            return []
+        # Leave out the load generator's own bookkeeping
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen *>'),
+                   tracemalloc.Filter(False, __file__)]
+        current = tracemalloc.take_snapshot().filter_traces(filters)
+        growth = current.compare_to(self.baseline_snapshot.filter_traces(filters), 'lineno')
+        return [
+            {'where': str(stat.traceback[0]), 'grew_kb': round(stat.size_diff / 1024.0, 1), 'blocks': stat.count_diff}
+            for stat in growth[:limit] if stat.size_diff > 0
+        ]
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Resource sample failed: {str(e)}")
+
+    def start(self):
+        self.started = time.monotonic()
+        self.sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='resource-monitor')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+
+
+def start_local_server(stub):
+    """
+    Serve the app from this process on a free local port.
+
+    Args:
+        stub (StubServer): Started stub APIs the app is pointed at
+
+    Returns:
+        tuple: (base URL, server) where `server.shutdown()` stops it
+    """
+    from werkzeug.serving import make_server
+
+    stub.configure_env()
+    os.environ.setdefault('SEARCH_RATE', '1000')
+    # Keep load test answers out of the real knowledge store
+    os.environ.setdefault('KNOWLEDGE_DB', ':memory:')
+    os.environ.setdefault('KNOWLEDGE_REFRESH', '0')
+    # Unique uploads must really be scanned, not matched to a similar one
+    os.environ.setdefault('RESULT_CACHE_MAX_DISTANCE', '-1')
+
+    import app
+
+    app.check_config()
+    app.warmup()
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name='app-server').start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def print_report(report):
+    load = report['load']
+    print(f"{'endpoint':<24}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for endpoint, row in load['latency'].items():
+        print(f"{endpoint:<24}{row['count']:>7}{row['p50']:>11.1f}{row['p95']:>11.1f}{row['p99']:>11.1f}{row['max']:>11.1f}")
+    print(f"requests: {load['requests']} in {report['duration']:.0f}s, errors: {load['errors']} "
+          f"({load['error_rate']:.2%}), rejected as busy: {load['rejected']}, dropped arrivals: {load['dropped']}")
+    print(f"statuses: {load['statuses']}")
+    for error, count in load['errors_seen'].items():
+        print(f"  {count} x {error}")
+
+    first, last = report['resources']['first'], report['resources']['last']
+    for metric in ('rss_mb', 'traced_mb', 'fds', 'temp_files', 'temp_mb'):
+        if last.get(metric) is not None:
+            print(f"{metric:<12}{first[metric]:>10} -> {last[metric]:<10} (max {report['resources']['max'][metric]})")
+
+    for leak in report['leaks']:
+        print(f"LEAK {leak['metric']}: {leak['start']} -> {leak['end']} ({leak['per_hour']:+} per hour)")
+    for entry in report['write_races']:
+        print(f"SHARED FILE {entry['path']}: {entry['writes']} writes from {entry['threads']} threads, "
+              f"{entry['overlaps']} concurrent")
+    for path, seen in report['concurrent_open_writes'].items():
+        print(f"CONCURRENT WRITE {path}: open for writing more than once in {seen} sample(s)")
+    if report['heap_growth']:
+        print("largest Python heap growth since warm-up:")
+        for entry in report['heap_growth']:
+            print(f"  {entry['grew_kb']:>10.1f} KiB  {entry['where']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load and soak test the scan endpoints and watch for resource leaks.")
+    parser.add_argument('--duration', default='60s', help="run time, e.g. 300, 30m or 4h (default %(default)s)")
+    parser.add_argument('--warmup', default='30s',
+                        help="start of the run left out of the leak trends, at most a quarter of it")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at most")
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help="mean arrivals per second; 0 sends back to back requests")
+    parser.add_argument('--camera-share', type=float, default=0.5, help="share of requests to /api/process_camera")
+    parser.add_argument('--repeat-share', type=float, default=0.2,
+                        help="share of requests resending an image unchanged")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds before a request is abandoned")
+    parser.add_argument('--corpus', help="directory of extra label images to include")
+    parser.add_argument('--url', help="test a running server instead of one started in this process")
+    parser.add_argument('--pid', type=int, help="pid of the server at --url, to sample its resources")
+    parser.add_argument('--temp-dir', action='append', default=[],
+                        help="extra directory whose growth is tracked (repeatable)")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between resource samples")
+    parser.add_argument('--no-tracemalloc', action='store_true', help="do not trace Python allocations")
+    parser.add_argument('--groq-latency', type=float, default=0.8, help="stub chat completion latency in seconds")
+    parser.add_argument('--search-latency', type=float, default=0.25, help="stub search latency in seconds")
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help="error rate above which the run fails (default %(default)s)")
+    parser.add_argument('--output', help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    duration = parse_duration(args.duration)
+    warmup = min(parse_duration(args.warmup), duration / 4.0)
+    corpus = build_corpus(extra_dir=args.corpus)
+    if not corpus:
+        parser.error("the load test corpus is empty")
+
+    stub, server, audit = None, None, None
+    if args.url:
+        base_url, pid = args.url, args.pid
+    else:
+        if not args.no_tracemalloc:
+            tracemalloc.start()
+        audit = WriteAudit().install()
+        stub = StubServer(groq_latency=args.groq_latency, search_latency=args.search_latency).start()
+        base_url, server = start_local_server(stub)
+        pid = os.getpid()
+
+    import extraction
+
+    temp_dirs = [tempfile.gettempdir(), os.path.abspath(extraction.DEBUG_DIR)] + args.temp_dir
+    generator = LoadGenerator(base_url, corpus, args.concurrency, args.rate, args.camera_share,
+                              args.repeat_share, args.timeout)
+    monitor = ResourceMonitor(pid, [path for path in temp_dirs if os.path.isdir(path)], args.interval, generator)
+    logger.info(f"Load testing {base_url} for {duration:.0f}s with {len(corpus)} images, "
+                f"concurrency {args.concurrency}, {'rate ' + str(args.rate) + '/s' if args.rate else 'closed loop'}")
+
+    monitor.start()
+    warm = threading.Timer(warmup, monitor.mark_warm)
+    warm.daemon = True
+    warm.start()
+    stop = threading.Event()
+    started = time.monotonic()
+    try:
+        generator.run(duration, stop)
+    except KeyboardInterrupt:
+        stop.set()
+        logger.info("Interrupted, reporting on the run so far")
+    finally:
+        warm.cancel()
+        monitor.stop()
+        if audit is not None:
+            audit.active = False
+        if server is not None:
+            server.shutdown()
+        if stub is not None:
+            stub.stop()
+
+    samples = monitor.samples
+    report = {
+        'duration': round(time.monotonic() - started, 1),
+        'load': generator.summary(),
+        'load_after_warmup': generator.summary(since=started + warmup),
+        'resources': {
+            'first': samples[0],
+            'last': samples[-1],
+            'max': {metric: max((sample[metric] for sample in samples if sample[metric] is not None), default=None)
+                    for metric in LEAK_THRESHOLDS},
+            'samples': samples,
+        },
+        'leaks': find_leaks(samples, warmup),
+        'write_races': audit.report() if audit is not None else [],
+        'concurrent_open_writes': monitor.shared_writes,
+        'heap_growth': monitor.top_growth(),
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'url': args.url or 'in-process',
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'camera_share': args.camera_share,
+            'repeat_share': args.repeat_share,
+            'warmup': warmup,
+            'api_requests': dict(stub.requests) if stub is not None else None,
+        },
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+
+    failed = (report['leaks'] or report['concurrent_open_writes']
+              or any(entry['overlaps'] for entry in report['write_races'])
+              or report['load']['error_rate'] > args.max_error_rate)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const cameraFeed = document.getElementById('camera-feed');
     const cameraCanvas = document.getElementById('camera-canvas');
     const captureBtn = document.getElementById('capture-btn');
+    const liveScanBtn = document.getElementById('live-scan-btn');
+    const liveStatus = document.getElementById('live-status');
     const retakeBtn = document.getElementById('retake-btn');
     const processCameraBtn = document.getElementById('process-camera-btn');
     const cameraPreview = document.getElementById('camera-preview');
@@ -27,10 +29,26 @@ document.addEventListener('DOMContentLoaded', function() {
     const errorMessage = document.getElementById('error-message');
     const closeModalBtns = document.querySelectorAll('.close-modal');
 
+    // Longest side of images sent for scanning; more pixels only slow the upload
+    const MAX_UPLOAD_SIDE = 2000;
+    
+    // Live scan streams smaller frames a few times a second; the server
+    // drops blurry, moving and repeated frames before reading any
+    const LIVE_FRAME_SIDE = 1280;
+    const LIVE_FPS = 4;
+    const LIVE_HINTS = {
+        blurry: 'Hold steady, the image is blurry',
+        moving: 'Hold the camera still',
+        duplicate: 'Reading the label...',
+        candidate: 'Reading the label...'
+    };
+
     // Variables
     let stream = null;
     let capturedImage = null;
     let uploadedFile = null;
+    let liveSocket = null;
+    let liveTimer = null;
 
     // Initialize
     initCamera();
@@ -69,6 +87,7 @@ document.addEventListener('DOMContentLoaded', function() {
         captureBtn.addEventListener('click', captureImage);
         retakeBtn.addEventListener('click', retakePicture);
         processCameraBtn.addEventListener('click', processCameraImage);
+        liveScanBtn.addEventListener('click', toggleLiveScan);
         
         // File upload controls
         fileInput.addEventListener('change', handleFileSelect);
@@ -119,40 +138,151 @@ document.addEventListener('DOMContentLoaded', function() {
             cameraFeed.style.display = 'block';
             cameraPreview.style.display = 'none';
             captureBtn.style.display = 'block';
+            liveScanBtn.style.display = 'block';
             retakeBtn.style.display = 'none';
             processCameraBtn.style.display = 'none';
         } else {
             cameraFeed.style.display = 'none';
             cameraPreview.style.display = 'block';
             captureBtn.style.display = 'none';
+            liveScanBtn.style.display = 'none';
             retakeBtn.style.display = 'block';
             processCameraBtn.style.display = 'block';
         }
     }
     
+    // Draw an image or video frame scaled down to maxSide (MAX_UPLOAD_SIDE
+    // by default) and encode it as WebP, or as JPEG where the browser
+    // cannot encode WebP
+    function encodeImage(source, width, height, canvas, maxSide) {
+        const scale = Math.min(1, (maxSide || MAX_UPLOAD_SIDE) / Math.max(width, height));
+        canvas = canvas || document.createElement('canvas');
+        canvas.width = Math.round(width * scale);
+        canvas.height = Math.round(height * scale);
+        canvas.getContext('2d').drawImage(source, 0, 0, canvas.width, canvas.height);
+        
+        return new Promise(resolve => {
+            canvas.toBlob(blob => {
+                if (blob && blob.type === 'image/webp') {
+                    resolve(blob);
+                } else {
+                    canvas.toBlob(resolve, 'image/jpeg', 0.9);
+                }
+            }, 'image/webp', 0.9);
+        });
+    }
+    
     function captureImage() {
-        const context = cameraCanvas.getContext('2d');
+        // Encode the current frame from the video feed
+        encodeImage(cameraFeed, cameraFeed.videoWidth, cameraFeed.videoHeight, cameraCanvas)
+            .then(blob => {
+                capturedImage = blob;
+                
+                // Display the captured image
+                cameraPreviewImg.src = URL.createObjectURL(blob);
+                
+                // Show the preview and relevant controls
+                toggleCameraControls(false);
+            });
+    }
+    
+    function retakePicture() {
+        if (cameraPreviewImg.src.startsWith('blob:')) {
+            URL.revokeObjectURL(cameraPreviewImg.src);
+        }
+        capturedImage = null;
+        toggleCameraControls(true);
+    }
+    
+    // Live scan: stream frames over a WebSocket until the server settles on
+    // a medicine name, then follow the scan job it started like any other
+    function toggleLiveScan() {
+        if (liveSocket) {
+            stopLiveScan();
+        } else {
+            startLiveScan();
+        }
+    }
+    
+    function startLiveScan() {
+        if (!stream) {
+            showError('Live scan needs camera access. Please allow the camera or upload a photo instead.');
+            return;
+        }
         
-        // Set canvas dimensions to match the video feed
-        cameraCanvas.width = cameraFeed.videoWidth;
-        cameraCanvas.height = cameraFeed.videoHeight;
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${location.host}/api/live`);
+        let lastFrame = null;
+        let encoding = false;
+        liveSocket = socket;
         
-        // Draw the current frame from the video onto the canvas
-        context.drawImage(cameraFeed, 0, 0, cameraCanvas.width, cameraCanvas.height);
+        liveScanBtn.innerHTML = '<i class="fas fa-stop"></i> Stop';
+        captureBtn.style.display = 'none';
+        liveStatus.textContent = 'Point the camera at the medicine label';
+        liveStatus.style.display = 'block';
         
-        // Convert the canvas content to a data URL
-        capturedImage = cameraCanvas.toDataURL('image/png');
+        socket.addEventListener('open', () => {
+            liveTimer = setInterval(() => {
+                // Skip frames rather than queue them behind a slow connection
+                if (encoding || socket.bufferedAmount > 0) {
+                    return;
+                }
+                encoding = true;
+                encodeImage(cameraFeed, cameraFeed.videoWidth, cameraFeed.videoHeight, cameraCanvas, LIVE_FRAME_SIDE)
+                    .then(blob => {
+                        if (blob && socket.readyState === WebSocket.OPEN) {
+                            lastFrame = blob;
+                            socket.send(blob);
+                        }
+                    })
+                    .finally(() => {
+                        encoding = false;
+                    });
+            }, 1000 / LIVE_FPS);
+        });
         
-        // Display the captured image
-        cameraPreviewImg.src = capturedImage;
+        socket.addEventListener('message', e => {
+            const message = JSON.parse(e.data);
+            if (message.type === 'frame') {
+                liveStatus.textContent = LIVE_HINTS[message.status] || 'Reading the label...';
+            } else if (message.type === 'ocr' && message.candidates.length) {
+                liveStatus.textContent = `Looks like ${message.candidates[0].name}, hold on...`;
+            } else if (message.type === 'busy') {
+                liveStatus.textContent = 'The server is busy, keep holding the camera steady';
+            } else if (message.type === 'resolved') {
+                stopLiveScan();
+                const imageData = URL.createObjectURL(lastFrame);
+                resultOriginalImg.src = imageData;
+                resetResults(imageData);
+                showResults();
+                listenToJob(message.events_url);
+            } else if (message.type === 'timeout') {
+                stopLiveScan();
+                showError('No medicine was recognized. Try capturing a photo instead.');
+            }
+        });
         
-        // Show the preview and relevant controls
-        toggleCameraControls(false);
+        socket.addEventListener('close', e => {
+            if (liveSocket === socket) {
+                stopLiveScan();
+                if (e.code !== 1000) {
+                    showError('Live scan is not available right now. Please capture a photo instead.');
+                }
+            }
+        });
     }
     
-    function retakePicture() {
-        capturedImage = null;
-        toggleCameraControls(true);
+    function stopLiveScan() {
+        clearInterval(liveTimer);
+        liveTimer = null;
+        if (liveSocket) {
+            const socket = liveSocket;
+            liveSocket = null;
+            socket.close();
+        }
+        liveScanBtn.innerHTML = '<i class="fas fa-video"></i> Live Scan';
+        captureBtn.style.display = 'block';
+        liveStatus.style.display = 'none';
     }
     
     function processCameraImage() {
@@ -161,7 +291,7 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        processImage(capturedImage, 'camera');
+        processImage(capturedImage);
     }
     
     // File upload functions
@@ -222,38 +352,43 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        const reader = new FileReader();
-        reader.onload = function(e) {
-            processImage(e.target.result, 'upload');
-        };
-        reader.readAsDataURL(uploadedFile);
+        // Only re-encode photos larger than the server needs
+        createImageBitmap(uploadedFile)
+            .then(bitmap => Math.max(bitmap.width, bitmap.height) > MAX_UPLOAD_SIDE
+                ? encodeImage(bitmap, bitmap.width, bitmap.height)
+                : uploadedFile)
+            .catch(() => uploadedFile)
+            .then(processImage);
     }
     
     // Image processing functions
-    function processImage(imageData, source) {
+    function processImage(imageBlob) {
         showLoading(true);
         
         // Display the original image in results
+        const imageData = URL.createObjectURL(imageBlob);
         resultOriginalImg.src = imageData;
         
-        // Make API call to process the image
-        // This is a placeholder for the actual API call
-        fetch('/api/process-medicine-image', {
+        // Submit a scan job as a binary body; results then stream back stage by stage
+        fetch('/api/jobs', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ image: imageData })
+            headers: { 'Content-Type': imageBlob.type || 'application/octet-stream' },
+            body: imageBlob
         })
         .then(response => {
+            if (response.status === 503) {
+                const retryAfter = response.headers.get('Retry-After') || 'a few';
+                throw new Error(`The server is busy, please try again in ${retryAfter} seconds`);
+            }
             if (!response.ok) {
                 throw new Error('Server returned an error response');
             }
             return response.json();
         })
-        .then(data => {
-            // Handle successful response
-            displayResults(data, imageData);
+        .then(job => {
+            resetResults(imageData);
+            showResults();
+            listenToJob(job.events_url);
         })
         .catch(error => {
             showError(`Failed to process image: ${error.message}`);
@@ -263,79 +398,110 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Results display functions
-    function displayResults(data, originalImage) {
-        // Update UI elements with results
-        if (data.processedImage) {
-            resultProcessedImg.src = data.processedImage;
-        } else {
-            resultProcessedImg.src = originalImage;
-        }
+    function resetResults(originalImage) {
+        resultProcessedImg.src = originalImage;
+        extractedTextEl.textContent = 'Reading text from the image...';
+        medicineNameBadge.style.display = 'none';
+        medicineInfo.textContent = '';
+        infoLoading.style.display = 'block';
+    }
+    
+    // Outline the recognized words on the original image, as the server
+    // would; fetch the server-drawn image only if that is not possible
+    function drawBoxes(boxes, imageSize, annotatedUrl) {
+        resultOriginalImg.decode()
+            .then(() => {
+                const canvas = document.createElement('canvas');
+                canvas.width = resultOriginalImg.naturalWidth;
+                canvas.height = resultOriginalImg.naturalHeight;
+                const scale = canvas.width / imageSize[0];
+                const context = canvas.getContext('2d');
+                context.drawImage(resultOriginalImg, 0, 0);
+                context.strokeStyle = '#00ff00';
+                context.lineWidth = Math.max(2, 2 * scale);
+                boxes.forEach(([x, y, w, h, conf]) => {
+                    if (conf > 60) {
+                        context.strokeRect(x * scale, y * scale, w * scale, h * scale);
+                    }
+                });
+                resultProcessedImg.src = canvas.toDataURL('image/jpeg', 0.85);
+            })
+            .catch(() => {
+                resultProcessedImg.src = annotatedUrl;
+            });
+    }
+    
+    function listenToJob(eventsUrl) {
+        const events = new EventSource(eventsUrl);
+        let llmText = '';
         
-        if (data.extractedText) {
-            extractedTextEl.textContent = data.extractedText;
-        } else {
-            extractedTextEl.textContent = 'No text was detected in the image.';
-        }
+        events.addEventListener('ocr', e => {
+            const data = JSON.parse(e.data);
+            if (data.processed_image) {
+                resultProcessedImg.src = `data:image/jpeg;base64,${data.processed_image}`;
+            } else if (data.boxes) {
+                drawBoxes(data.boxes, data.image_size, data.annotated_url);
+            }
+            extractedTextEl.textContent = data.extracted_text && data.extracted_text.trim()
+                ? data.extracted_text
+                : 'No text was detected in the image.';
+            showLoading(false);
+        });
         
-        if (data.medicineName) {
-            medicineNameBadge.textContent = data.medicineName;
-            medicineNameBadge.style.display = 'inline-block';
-            
-            // Fetch medicine information
-            fetchMedicineInfo(data.medicineName);
-        } else {
-            medicineNameBadge.style.display = 'none';
-            medicineInfo.textContent = 'No medicine was detected in the image.';
+        const showName = e => {
+            const data = JSON.parse(e.data);
+            if (data.medicine_name) {
+                medicineNameBadge.textContent = data.medicine_name;
+                medicineNameBadge.style.display = 'inline-block';
+            } else {
+                medicineNameBadge.style.display = 'none';
+            }
+        };
+        events.addEventListener('name', showName);
+        
+        // Search may settle on a runner-up name that matches the label better
+        events.addEventListener('search', showName);
+        
+        // Show the answer as the LLM writes it
+        events.addEventListener('llm_token', e => {
+            llmText += JSON.parse(e.data).token;
             infoLoading.style.display = 'none';
-        }
+            medicineInfo.textContent = llmText;
+        });
         
-        // Show results container
-        showResults();
-        showLoading(false);
-    }
-    
-    function fetchMedicineInfo(medicineName) {
-        infoLoading.style.display = 'block';
-        medicineInfo.textContent = '';
+        // The answer broke off part way: keep what arrived, marked as incomplete
+        let llmError = '';
+        events.addEventListener('llm_error', e => {
+            llmError = JSON.parse(e.data).error;
+        });
         
-        // Make API call to fetch medicine information
-        fetch(`/api/medicine-info?name=${encodeURIComponent(medicineName)}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch medicine information');
-                }
-                return response.json();
-            })
-            .then(data => {
+        events.addEventListener('llm', e => {
+            infoLoading.style.display = 'none';
+            const answer = JSON.parse(e.data).llm_response;
+            medicineInfo.textContent = llmError ? `${answer}\n\n(${llmError})` : answer;
+        });
+        
+        events.addEventListener('done', () => {
+            events.close();
+            infoLoading.style.display = 'none';
+            if (!medicineInfo.textContent) {
+                medicineInfo.textContent = 'No medicine was detected in the image.';
+            }
+            showLoading(false);
+        });
+        
+        events.addEventListener('error', e => {
+            // Server-sent 'error' events carry data; connection errors do not
+            if (e.data) {
+                events.close();
                 infoLoading.style.display = 'none';
-                
-                if (data.info) {
-                    // Format and display medicine information
-                    let infoHtml = '';
-                    
-                    if (data.info.description) {
-                        infoHtml += `<p><strong>Description:</strong> ${data.info.description}</p>`;
-                    }
-                    if (data.info.usedFor) {
-                        infoHtml += `<p><strong>Used for:</strong> ${data.info.usedFor}</p>`;
-                    }
-                    if (data.info.sideEffects) {
-                        infoHtml += `<p><strong>Common side effects:</strong> ${data.info.sideEffects}</p>`;
-                    }
-                    if (data.info.warnings) {
-                        infoHtml += `<p><strong>Warnings:</strong> ${data.info.warnings}</p>`;
-                    }
-                    
-                    medicineInfo.innerHTML = infoHtml;
-                } else {
-                    medicineInfo.textContent = 'No detailed information available for this medicine.';
-                }
-            })
-            .catch(error => {
+                showError(JSON.parse(e.data).error);
+            } else if (events.readyState === EventSource.CLOSED) {
                 infoLoading.style.display = 'none';
-                medicineInfo.textContent = `Could not retrieve medicine information: ${error.message}`;
-                console.error('Medicine info error:', error);
-            });
+                medicineInfo.textContent = 'Lost connection to the server.';
+            }
+            showLoading(false);
+        });
     }
     
     // UI state management
@@ -388,6 +554,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Clean up resources when page is unloaded
     window.addEventListener('beforeunload', function() {
+        stopLiveScan();
         stopCamera();
     });
 });
@@ -0,0 +1,258 @@
+import bisect
+import contextvars
+import os
+import re
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# METRICS_ENABLED=0 turns spans into no-ops and hides /metrics
+ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# Histogram buckets in seconds, from a fast image pass to a slow completion
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stage durations collected for the current request's Server-Timing header
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a counter that is maintained elsewhere, e.g. cache hits."""
+        with self._lock:
+            self._series[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        with self._lock:
+            series = list(self._series.items())
+        return self._header() + [f"{self.name}_total{_labels(key)} {_number(value)}" for key, value in series]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, optionally split by labels."""
+
+    type = 'gauge'
+
+    def render(self):
+        with self._lock:
+            series = list(self._series.items())
+        return self._header() + [f"{self.name}{_labels(key)} {_number(value)}" for key, value in series]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram of observed values, optionally split by labels.
+
+    Args:
+        name (str): Metric name
+        help (str): Description shown in the exposition
+        buckets (tuple): Sorted upper bounds of the buckets
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = self._header()
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_labels(key, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(key)} {count}")
+        return lines
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, help, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, **kwargs)
+        return metric
+
+
+def counter(name, help):
+    """Return the counter called `name`, creating it on first use."""
+    return _get_or_create(Counter, name, help)
+
+
+def gauge(name, help):
+    """Return the gauge called `name`, creating it on first use."""
+    return _get_or_create(Gauge, name, help)
+
+
+def histogram(name, help, buckets=BUCKETS):
+    """Return the histogram called `name`, creating it on first use."""
+    return _get_or_create(Histogram, name, help, buckets=buckets)
+
+
+STAGE_SECONDS = histogram('scanner_stage_seconds', 'Time spent in each pipeline stage')
+
+
+def record(stage, seconds):
+    """
+    Record the duration of a stage.
+
+    The duration goes into the stage histogram and, inside a request
+    started with `start_request`, into that request's Server-Timing.
+
+    Args:
+        stage (str): Stage name, e.g. 'search.api' or 'ocr.ocr_otsu'
+        seconds (float): Time the stage took
+    """
+    if not ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_timings(timings, prefix=''):
+    """Record every stage of a {stage: seconds} dict, e.g. an OCR result's timings."""
+    if not ENABLED:
+        return
+    for stage, seconds in timings.items():
+        record(prefix + stage, seconds)
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage):
+    """
+    Time a block of code as a pipeline stage.
+
+    Usage:
+        with metrics.span('search.api'):
+            ...
+
+    Spans may nest; each one records its own inclusive duration.
+    """
+    return _Span(stage) if ENABLED else _NOOP_SPAN
+
+
+def start_request():
+    """Start collecting stage timings for the current request; returns a reset token."""
+    return _timings.set({})
+
+
+def finish_request(token):
+    """
+    Stop collecting stage timings for the current request.
+
+    Returns:
+        dict: {stage: seconds} recorded since `start_request`
+    """
+    timings = _timings.get() or {}
+    _timings.reset(token)
+    return timings
+
+
+def server_timing(timings):
+    """Format {stage: seconds} as a Server-Timing header value."""
+    return ', '.join(
+        f"{re.sub(r'[^A-Za-z0-9_.-]', '_', stage)};dur={seconds * 1000:.1f}"
+        for stage, seconds in timings.items()
+    )
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,227 @@
+import os
+import re
+import threading
+import logging
+import word_lines
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEXICON_PATH = os.getenv(
+    'DRUG_LEXICON', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'drug_names.txt'))
+
+# Candidates scoring below this are treated as unresolved
+MIN_SCORE = float(os.getenv('NAME_MIN_SCORE', 0.35))
+
+# Longest run of OCR words tried as one name (e.g. "clavulanic acid")
+MAX_NGRAM = 3
+
+
+def normalize(text):
+    """Lowercase and strip everything but letters and digits."""
+    return re.sub(r'[^a-z0-9]', '', text.lower())
+
+
+def max_distance(term):
+    """Edit distance tolerated for a term of this length."""
+    if len(term) < 4:
+        return 0
+    if len(term) < 7:
+        return 1
+    return 2
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between two strings.
+
+    Adjacent transpositions count as one edit, which covers a common class
+    of OCR slips. Returns limit + 1 as soon as the distance must exceed it.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(term, distance):
+    """All strings reachable from `term` by deleting up to `distance` characters."""
+    results = {term}
+    frontier = {term}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        results |= frontier
+    return results
+
+
+def load_lexicon(path=LEXICON_PATH):
+    """
+    Read the drug name lexicon.
+
+    Args:
+        path (str): Lexicon file, one 'name' or 'brand|generic[|generic]' per line
+
+    Returns:
+        list: Dicts with 'name' (display form) and 'generic' (list of generic names)
+    """
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, *generics = [part.strip() for part in line.split('|')]
+            entries.append({'name': name, 'generic': generics or [name]})
+    return entries
+
+
+class LexiconResolver:
+    """
+    Resolve OCR text to medicine names with a SymSpell style fuzzy index.
+
+    Every lexicon term is indexed under all of its deletion variants, so a
+    lookup only has to generate the deletions of the query and verify the
+    few terms sharing one, instead of comparing against the whole lexicon.
+
+    Args:
+        entries (list): Output of `load_lexicon`
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._terms = {}
+        self._index = {}
+        for entry in entries:
+            term = normalize(entry['name'])
+            if len(term) < 4:
+                continue
+            self._terms[term] = entry
+            for variant in _deletes(term, max_distance(term)):
+                self._index.setdefault(variant, set()).add(term)
+
+    def lookup(self, query):
+        """
+        Find the closest lexicon term to a normalized query.
+
+        Returns:
+            tuple: (term, distance), or (None, None) if nothing is close enough
+        """
+        if query in self._terms:
+            return query, 0
+        limit = max_distance(query)
+        if limit == 0:
+            return None, None
+        best, best_distance = None, limit + 1
+        seen = set()
+        for variant in _deletes(query, limit):
+            for term in self._index.get(variant, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(query, term, min(limit, max_distance(term)))
+                if distance < best_distance or (distance == best_distance and best and len(term) > len(best)):
+                    best, best_distance = term, distance
+        if best is None or best_distance > min(limit, max_distance(best)):
+            return None, None
+        return best, best_distance
+
+    def resolve(self, text, words=None, limit=5):
+        """
+        Rank the medicine names that appear in OCR output.
+
+        Every word and run of up to MAX_NGRAM words on a line is looked up.
+        A match scores by string similarity, weighted by the OCR confidence
+        of its words and by their glyph height relative to the tallest text,
+        since brand names are usually printed largest.
+
+        Args:
+            text (str): OCR text, used when no word boxes are available
+            words (list): OCR words with 'text', 'conf', 'height' and line numbers
+            limit (int): Maximum number of candidates to return
+
+        Returns:
+            list: Candidate dicts with 'name', 'generic', 'score', 'matched'
+            and 'distance', best first; empty when nothing resolves
+        """
+        if words:
+            lines = [[(word['text'], max(0.0, min(1.0, word['conf'] / 100.0)), word['height']) for word in line]
+                     for line in word_lines.group_lines(words)]
+        else:
+            lines = [[(token, 1.0, 1.0) for token in line.split()] for line in text.splitlines()]
+
+        tallest = max((height for line in lines for _, _, height in line), default=1.0) or 1.0
+
+        candidates = {}
+        for line in lines:
+            for n in range(1, MAX_NGRAM + 1):
+                for start in range(len(line) - n + 1):
+                    gram = line[start:start + n]
+                    query = normalize(''.join(token for token, _, _ in gram))
+                    if len(query) < 4 or query.isdigit():
+                        continue
+                    term, distance = self.lookup(query)
+                    if term is None:
+                        continue
+
+                    similarity = 1.0 - distance / float(len(term))
+                    conf = sum(c for _, c, _ in gram) / n
+                    size = max(h for _, _, h in gram) / tallest
+                    score = similarity ** 2 * (0.4 + 0.6 * conf) * (0.5 + 0.5 * size)
+
+                    entry = self._terms[term]
+                    current = candidates.get(entry['name'])
+                    if current is None or score > current['score']:
+                        candidates[entry['name']] = {
+                            'name': entry['name'],
+                            'generic': entry['generic'],
+                            'score': score,
+                            'matched': ' '.join(token for token, _, _ in gram),
+                            'distance': distance,
+                        }
+
+        ranked = sorted(candidates.values(), key=lambda candidate: candidate['score'], reverse=True)
+        return [candidate for candidate in ranked if candidate['score'] >= MIN_SCORE][:limit]
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Return the active resolver, building the lexicon index on first use."""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = LexiconResolver(load_lexicon())
+            logger.info(f"Loaded {len(_resolver.entries)} drug names from {LEXICON_PATH}")
+        return _resolver
+
+
+def set_resolver(resolver):
+    """
+    Replace the active resolver.
+
+    Args:
+        resolver: Any object with a `resolve(text, words=None, limit=5)`
+            method returning candidates like `LexiconResolver.resolve`
+    """
+    global _resolver
+    with _resolver_lock:
+        _resolver = resolver
+
+
+def resolve(text, words=None, limit=5):
+    """Rank medicine name candidates with the active resolver."""
+    return get_resolver().resolve(text, words, limit)
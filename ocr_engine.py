@@ -0,0 +1,402 @@
+import pytesseract
+import numpy as np
+import platform
+import os
+import queue
+import threading
+import time
+import contextvars
+import logging
+from contextlib import contextmanager
+import word_lines
+
+# tesserocr binds the Tesseract C API directly and is what keeps engines
+# warm. It is in requirements.txt everywhere but Windows; without it, or
+# when it cannot load the language data, every pass falls back to the
+# pytesseract command line wrapper, which starts a tesseract process.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set Tesseract path based on operating system
+if platform.system() == 'Windows':
+    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# For macOS (Homebrew installation)
+elif platform.system() == 'Darwin':
+    if os.path.exists("/usr/local/bin/tesseract"):
+        pytesseract.pytesseract.tesseract_cmd = r"/usr/local/bin/tesseract"
+    elif os.path.exists("/opt/homebrew/bin/tesseract"):
+        pytesseract.pytesseract.tesseract_cmd = r"/opt/homebrew/bin/tesseract"
+# For Linux
+elif platform.system() == 'Linux':
+    pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"
+
+# Language and engine mode shared by every backend
+# OEM 3: Default, based on LSTM neural network
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+OCR_OEM = 3
+
+# Number of warm engines kept per PSM mode
+POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', os.cpu_count() or 1))
+
+
+class OcrTimeout(Exception):
+    """Raised when an OCR pass cannot finish before the current deadline."""
+
+
+_deadline = contextvars.ContextVar('ocr_deadline', default=None)
+
+
+@contextmanager
+def deadline(at):
+    """
+    Make the OCR passes run in this context stop at a deadline.
+
+    Threads started inside the context only see it when they run in a
+    copy of it (`contextvars.copy_context().run`).
+
+    Args:
+        at (float): `time.time()` by which OCR must finish, or None for no limit
+    """
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left before the current deadline.
+
+    Returns:
+        float: Seconds left, or None when there is no deadline
+
+    Raises:
+        OcrTimeout: If the deadline has already passed
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    left = at - time.time()
+    if left <= 0:
+        raise OcrTimeout("OCR deadline passed")
+    return left
+
+
+def words_to_text(words):
+    """
+    Rebuild the plain text layout from word level OCR output.
+
+    Words on the same line are joined with spaces, lines with newlines and
+    blocks/paragraphs are separated by a blank line, which matches what
+    `image_to_string` returns.
+    """
+    lines = []
+    current_key = None
+    current_para = None
+    for word in words:
+        key = word_lines.line_key(word)
+        if key != current_key:
+            para = key[:-1]
+            if current_para is not None and para != current_para:
+                lines.append('')
+            lines.append(word['text'])
+            current_key = key
+            current_para = para
+        else:
+            lines[-1] += ' ' + word['text']
+    return '\n'.join(lines) + ('\n' if lines else '')
+
+
+class PytesseractEngine:
+    """
+    OCR engine that shells out to the tesseract binary through pytesseract.
+
+    A single `image_to_data` call returns both the word boxes and the text,
+    so each recognition costs one subprocess instead of two or three.
+    """
+
+    def __init__(self, psm):
+        self.psm = psm
+        self.config = f"--psm {psm} --oem {OCR_OEM}"
+
+    def recognize(self, image, timeout=None):
+        try:
+            # pytesseract kills the tesseract process when the timeout expires
+            data = pytesseract.image_to_data(
+                image, lang=OCR_LANG, config=self.config, output_type=pytesseract.Output.DICT,
+                timeout=timeout or 0)
+        except RuntimeError as e:
+            if 'timeout' in str(e).lower():
+                raise OcrTimeout(f"OCR pass stopped after {timeout:.1f}s") from None
+            raise
+
+        words = []
+        for i in range(len(data['text'])):
+            text = str(data['text'][i]).strip()
+            conf = float(data['conf'][i])
+            if not text or conf < 0:
+                continue
+            words.append({
+                'text': text,
+                'left': int(data['left'][i]),
+                'top': int(data['top'][i]),
+                'width': int(data['width'][i]),
+                'height': int(data['height'][i]),
+                'conf': conf,
+                'block': int(data['block_num'][i]),
+                'par': int(data['par_num'][i]),
+                'line': int(data['line_num'][i]),
+            })
+
+        return {'text': words_to_text(words), 'words': words}
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    OCR engine backed by an in-process Tesseract API handle.
+
+    The LSTM model is loaded once when the engine is created and reused for
+    every image, and the pixels are handed over without a temporary file.
+    """
+
+    def __init__(self, psm):
+        self.psm = psm
+        self.api = tesserocr.PyTessBaseAPI(
+            lang=OCR_LANG, psm=psm, oem=tesserocr.OEM(OCR_OEM))
+
+    def recognize(self, image, timeout=None):
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        self.api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+        # Tesseract checks the timeout between words and abandons the page
+        if not self.api.Recognize(int(timeout * 1000) if timeout else 0):
+            self.api.Clear()
+            if timeout:
+                raise OcrTimeout(f"OCR pass stopped after {timeout:.1f}s")
+            raise RuntimeError("Tesseract could not recognize the image")
+
+        words = []
+        level = tesserocr.RIL.WORD
+        iterator = self.api.GetIterator()
+        block = par = line = 0
+        if iterator is not None:
+            while True:
+                if iterator.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, par, line = block + 1, 0, 0
+                if iterator.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par, line = par + 1, 0
+                if iterator.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                text = (iterator.GetUTF8Text(level) or '').strip()
+                box = iterator.BoundingBox(level)
+                if text and box is not None:
+                    x1, y1, x2, y2 = box
+                    words.append({
+                        'text': text,
+                        'left': x1,
+                        'top': y1,
+                        'width': x2 - x1,
+                        'height': y2 - y1,
+                        'conf': float(iterator.Confidence(level)),
+                        'block': block,
+                        'par': par,
+                        'line': line,
+                    })
+                if not iterator.Next(level):
+                    break
+
+        # GetUTF8Text reuses the recognition above instead of running it again
+        text = self.api.GetUTF8Text()
+        self.api.Clear()
+        return {'text': text, 'words': words}
+
+    def close(self):
+        self.api.End()
+
+
+_backend = None
+
+
+def _use_backend(name, reason=None):
+    """Remember which backend the engines use, logging it the first time."""
+    global _backend
+    if _backend == name:
+        return
+    _backend = name
+    if name == 'tesserocr':
+        logger.info("OCR engines use tesserocr: warm in-process Tesseract handles")
+    else:
+        logger.warning(f"OCR engines use pytesseract ({reason}): every OCR pass starts a tesseract process")
+
+
+def backend():
+    """
+    Name the backend OCR engines run on in this process.
+
+    Returns:
+        str: 'tesserocr' (warm in-process engines) or 'pytesseract' (one
+        tesseract process per pass); before any engine was created, the
+        one that will be tried first
+    """
+    if _backend is not None:
+        return _backend
+    return 'tesserocr' if tesserocr is not None else 'pytesseract'
+
+
+def create_engine(psm):
+    """
+    Create the best available OCR engine for a page segmentation mode.
+
+    Args:
+        psm (int): Tesseract page segmentation mode
+
+    Returns:
+        object: An engine exposing `recognize(image)` and `close()`
+    """
+    if tesserocr is None:
+        _use_backend('pytesseract', "tesserocr is not installed")
+        return PytesseractEngine(psm)
+    try:
+        engine = TesserocrEngine(psm)
+    except Exception as e:
+        _use_backend('pytesseract', f"tesserocr could not start: {str(e)}")
+        return PytesseractEngine(psm)
+    _use_backend('tesserocr')
+    return engine
+
+
+class EnginePool:
+    """
+    Pool of warm OCR engines for a single page segmentation mode.
+
+    Engines are created lazily up to `size` and handed out one caller at a
+    time, since a Tesseract handle is not safe to share between threads.
+    """
+
+    def __init__(self, psm, size=POOL_SIZE):
+        self.psm = psm
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def engine(self):
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            engine = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    engine = create_engine(self.psm)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                engine = self._idle.get()
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    def warm(self):
+        """Create the first engine up front so the model is already loaded."""
+        with self.engine():
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(psm):
+    """
+    Return the shared engine pool for a page segmentation mode.
+
+    Args:
+        psm (int): Tesseract page segmentation mode
+
+    Returns:
+        EnginePool: The pool for that mode
+    """
+    with _pools_lock:
+        pool = _pools.get(psm)
+        if pool is None:
+            pool = EnginePool(psm, POOL_SIZE)
+            _pools[psm] = pool
+        return pool
+
+
+def recognize(image, psm=6):
+    """
+    Run one OCR pass over an image, stopping it at the current `deadline`.
+
+    Args:
+        image (numpy.ndarray): Grayscale or BGR image
+        psm (int): Tesseract page segmentation mode
+
+    Returns:
+        dict: 'text' with the recognized text and 'words' with one entry per
+        word holding its box ('left', 'top', 'width', 'height'), 'conf' and
+        its 'block', 'par' and 'line' numbers
+
+    Raises:
+        OcrTimeout: If the deadline passes before or during the pass
+    """
+    remaining()
+    with get_pool(psm).engine() as engine:
+        # Measured again once an engine is free, which may have taken a while
+        return engine.recognize(image, timeout=remaining())
+
+
+def detect_orientation(image):
+    """
+    Run Tesseract orientation and script detection (OSD) on an image.
+
+    OSD needs the `osd` traineddata, which not every Tesseract install
+    ships; any failure is logged and reported as no result.
+
+    Args:
+        image (numpy.ndarray): Grayscale or BGR image, ideally a thumbnail
+
+    Returns:
+        dict: 'rotate' (degrees to turn the image clockwise to make the
+        text upright) and 'confidence', or None if OSD was not possible
+
+    Raises:
+        OcrTimeout: If the current `deadline` has already passed
+    """
+    timeout = remaining()
+    try:
+        osd = pytesseract.image_to_osd(image, output_type=pytesseract.Output.DICT, timeout=timeout or 0)
+    except Exception as e:
+        logger.info(f"Orientation detection failed: {str(e).strip()}")
+        return None
+    return {'rotate': int(osd['rotate']) % 360, 'confidence': float(osd['orientation_conf'])}
@@ -1,8 +1,12 @@
 import cv2
-import numpy as np
 import streamlit as st
+import cache
 import extraction
+import knowledge_store
 import LLM
+import llm_gateway
+import ocr_engine
+import search
 import os
 from dotenv import load_dotenv
 import logging
@@ -19,8 +23,11 @@ load_dotenv()
 required_keys = ['GROQ_API_KEY', 'GOOGLE_API_KEY', 'GOOGLE_SEARCH_ENGINE_ID']
 missing_keys = [key for key in required_keys if not os.getenv(key)]
 
-# Create temp directory if it doesn't exist
-os.makedirs("temp", exist_ok=True)
+# Scans memoized per image digest, shared by every session and rerun
+SCAN_CACHE_SIZE = int(os.getenv('STREAMLIT_SCAN_CACHE_SIZE', 64))
+
+# Medicine information is refetched after this many seconds
+ANSWER_TTL = int(os.getenv('STREAMLIT_ANSWER_TTL', 24 * 3600))
 
 # UI
 st.set_page_config(
@@ -36,18 +43,82 @@ st.write("Take a picture or upload an image of a medicine package to get detaile
 if missing_keys:
     st.warning(f"Missing required API keys: {', '.join(missing_keys)}. Some features may not work.")
 
+@st.cache_resource(show_spinner=False)
+def ocr_pools():
+    """Warm OCR engine pools, created once per process rather than per rerun."""
+    pools = [ocr_engine.get_pool(psm) for psm in (extraction.PRIMARY_PSM, extraction.FALLBACK_PSM)]
+    pools[0].warm()
+    return pools
+
+@st.cache_resource(show_spinner=False)
+def api_clients():
+    """The shared search client and LLM gateway, with their connection pools."""
+    return search.get_client(), llm_gateway.get_gateway()
+
+@st.cache_data(max_entries=SCAN_CACHE_SIZE, show_spinner=False)
+def read_label(digest, _image_bytes):
+    """
+    Run OCR and name identification on an encoded image.
+
+    Streamlit memoizes the result under the image digest alone, so
+    reruns and other sessions showing the same image skip the work.
+
+    Args:
+        digest (str): SHA-256 digest of the image bytes, the cache key
+        _image_bytes (bytes): Encoded image, not hashed by Streamlit
+
+    Returns:
+        dict: 'text', 'words' (OCR word boxes), 'processed_image' (JPEG
+        bytes with the word boxes), 'medicine_name' and 'medicine_candidates'
+    """
+    ocr_pools()
+    result = extraction.analyze(extraction.load_image(_image_bytes))
+    ok, processed = cv2.imencode('.jpg', extraction.draw_boxes(result), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    identified = LLM.identify_medicine(result['text'], result['words'])
+    return dict(identified, text=result['text'], words=result['words'], processed_image=processed.tobytes())
+
+@st.cache_data(max_entries=SCAN_CACHE_SIZE, ttl=ANSWER_TTL, show_spinner=False)
+def medicine_info(digest, _label):
+    """
+    Answer from the knowledge store, or search for the medicine and
+    generate its information with the LLM on a miss.
+
+    Memoized under the image digest like `read_label`. Failed calls raise
+    instead of returning an error text, so they are not cached.
+
+    Args:
+        digest (str): SHA-256 digest of the image bytes, the cache key
+        _label (dict): Output of `read_label` for that image
+
+    Returns:
+        dict: 'medicine_name' and 'llm_response'
+    """
+    record = knowledge_store.get_store().find(_label['medicine_name'], _label['text'])
+    if record is not None:
+        return {'medicine_name': record['name'], 'llm_response': record['answer']}
+    
+    api_clients()
+    searched = search.search_candidates(_label['medicine_candidates'], _label['text'])
+    medicine_name = searched['medicine_name'] or _label['medicine_name']
+    llm_response = LLM.query_llm(_label['text'], medicine_name, searched['search_results'], raise_errors=True,
+                                 candidates=_label['medicine_candidates'], words=_label['words'])
+    return {'medicine_name': medicine_name, 'llm_response': llm_response}
+
 # Function to process images and display results
-def process_image(image_path, image_display):
+def process_image(image_bytes):
     try:
+        digest = cache.image_digest(image_bytes)
+        
         # Process the image to extract text
         with st.spinner("Processing image..."):
-            processed_image, extracted_text = extraction.extract_text(image_path)
+            label = read_label(digest, image_bytes)
+        extracted_text = label['text']
         
         # Display results
         col1, col2 = st.columns(2)
         
         with col1:
-            st.image(image_display, caption='Uploaded Image')
+            st.image(image_bytes, caption='Uploaded Image')
             
             # Display the extracted text
             st.subheader("Extracted Text:")
@@ -57,10 +128,10 @@ def process_image(image_path, image_display):
                 st.error("No text could be extracted. Please try with a clearer image.")
         
         with col2:
-            st.image(processed_image, caption='Processed Image')
+            st.image(label['processed_image'], caption='Processed Image')
             
-            # Extract medicine name
-            medicine_name = LLM.extract_medicine_name(extracted_text)
+            # Show the medicine name
+            medicine_name = label['medicine_name']
             if medicine_name:
                 st.success(f"Identified medicine: {medicine_name}")
             else:
@@ -69,10 +140,14 @@ def process_image(image_path, image_display):
         if extracted_text.strip():
             # Generate medicine information using LLM
             with st.spinner("Searching for medicine information and generating response..."):
-                llm_response = LLM.query_llm(extracted_text)
+                try:
+                    info = medicine_info(digest, label)
+                except llm_gateway.LLMTruncated as e:
+                    # Shown once but not memoized, since medicine_info raised
+                    info = {'llm_response': e.text + LLM.TRUNCATED_NOTE}
                 
             st.subheader("Medicine Information:")
-            st.markdown(llm_response)
+            st.markdown(info['llm_response'])
             
             # Add disclaimer
             st.info("⚠️ DISCLAIMER: This information is for educational purposes only. Always consult a healthcare professional for medical advice and follow your prescription instructions.")
@@ -91,12 +166,8 @@ with tab1:
     pic = st.camera_input("Capture image")
     
     if pic is not None:
-        bytes_data = pic.read()
-        np_array = np.frombuffer(bytes_data, np.uint8)
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-        cv2.imwrite("cap_img.jpg", image)
-        
-        process_image("cap_img.jpg", pic)
+        # The session's own in-memory copy; nothing is written to disk
+        process_image(pic.getvalue())
 
 with tab2:
     st.header("File Upload")
@@ -105,14 +176,7 @@ with tab2:
     uploaded_file = st.file_uploader("Upload image:", type=["jpg", "png", "jpeg"])
     
     if uploaded_file is not None:
-        bytes_data = uploaded_file.read()
-        np_array = np.frombuffer(bytes_data, np.uint8)
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-        
-        temp_image_path = "captured_image.jpg"
-        cv2.imwrite(temp_image_path, image)
-        
-        process_image(temp_image_path, uploaded_file)
+        process_image(uploaded_file.getvalue())
 
 # Add instructions at the bottom
 st.divider()
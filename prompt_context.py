@@ -0,0 +1,309 @@
+import math
+import os
+import re
+import threading
+import logging
+import knowledge_store
+import metrics
+import word_lines
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Estimated tokens the label text and search snippets may take together
+# in the user message, and the largest share of that the label may use;
+# whatever the label leaves goes to the snippets
+LLM_INPUT_TOKENS = int(os.getenv('LLM_INPUT_TOKENS', 600))
+LLM_LABEL_SHARE = float(os.getenv('LLM_LABEL_SHARE', 0.35))
+
+# OCR words below this confidence are left out of the label text
+LABEL_MIN_CONFIDENCE = float(os.getenv('LLM_LABEL_MIN_CONFIDENCE', 60))
+
+# Output tokens allowed per rendered section of the answer, plus its
+# heading; max_tokens is their sum unless LLM_MAX_TOKENS overrides it
+SECTION_TOKENS = {
+    'name': 20,
+    'uses': 100,
+    'dosage': 120,
+    'side_effects': 100,
+    'precautions': 120,
+    'note': 50,
+}
+HEADING_TOKENS = 8
+LLM_MAX_TOKENS = int(os.getenv('LLM_MAX_TOKENS', 0)) or sum(
+    SECTION_TOKENS[key] + HEADING_TOKENS for key, _ in knowledge_store.SECTIONS)
+
+# Words in a snippet that suggest it covers one of the answer's sections
+SECTION_TERMS = ('use', 'treat', 'dose', 'dosage', 'side effect', 'warning', 'precaution',
+                 'contraindicat', 'pregnan', 'interact', 'overdose', 'allerg')
+
+# Snippets sharing at least this share of their words with a kept one are dropped
+DUPLICATE_OVERLAP = 0.7
+
+# Snippets are only cut to fit when at least this many tokens are left
+MIN_SNIPPET_TOKENS = 20
+
+PROMPT_TOKENS = metrics.counter('scanner_llm_prompt_tokens', 'Estimated LLM prompt tokens before and after compaction')
+
+_TOKEN = re.compile(r'\w+|[^\w\s]')
+_WORD = re.compile(r'[a-z0-9]+')
+_SPACES = re.compile(r'\s+')
+_DATE_PREFIX = re.compile(r'^[A-Z][a-z]{2} \d{1,2}, \d{4}\s*(?:\.\.\.|…|—|-)?\s*')
+
+
+def count_tokens(text):
+    """
+    Estimate the tokens in a text.
+
+    No tokenizer ships with the app, so this takes the larger of the
+    word and punctuation count and one token per four characters (runs
+    of whitespace, which tokenizers merge, counting as one), which tracks
+    Llama tokenizers closely for English label and web text.
+    """
+    if not text:
+        return 0
+    return max(len(_TOKEN.findall(text)), int(math.ceil(len(_SPACES.sub(' ', text)) / 4.0)))
+
+
+def count_messages(messages):
+    """Estimated prompt tokens of chat messages, including a few per message for the roles."""
+    return sum(count_tokens(message['content']) + 4 for message in messages)
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def _is_wordlike(token):
+    """Whether an OCR token is text rather than noise such as '|' or '~='."""
+    alnum = sum(char.isalnum() for char in token)
+    return alnum > 0 and alnum >= len(token) / 2.0
+
+
+def clean_label(text, words=None, min_confidence=LABEL_MIN_CONFIDENCE):
+    """
+    Clean OCR output into the label lines worth showing the LLM.
+
+    With word boxes, words below `min_confidence` are dropped and lines
+    are rebuilt from the rest; either way noise tokens are removed, lines
+    without real text are dropped and lines repeated by overlapping
+    regions or tiles are kept once.
+
+    Args:
+        text (str): The OCR extracted text
+        words (list): OCR word boxes in reading order with 'conf' and the
+            line numbers `word_lines.line_key` reads, if available
+        min_confidence (float): Lowest word confidence kept
+
+    Returns:
+        list: (line, mean word confidence or None) in reading order
+    """
+    if words:
+        lines = []
+        for line_words in word_lines.group_lines(words):
+            kept = [word for word in line_words if word['conf'] >= min_confidence and _is_wordlike(word['text'])]
+            if kept:
+                confidence = sum(word['conf'] for word in kept) / len(kept)
+                lines.append((' '.join(word['text'] for word in kept), confidence))
+    else:
+        lines = [(' '.join(token for token in line.split() if _is_wordlike(token)), None)
+                 for line in text.splitlines()]
+
+    cleaned, seen = [], {}
+    for line, confidence in lines:
+        key = ' '.join(_words(line))
+        if sum(char.isalnum() for char in key) < 3:
+            continue
+        # Keep one copy of repeated lines, and none of lines contained in a kept one
+        if key in seen or any(len(key) >= 6 and key in other for other in seen):
+            index = seen.get(key)
+            if index is not None and confidence is not None and confidence > (cleaned[index][1] or 0):
+                cleaned[index] = (cleaned[index][0], confidence)
+            continue
+        seen[key] = len(cleaned)
+        cleaned.append((line, confidence))
+    return cleaned
+
+
+def fit_label(lines, medicine_name, budget):
+    """
+    Drop the least confident label lines until the rest fit the budget.
+
+    Lines naming the medicine are kept first; the others go lowest
+    confidence first, and from the end of the label when there are no
+    confidences. The kept lines stay in reading order.
+
+    Returns:
+        str: The kept lines, one per line
+    """
+    name = ' '.join(_words(medicine_name))
+    costs = [count_tokens(line) + 1 for line, _ in lines]
+
+    def priority(index):
+        line, confidence = lines[index]
+        named = bool(name) and name in ' '.join(_words(line))
+        return (named, confidence if confidence is not None else -index)
+
+    kept, used = set(), 0
+    for index in sorted(range(len(lines)), key=priority, reverse=True):
+        if used + costs[index] <= budget:
+            kept.add(index)
+            used += costs[index]
+    return '\n'.join(lines[index][0] for index in sorted(kept))
+
+
+def parse_snippets(search_results):
+    """
+    Split compiled search results back into their items.
+
+    Args:
+        search_results (str): Output of `search.format_results`
+
+    Returns:
+        list: Dicts with 'title', 'source' and 'snippet', empty when the
+        text is not compiled results (a failure message, say)
+    """
+    items = []
+    for block in (search_results or '').split('\n\n'):
+        fields = {}
+        for line in block.splitlines():
+            name, _, value = line.partition(': ')
+            if name in ('Title', 'Source', 'Snippet'):
+                fields[name.lower()] = value.strip()
+        if 'snippet' in fields:
+            items.append({'title': fields.get('title', ''), 'source': fields.get('source', ''),
+                          'snippet': fields['snippet']})
+    return items
+
+
+def _truncate(text, tokens):
+    """Cut text to about `tokens` tokens, at a sentence end when one is close."""
+    cut = text[:tokens * 4]
+    end = max(cut.rfind('. '), cut.rfind('; '))
+    if end > len(cut) / 2:
+        return cut[:end + 1]
+    return cut.rsplit(' ', 1)[0] + ' ...'
+
+
+def rank_snippets(items, names, label_text, budget):
+    """
+    Keep the search snippets most relevant to the medicine within a budget.
+
+    A snippet scores for mentioning the medicine or one of its generic
+    names, for covering the answer's sections and for sharing words with
+    the label. Snippets that neither name the medicine nor cover a
+    section, and near duplicates of a better snippet, are dropped.
+
+    Args:
+        items (list): Output of `parse_snippets`
+        names (list): The resolved medicine name and its generic names
+        label_text (str): Cleaned label text
+        budget (int): Tokens the snippets may take
+
+    Returns:
+        str: The kept snippets, best first, one per line
+    """
+    names = [' '.join(_words(name)) for name in names if name]
+    label = set(word for word in _words(label_text) if len(word) > 3)
+
+    scored = []
+    for item in items:
+        snippet = _DATE_PREFIX.sub('', item['snippet']).strip(' .…')
+        text = f"{item['title']} {snippet}".lower()
+        words = set(_words(text))
+        named = any(name and name in ' '.join(_words(text)) for name in names)
+        terms = sum(term in text for term in SECTION_TERMS)
+        if not named and not terms:
+            continue
+        score = 2.0 * named + 2.0 * terms / len(SECTION_TERMS) + 0.5 * len(words & label) / float(len(label) or 1)
+        scored.append((score, words, f"- {item['title']} ({item['source']}): {snippet}"))
+    scored.sort(key=lambda entry: entry[0], reverse=True)
+
+    kept, kept_words, used = [], [], 0
+    for _, words, line in scored:
+        if any(len(words & other) >= DUPLICATE_OVERLAP * min(len(words), len(other)) for other in kept_words):
+            continue
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            if budget - used < MIN_SNIPPET_TOKENS:
+                break
+            line = _truncate(line, budget - used - 1)
+            cost = count_tokens(line) + 1
+        kept.append(line)
+        kept_words.append(words)
+        used += cost
+    return '\n'.join(kept)
+
+
+def build(input_text, medicine_name, search_results, words=None, names=(), budget=LLM_INPUT_TOKENS):
+    """
+    Compact the label text and search results for the LLM prompt.
+
+    Args:
+        input_text (str): The text extracted from the medicine image
+        medicine_name (str): The identified medicine name
+        search_results (str): Compiled search results, or a failure message
+        words (list): OCR word boxes with confidences, if available
+        names (list): Other names of the medicine, such as its generics
+        budget (int): Estimated tokens the label and snippets may take
+
+    Returns:
+        dict: 'label' and 'search' (the compacted texts) and 'max_tokens'
+        (output tokens for the rendered sections)
+    """
+    lines = clean_label(input_text, words)
+    label = fit_label(lines, medicine_name, int(budget * LLM_LABEL_SHARE))
+
+    items = parse_snippets(search_results)
+    if items:
+        search_text = rank_snippets(items, [medicine_name] + list(names), label, budget - count_tokens(label))
+    else:
+        # Failure messages are short and tell the LLM it has no references
+        search_text = search_results or ''
+
+    return {'label': label or input_text.strip()[:200], 'search': search_text, 'max_tokens': LLM_MAX_TOKENS}
+
+
+_totals = {'prompts': 0, 'tokens_before': 0, 'tokens_after': 0, 'max_tokens': 0}
+_totals_lock = threading.Lock()
+
+
+def report(medicine_name, raw_messages, messages, max_tokens):
+    """
+    Record how much a prompt was compacted.
+
+    Args:
+        medicine_name (str): Medicine the prompt is about
+        raw_messages (list): The messages built from the raw text and results
+        messages (list): The messages actually sent
+        max_tokens (int): Output tokens requested
+
+    Returns:
+        dict: 'before' and 'after' estimated prompt tokens and 'max_tokens'
+    """
+    before, after = count_messages(raw_messages), count_messages(messages)
+    PROMPT_TOKENS.inc(before, stage='raw')
+    PROMPT_TOKENS.inc(after, stage='sent')
+    with _totals_lock:
+        _totals['prompts'] += 1
+        _totals['tokens_before'] += before
+        _totals['tokens_after'] += after
+        _totals['max_tokens'] += max_tokens
+    logger.info(f"Prompt for '{medicine_name}' compacted from about {before} to {after} tokens, "
+                f"max_tokens {max_tokens}")
+    return {'before': before, 'after': after, 'max_tokens': max_tokens}
+
+
+def stats():
+    with _totals_lock:
+        totals = dict(_totals)
+    prompts = totals['prompts']
+    return {
+        'prompts': prompts,
+        'mean_tokens_before': round(totals['tokens_before'] / float(prompts), 1) if prompts else None,
+        'mean_tokens_after': round(totals['tokens_after'] / float(prompts), 1) if prompts else None,
+        'saved_ratio': round(1 - totals['tokens_after'] / float(totals['tokens_before']), 3)
+        if totals['tokens_before'] else 0.0,
+        'mean_max_tokens': round(totals['max_tokens'] / float(prompts), 1) if prompts else None,
+    }
@@ -1,57 +1,430 @@
+import asyncio
 import os
-import json
-import requests
+import re
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import cache
+import metrics
 
-def search_medicine_info(medicine_name):
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+SEARCH_URL = os.getenv('GOOGLE_SEARCH_URL', "https://www.googleapis.com/customsearch/v1")
+
+# (connect, read) timeouts in seconds
+SEARCH_TIMEOUT = (3.05, float(os.getenv('SEARCH_TIMEOUT', 8)))
+
+# Results are fresh for SEARCH_CACHE_TTL seconds; for SEARCH_STALE_TTL
+# seconds after that they are still served while a refresh runs in the
+# background
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 7 * 24 * 3600))
+SEARCH_STALE_TTL = float(os.getenv('SEARCH_STALE_TTL', 30 * 24 * 3600))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1024))
+
+# Custom Search API quotas: queries per second and per day
+SEARCH_RATE = float(os.getenv('SEARCH_RATE', 5))
+SEARCH_DAILY_QUOTA = int(os.getenv('SEARCH_DAILY_QUOTA', 10000))
+
+# Speculative search: how many name candidates to search at once, how
+# much the name resolver's score counts against how well the results
+# match the label, and how long to wait for the searches
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 3))
+CANDIDATE_WEIGHT = 0.5
+SEARCH_CANDIDATES_BUDGET = float(os.getenv('SEARCH_CANDIDATES_BUDGET', SEARCH_TIMEOUT[1]))
+
+# Threads for speculative searches; shared so abandoned searches never
+# hold up the request that started them
+_search_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SEARCH_POOL_SIZE', 16)), thread_name_prefix='search')
+
+
+class QuotaExceeded(Exception):
+    """Raised when a search would go over the rate limit or daily quota."""
+
+
+class RateLimiter:
     """
-    Search for information about a medicine using Google Custom Search API.
-    
+    Token bucket rate limiter with a daily cap.
+
     Args:
-        medicine_name (str): The name of the medicine to search for
-        
+        rate (float): Requests per second allowed on average
+        daily_quota (int): Requests allowed per UTC day
+        burst (int): Requests that may be made back to back
+    """
+
+    def __init__(self, rate=SEARCH_RATE, daily_quota=SEARCH_DAILY_QUOTA, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.daily_quota = daily_quota
+        self.used_today = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._day = time.gmtime().tm_yday
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=1.0):
+        """
+        Take one request from the budget, waiting up to `timeout` seconds.
+
+        Raises:
+            QuotaExceeded: If the daily quota is used up or no token frees up in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                today = time.gmtime().tm_yday
+                if today != self._day:
+                    self._day, self.used_today = today, 0
+                if self.used_today >= self.daily_quota:
+                    raise QuotaExceeded("Daily search quota exhausted")
+
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.used_today += 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise QuotaExceeded("Search rate limit reached")
+            time.sleep(wait)
+
+
+def normalize_name(medicine_name):
+    """
+    Normalize a medicine name into a cache key.
+
+    Args:
+        medicine_name (str): Name as read from the label
+
     Returns:
-        str: Compiled search results information
+        str: Lowercase name with punctuation removed and spaces collapsed
     """
-    try:
-        # Load environment variables
-        load_dotenv()
-        
-        # Get API key and Search Engine ID from environment variables
+    return ' '.join(re.sub(r'[^\w\s]', ' ', medicine_name.lower()).split())
+
+
+class SearchClient:
+    """
+    Google Custom Search client shared by every request.
+
+    Connections are kept alive in a pooled session, results are cached in
+    memory (and optionally in SQLite) by normalized medicine name, identical
+    concurrent queries share one API call, and stale results are served
+    while they are refreshed in the background.
+
+    Args:
+        db_path (str): SQLite file for the persistent cache tier, or None
+    """
+
+    def __init__(self, db_path=None):
+        # Imported here so that importing search, e.g. for normalize_name, stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=int(os.getenv('SEARCH_POOL_SIZE', 16)),
+            max_retries=Retry(total=2, backoff_factor=0.3,
+                              status_forcelist=[500, 502, 503, 504], allowed_methods=['GET'])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        ttl = SEARCH_CACHE_TTL + SEARCH_STALE_TTL
+        self.memory = cache.TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=ttl)
+        self.disk = cache.SQLiteStore(db_path, table='search', ttl=ttl) if db_path else None
+        self.flight = cache.SingleFlight()
+        self.limiter = RateLimiter()
+        self.api_calls = 0
+        self.stale_served = 0
+        self.errors = 0
+
+    def _fetch(self, key, medicine_name):
+        """Query the API and store the result items under `key`."""
         api_key = os.getenv('GOOGLE_API_KEY')
         search_engine_id = os.getenv('GOOGLE_SEARCH_ENGINE_ID')
-        
-        if not api_key or not search_engine_id:
-            return "Google Search API configuration is missing."
-        
+
+        self.limiter.acquire()
+        self.api_calls += 1
+
         # Construct search query
         query = f"{medicine_name} medicine usage information dosage"
-        
-        # Make request to Google Custom Search API
-        url = f"https://www.googleapis.com/customsearch/v1"
         params = {
             'key': api_key,
             'cx': search_engine_id,
             'q': query,
             'num': 3  # Number of results to return
         }
-        
-        response = requests.get(url, params=params)
-        results = response.json()
-        
-        # Process and format the search results
-        if 'items' not in results:
-            return f"No information found for {medicine_name}."
-        
-        # Compile relevant information from search results
-        compiled_info = f"Search Results for {medicine_name}:\n\n"
-        
-        for item in results['items']:
-            compiled_info += f"Title: {item.get('title', 'N/A')}\n"
-            compiled_info += f"Source: {item.get('displayLink', 'N/A')}\n"
-            compiled_info += f"Snippet: {item.get('snippet', 'N/A')}\n\n"
-        
-        return compiled_info
-    
+
+        with metrics.span('search.api'):
+            response = self.session.get(SEARCH_URL, params=params, timeout=SEARCH_TIMEOUT)
+            response.raise_for_status()
+        items = [
+            {field: item.get(field, 'N/A') for field in ('title', 'displayLink', 'snippet')}
+            for item in response.json().get('items', [])
+        ]
+
+        entry = {'items': items, 'fetched': time.time()}
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+        return entry
+
+    def _refresh(self, key, medicine_name):
+        def run():
+            try:
+                self.flight.do(key, lambda: self._fetch(key, medicine_name))
+            except Exception as e:
+                logger.warning(f"Background search refresh for '{key}' failed: {str(e)}")
+
+        if not self.flight.in_flight(key):
+            threading.Thread(target=run, daemon=True).start()
+
+    def _cached(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    def search(self, medicine_name):
+        """
+        Return search result items for a medicine.
+
+        Args:
+            medicine_name (str): The name of the medicine to search for
+
+        Returns:
+            list: Dicts with 'title', 'displayLink' and 'snippet'
+        """
+        key = normalize_name(medicine_name)
+        entry = self._cached(key)
+        if entry is not None:
+            if time.time() - entry['fetched'] > SEARCH_CACHE_TTL:
+                # Serve the stale result now and refresh it for next time
+                self.stale_served += 1
+                self._refresh(key, medicine_name)
+            return entry['items']
+
+        try:
+            return self.flight.do(key, lambda: self._fetch(key, medicine_name))['items']
+        except Exception:
+            self.errors += 1
+            raise
+
+    def stats(self):
+        return dict(
+            self.memory.stats(),
+            api_calls=self.api_calls,
+            stale_served=self.stale_served,
+            coalesced=self.flight.coalesced,
+            errors=self.errors,
+            quota_used_today=self.limiter.used_today,
+        )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared search client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SearchClient(db_path=os.getenv('SEARCH_CACHE_DB') or None)
+        return _client
+
+
+def format_results(medicine_name, items):
+    """
+    Compile search result items into the text passed to the LLM.
+
+    Args:
+        medicine_name (str): The name of the medicine
+        items (list): Result items from `SearchClient.search`
+
+    Returns:
+        str: Compiled search results information
+    """
+    # Process and format the search results
+    if not items:
+        return f"No information found for {medicine_name}."
+
+    # Compile relevant information from search results
+    compiled_info = f"Search Results for {medicine_name}:\n\n"
+
+    for item in items:
+        compiled_info += f"Title: {item.get('title', 'N/A')}\n"
+        compiled_info += f"Source: {item.get('displayLink', 'N/A')}\n"
+        compiled_info += f"Snippet: {item.get('snippet', 'N/A')}\n\n"
+
+    return compiled_info
+
+
+def search_medicine_info(medicine_name):
+    """
+    Search for information about a medicine using Google Custom Search API.
+
+    Args:
+        medicine_name (str): The name of the medicine to search for
+
+    Returns:
+        str: Compiled search results information
+    """
+    try:
+        # Get API key and Search Engine ID from environment variables
+        if not os.getenv('GOOGLE_API_KEY') or not os.getenv('GOOGLE_SEARCH_ENGINE_ID'):
+            return "Google Search API configuration is missing."
+
+        with metrics.span('search'):
+            items = get_client().search(medicine_name)
+        return format_results(medicine_name, items)
+
+    except QuotaExceeded as e:
+        return f"Search is temporarily unavailable: {str(e)}"
     except Exception as e:
-        return f"Error searching for medicine information: {str(e)}"
\ No newline at end of file
+        return f"Error searching for medicine information: {str(e)}"
+
+
+def _label_tokens(text):
+    return set(re.findall(r'[a-z]{4,}', text.lower()))
+
+
+def match_score(text, items):
+    """
+    Share of the label's words that also appear in search results.
+
+    Args:
+        text (str): OCR text of the label
+        items (list): Result items from `SearchClient.search`
+
+    Returns:
+        float: 0 (nothing in common) to 1 (every label word found)
+    """
+    label = _label_tokens(text)
+    if not label or not items:
+        return 0.0
+    found = _label_tokens(' '.join(f"{item.get('title', '')} {item.get('snippet', '')}" for item in items))
+    return len(label & found) / float(len(label))
+
+
+def _order(entry):
+    """Sort key of a scored candidate: best score first, then resolver rank."""
+    return -entry['score'], entry['rank']
+
+
+async def _search_candidates(client, candidates, text, budget):
+    """
+    Search every candidate concurrently, stopping as soon as one is sure to win.
+
+    A candidate's score mixes its name resolver score with `match_score`
+    of its results; equal scores go to the candidate the resolver ranked
+    higher. Once the best finished candidate beats what any pending one
+    could reach with a perfect match, the pending searches are cancelled;
+    searches that already reached the API still finish into the cache.
+
+    Returns:
+        list: Scored candidates whose search finished within the budget,
+        with their 'rank' among the candidates
+    """
+    loop = asyncio.get_running_loop()
+    tasks = {
+        loop.run_in_executor(_search_executor, client.search, candidate['name']): (rank, candidate)
+        for rank, candidate in enumerate(candidates)
+    }
+    deadline = loop.time() + budget
+    pending = set(tasks)
+    scored = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.warning(f"Speculative search budget of {budget:g}s exhausted")
+                break
+            for task in done:
+                rank, candidate = tasks[task]
+                if task.exception() is not None:
+                    logger.warning(f"Search for '{candidate['name']}' failed: {str(task.exception())}")
+                    continue
+                items = task.result()
+                match = match_score(text, items)
+                scored.append({
+                    'name': candidate['name'],
+                    'score': CANDIDATE_WEIGHT * candidate['score'] + (1 - CANDIDATE_WEIGHT) * match,
+                    'match': match,
+                    'items': items,
+                    'rank': rank,
+                })
+
+            # Stop once no pending candidate could overtake the leader, even with a perfect match
+            leader = min((_order(entry) for entry in scored), default=None)
+            if leader is not None and all(
+                    leader < _order({'score': CANDIDATE_WEIGHT * tasks[task][1]['score'] + (1 - CANDIDATE_WEIGHT),
+                                     'rank': tasks[task][0]})
+                    for task in pending):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    return scored
+
+
+def search_candidates(candidates, text, k=SEARCH_CANDIDATES):
+    """
+    Search the top-k medicine name candidates at once and keep the best match.
+
+    When the resolver's first guess is wrong, the right name is usually
+    among its runners-up; searching them in parallel picks it up without
+    a rescan, in about the time of a single search.
+
+    Args:
+        candidates (list): Ranked candidates from `LLM.identify_medicine`
+        text (str): OCR text of the label
+        k (int): Number of candidates to search
+
+    Returns:
+        dict: 'medicine_name' (the chosen candidate, or '' when there is
+        none), 'search_results' (compiled for the LLM) and 'ranking'
+        (name, score and match of every candidate searched, best first)
+    """
+    candidates = candidates[:max(1, k)]
+    if not candidates:
+        return {'medicine_name': '', 'search_results': None, 'ranking': []}
+    top = candidates[0]['name']
+
+    if len(candidates) == 1:
+        return {'medicine_name': top, 'search_results': search_medicine_info(top), 'ranking': []}
+    if not os.getenv('GOOGLE_API_KEY') or not os.getenv('GOOGLE_SEARCH_ENGINE_ID'):
+        return {'medicine_name': top, 'search_results': "Google Search API configuration is missing.", 'ranking': []}
+
+    with metrics.span('search'):
+        scored = asyncio.run(_search_candidates(get_client(), candidates, text, SEARCH_CANDIDATES_BUDGET))
+    if not scored:
+        return {'medicine_name': top, 'search_results': search_medicine_info(top), 'ranking': []}
+
+    # Runners-up replace the resolver's first guess only on a strictly higher score
+    scored.sort(key=_order)
+    best = scored[0]
+    if best['name'] != top:
+        logger.info(f"Search results favour '{best['name']}' over the top name candidate '{top}'")
+    return {
+        'medicine_name': best['name'],
+        'search_results': format_results(best['name'], best['items']),
+        'ranking': [
+            {'name': entry['name'], 'score': round(entry['score'], 3), 'match': round(entry['match'], 3)}
+            for entry in scored
+        ],
+    }
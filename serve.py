@@ -0,0 +1,116 @@
+import argparse
+import os
+import threading
+import time
+import logging
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Windows, or an install without the production server
+    BaseApplication = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SERVE_BIND = os.getenv('SERVE_BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+# Worker processes, and threads per worker; scans spend most of their
+# time waiting on OCR processes, search and the LLM, and SSE and live
+# scan connections each hold a thread, so workers are threaded.
+# OCR already runs on a process pool per worker, so one worker with many
+# threads uses every core. Scan jobs and annotated images live in the
+# memory of the worker that created them: with more than one worker,
+# /api/jobs/<id>, its events and /api/annotated/<id> only work behind a
+# load balancer that sends each client back to the same worker, or once
+# those stores are moved to a store shared by all workers.
+SERVE_WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', 32))
+SERVE_TIMEOUT = int(os.getenv('SERVE_TIMEOUT', 120))
+
+
+def load_app():
+    """
+    Import the app and preload the OCR stack in this process.
+
+    Returns:
+        flask.Flask: The WSGI app
+    """
+    started = time.perf_counter()
+    import app
+
+    app.check_config()
+    app.preload()
+    logger.info(f"Loaded the app in {time.perf_counter() - started:.2f}s")
+    return app.app
+
+
+def post_worker_init(worker):
+    """Gunicorn hook: warm each forked worker in the background, gated by /readyz."""
+    import app
+
+    threading.Thread(target=app.warmup, daemon=True, name='warmup').start()
+
+
+if BaseApplication is not None:
+    class Server(BaseApplication):
+        """
+        Gunicorn server for an app that is already loaded.
+
+        The app is loaded before the master forks, so the OpenCV/Tesseract
+        stack is imported once and shared copy-on-write by every worker.
+
+        Args:
+            application: WSGI app
+            options (dict): Gunicorn settings
+        """
+
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the medicine scanner with preloaded, pre-forked workers.")
+    parser.add_argument('--bind', default=SERVE_BIND, help="address to listen on (default %(default)s)")
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help="worker processes")
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS, help="threads per worker")
+    parser.add_argument('--timeout', type=int, default=SERVE_TIMEOUT, help="seconds before a silent worker is restarted")
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        logger.warning(f"Running {args.workers} workers: scan jobs and annotated images are kept per worker, "
+                       "so clients must be routed back to the worker that created them")
+
+    application = load_app()
+
+    if BaseApplication is None:
+        import app
+
+        logger.warning("gunicorn is not installed, falling back to the single process development server")
+        threading.Thread(target=app.warmup, daemon=True, name='warmup').start()
+        host, _, port = args.bind.rpartition(':')
+        application.run(host=host or '0.0.0.0', port=int(port), threaded=True, use_reloader=False)
+        return
+
+    Server(application, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'preload_app': True,
+        'post_worker_init': post_worker_init,
+        'accesslog': '-',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
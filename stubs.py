@@ -0,0 +1,181 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STUB_ANSWER = (
+    "1. Medicine Name: {name}\n"
+    "2. Primary Uses: Relief of mild to moderate pain and fever.\n"
+    "3. Dosage Information: Follow the dose prescribed by your doctor.\n"
+    "4. Common Side Effects: Nausea, rash.\n"
+    "5. Precautions: Do not exceed the stated dose.\n"
+    "6. Important Note: Always consult a healthcare professional."
+)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up early (timeouts, hedges) are expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    Local HTTP stand-in for the Groq and Google Custom Search APIs.
+
+    Serves OpenAI style chat completions (plain and streamed) under
+    /openai/v1/chat/completions and Custom Search results under
+    /customsearch/v1, after a configurable delay, so the pipeline can be
+    benchmarked without network access, API keys or quota. Completions
+    are counted per requested model in `models`.
+
+    Args:
+        groq_latency (float): Seconds before a chat completion is returned
+        search_latency (float): Seconds before search results are returned
+        jitter (float): Random spread of the latencies, as a fraction of them
+        token_delay (float): Seconds between chunks of a streamed completion
+        seed (int): Seed for the jitter, so runs are reproducible
+    """
+
+    def __init__(self, groq_latency=0.8, search_latency=0.25, jitter=0.1, token_delay=0.01, seed=0):
+        self.groq_latency = groq_latency
+        self.search_latency = search_latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.requests = {'groq': 0, 'search': 0}
+        self.models = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _delay(self, kind, latency):
+        with self._lock:
+            self.requests[kind] += 1
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, latency * (1 + spread)))
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/customsearch/v1':
+                    return self._json(404, {'error': 'not found'})
+                query = parse_qs(url.query).get('q', [''])[0]
+                name = query.split(' medicine')[0]
+                stub._delay('search', stub.search_latency)
+                self._json(200, {'items': [
+                    {
+                        'title': f"{name} - uses, dosage and side effects ({i})",
+                        'displayLink': f"example{i}.org",
+                        'snippet': f"{name} is used to treat pain and fever. Typical adult dose ..."
+                    }
+                    for i in range(1, 4)
+                ]})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if urlparse(self.path).path != '/openai/v1/chat/completions':
+                    return self._json(404, {'error': 'not found'})
+                prompt = body['messages'][-1]['content']
+                name = prompt.split('potentially being:')[-1].strip().splitlines()[0] if 'potentially being:' in prompt else 'unknown'
+                answer = STUB_ANSWER.format(name=name)
+                # Cut the answer at max_tokens, counting a word as a token, as the API would
+                finish_reason = 'stop'
+                max_tokens = body.get('max_tokens')
+                if max_tokens and len(answer.split(' ')) > max_tokens:
+                    answer = ' '.join(answer.split(' ')[:max_tokens])
+                    finish_reason = 'length'
+                model = body.get('model', 'stub')
+                with stub._lock:
+                    stub.models[model] = stub.models.get(model, 0) + 1
+                stub._delay('groq', stub.groq_latency)
+
+                completion = {
+                    'id': 'chatcmpl-stub',
+                    'created': int(time.time()),
+                    'model': model,
+                }
+                if not body.get('stream'):
+                    tokens = len(answer.split())
+                    return self._json(200, dict(
+                        completion,
+                        object='chat.completion',
+                        choices=[{'index': 0, 'message': {'role': 'assistant', 'content': answer},
+                                  'finish_reason': finish_reason}],
+                        usage={'prompt_tokens': len(prompt.split()), 'completion_tokens': tokens,
+                               'total_tokens': len(prompt.split()) + tokens},
+                    ))
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                pieces = [word + ' ' for word in answer.split(' ')]
+                for i, piece in enumerate(pieces):
+                    chunk = dict(completion, object='chat.completion.chunk', choices=[{
+                        'index': 0, 'delta': {'content': piece},
+                        'finish_reason': finish_reason if i == len(pieces) - 1 else None,
+                    }])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(stub.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Stub APIs listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def configure_env(self):
+        """
+        Point the Groq SDK and the search module at this server.
+
+        Must run before `search` is imported, since it reads its endpoint
+        at import time.
+        """
+        os.environ['GROQ_BASE_URL'] = self.url
+        os.environ['GROQ_API_KEY'] = 'stub-key'
+        os.environ['GOOGLE_SEARCH_URL'] = f"{self.url}/customsearch/v1"
+        os.environ['GOOGLE_API_KEY'] = 'stub-key'
+        os.environ['GOOGLE_SEARCH_ENGINE_ID'] = 'stub-engine'
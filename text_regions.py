@@ -0,0 +1,169 @@
+import cv2
+import numpy as np
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Regions are detected on a copy no larger than this on its long side
+DETECT_MAX_SIDE = 1200
+
+# Text height (in pixels) each crop is scaled to before OCR; Tesseract is
+# most accurate with capitals roughly 20-40 pixels tall
+TARGET_TEXT_HEIGHT = int(os.getenv('OCR_TARGET_TEXT_HEIGHT', 32))
+MIN_SCALE = 0.5
+MAX_SCALE = 4.0
+
+# Only the most prominent regions are read
+MAX_REGIONS = int(os.getenv('OCR_MAX_REGIONS', 8))
+
+def character_mask(image):
+    """
+    Find character sized edge components with a morphological gradient.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image
+
+    Returns:
+        tuple: (binary mask of the characters, their connected component
+        stats as returned by `cv2.connectedComponentsWithStats`)
+    """
+    # Take the strongest edge over the colour channels so coloured text on
+    # a similarly bright background (red on pink foil) still stands out
+    element = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    channels = cv2.split(image) if image.ndim == 3 else [image]
+    gradient = np.max([cv2.morphologyEx(channel, cv2.MORPH_GRADIENT, element) for channel in channels], axis=0)
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Keep only character sized edge components; package outlines and
+    # large graphics would otherwise glue every line together
+    height, width = binary.shape[:2]
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    character = (
+        (heights >= 4) & (heights <= height * 0.2)
+        & (stats[:, cv2.CC_STAT_WIDTH] <= width * 0.25) & (stats[:, cv2.CC_STAT_AREA] >= 8))
+    character[0] = False  # background
+    return np.where(character, 255, 0).astype(np.uint8)[labels], stats[character]
+
+def _line_boxes(image):
+    """Find boxes around text lines with a morphological gradient."""
+    binary, stats = character_mask(image)
+    height, width = binary.shape[:2]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    tops = stats[:, cv2.CC_STAT_TOP] + heights / 2.0
+    lefts = stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] / 2.0
+
+    # Join characters into words and words into lines
+    kernel_width = max(9, width // 80)
+    connected = cv2.morphologyEx(
+        binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_width, 1)))
+
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 8 or w < 8 or h > height * 0.5:
+            continue
+        # Text lines are wide and mostly filled with edges
+        fill = cv2.countNonZero(binary[y:y + h, x:x + w]) / float(w * h)
+        if w < h * 0.8 or fill < 0.15:
+            continue
+        # Touching lines of small print merge into one box, so take the
+        # text height from the characters inside rather than the box
+        inside = (lefts >= x) & (lefts < x + w) & (tops >= y) & (tops < y + h)
+        text_height = float(np.median(heights[inside])) if inside.any() else float(h)
+        boxes.append([x, y, w, h, min(float(h), text_height)])
+    return boxes
+
+def _merge_lines(lines):
+    """Group vertically adjacent lines of similar height into blocks."""
+    blocks = []
+    for x, y, w, h, line_height in sorted(lines, key=lambda box: box[1]):
+        for block in blocks:
+            bx, by, bw, bh, block_height = block
+            similar = 0.66 < line_height / block_height < 1.5
+            overlaps = x < bx + bw and bx < x + w
+            close = y - (by + bh) < line_height
+            if similar and overlaps and close:
+                x2, y2 = max(bx + bw, x + w), max(by + bh, y + h)
+                block[0], block[1] = min(bx, x), min(by, y)
+                block[2], block[3] = x2 - block[0], y2 - block[1]
+                # Keep the tallest line height as the block's text height
+                block[4] = max(block_height, line_height)
+                break
+        else:
+            blocks.append([x, y, w, h, line_height])
+    return blocks
+
+def scale_for(text_height):
+    """Return the resize factor that brings text of this height to TARGET_TEXT_HEIGHT."""
+    return float(np.clip(TARGET_TEXT_HEIGHT / text_height, MIN_SCALE, MAX_SCALE))
+
+def estimate_text_height(image):
+    """
+    Estimate the typical text line height of a whole image.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image
+
+    Returns:
+        float: Median line height in image pixels, or None if no text was found
+    """
+    height, width = image.shape[:2]
+    ratio = min(1.0, DETECT_MAX_SIDE / float(max(height, width)))
+    small = image
+    if ratio < 1.0:
+        small = cv2.resize(image, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+
+    lines = _line_boxes(small)
+    if not lines:
+        return None
+    return float(np.median([line[4] for line in lines])) / ratio
+
+def detect_text_regions(image, max_regions=MAX_REGIONS):
+    """
+    Locate text blocks in an image and rank them by prominence.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image
+        max_regions (int): Maximum number of regions to return
+
+    Returns:
+        list: Dicts with 'box' (x, y, w, h in image coordinates), 'text_height'
+        (estimated line height in pixels) and 'scale' (factor that brings the
+        text to TARGET_TEXT_HEIGHT), largest text first
+    """
+    height, width = image.shape[:2]
+    ratio = min(1.0, DETECT_MAX_SIDE / float(max(height, width)))
+    small = image
+    if ratio < 1.0:
+        small = cv2.resize(image, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+
+    blocks = _merge_lines(_line_boxes(small))
+
+    # Prominence: tall text first (brand names), then larger area
+    blocks.sort(key=lambda block: (block[4], block[2] * block[3]), reverse=True)
+
+    regions = []
+    for x, y, w, h, line_height in blocks[:max_regions]:
+        # Pad so characters touching the box edge are not cut off
+        pad = int(line_height * 0.3)
+        x0 = max(0, int((x - pad) / ratio))
+        y0 = max(0, int((y - pad) / ratio))
+        x1 = min(width, int((x + w + pad) / ratio))
+        y1 = min(height, int((y + h + pad) / ratio))
+        text_height = line_height / ratio
+        regions.append({
+            'box': (x0, y0, x1 - x0, y1 - y0),
+            'text_height': text_height,
+            'scale': scale_for(text_height),
+        })
+    return regions
+
+def coverage(regions, shape):
+    """Return the fraction of the image area covered by the region boxes."""
+    area = sum(region['box'][2] * region['box'][3] for region in regions)
+    return area / float(shape[0] * shape[1])
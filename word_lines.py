@@ -0,0 +1,35 @@
+# Line grouping of OCR word boxes, kept free of OCR and image dependencies
+# so that text-only modules (name_resolver, prompt_context) can use it
+# without loading the OCR backend
+
+
+def line_key(word):
+    """
+    Key of the text line a word is on.
+
+    Tesseract numbers blocks, paragraphs and lines per image, so words
+    merged from several crops or tiles also carry their 'region' and
+    'tile' index to tell their lines apart.
+    """
+    return tuple(word.get(key, 0) for key in ('region', 'tile', 'block', 'par', 'line'))
+
+
+def group_lines(words):
+    """
+    Split words in reading order into their text lines.
+
+    Consecutive words with the same `line_key` form a line; words with
+    that key further on start a new one.
+
+    Returns:
+        list: Lists of words, one per line
+    """
+    lines = []
+    current_key = None
+    for word in words:
+        key = line_key(word)
+        if key != current_key:
+            lines.append([])
+            current_key = key
+        lines[-1].append(word)
+    return lines
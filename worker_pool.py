@@ -0,0 +1,303 @@
+import cv2
+import multiprocessing
+import os
+import threading
+import time
+import logging
+import metrics
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pool sizing; OCR_WORKERS=0 runs extraction inline in the calling thread
+WORKERS = int(os.getenv('OCR_WORKERS', os.cpu_count() or 1))
+QUEUE_SIZE = int(os.getenv('OCR_QUEUE_SIZE', 2 * max(1, WORKERS)))
+JOB_TIMEOUT = float(os.getenv('OCR_JOB_TIMEOUT', 30))
+
+# Jobs stop themselves at their deadline; a caller waits this much longer
+# before giving up on a job that could not be stopped
+JOB_GRACE = float(os.getenv('OCR_JOB_GRACE', 5))
+
+# Workers start from a fresh interpreter, never forked from the server: by
+# the time the pool starts, its threads may hold locks (logging, SQLite,
+# the search session) that a forked child would wait on forever
+START_METHOD = os.getenv(
+    'OCR_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the admission queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__("OCR workers are busy, please retry shortly")
+        self.retry_after = retry_after
+
+
+class JobTimeout(Exception):
+    """Raised when an OCR job does not finish within its deadline."""
+
+
+def _init_worker():
+    """
+    Load the OpenCV/Tesseract stack once per worker process.
+
+    Workers share no state with the server, so the OCR engines are
+    created and warmed here.
+    """
+    # Each worker is single threaded; parallelism comes from the pool
+    cv2.setNumThreads(1)
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    import extraction
+    import ocr_engine
+    ocr_engine.POOL_SIZE = 1
+    for psm in (extraction.PRIMARY_PSM, extraction.FALLBACK_PSM):
+        try:
+            ocr_engine.get_pool(psm).warm()
+        except Exception as e:
+            logger.warning(f"Could not warm OCR engine for psm {psm}: {str(e)}")
+
+
+def extract(image_bytes, annotate=False, deadline=None):
+    """
+    Decode an image, run OCR and optionally draw the word boxes.
+
+    This is the job that runs inside a worker process, so it takes and
+    returns only cheap-to-pickle values. OCR passes stop at the deadline,
+    so a hard image hands its worker back instead of holding it until
+    Tesseract gives up.
+
+    Args:
+        image_bytes (bytes): Encoded image
+        annotate (bool): Also return the image with the word boxes drawn
+        deadline (float): `time.time()` by which the job must finish, or
+            None for no limit
+
+    Returns:
+        dict: The `extraction.analyze` result without the decoded image,
+        plus 'image_size' ([width, height]) and, when annotating,
+        'annotated_jpeg' with the boxed image encoded as JPEG; its
+        'timings' also cover drawing the boxes and the whole job
+
+    Raises:
+        JobTimeout: If OCR was stopped at the deadline
+    """
+    import extraction
+    import ocr_engine
+    started = time.perf_counter()
+    try:
+        with ocr_engine.deadline(deadline):
+            result = extraction.analyze(image_bytes)
+    except ocr_engine.OcrTimeout:
+        raise JobTimeout("OCR did not finish before its deadline") from None
+    result['image_size'] = [result['image'].shape[1], result['image'].shape[0]]
+    if annotate:
+        start = time.perf_counter()
+        _, annotated = cv2.imencode('.jpg', extraction.draw_boxes(result))
+        result['annotated_jpeg'] = annotated.tobytes()
+        result['timings']['annotate'] = time.perf_counter() - start
+    del result['image']
+    result['timings']['total'] = time.perf_counter() - started
+    return result
+
+
+class OcrWorkerPool:
+    """
+    Process pool that runs the CPU-bound extraction stage.
+
+    At most `workers + queue_size` jobs are admitted at once; beyond that
+    `submit` fails fast with `PoolSaturated` instead of queueing without
+    bound, so request threads never pile up behind slow images.
+
+    Args:
+        workers (int): Number of worker processes
+        queue_size (int): Jobs allowed to wait for a free worker
+        timeout (float): Seconds a job may take from its admission
+    """
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, timeout=JOB_TIMEOUT):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             mp_context=multiprocessing.get_context(START_METHOD))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._avg_seconds = 2.0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+
+    def _retry_after(self):
+        # Time for the jobs already admitted to drain through the workers
+        waves = (self._in_flight + self.workers - 1) // self.workers
+        return max(1, int(round(waves * self._avg_seconds)))
+
+    def submit(self, fn, *args):
+        """
+        Admit a job or raise `PoolSaturated`.
+
+        Returns:
+            concurrent.futures.Future: Future for the job's result
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+                retry_after = self._retry_after()
+            raise PoolSaturated(retry_after)
+
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+
+        def done(_future):
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+                # Exponential moving average of the job duration
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+            self._slots.release()
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            done(None)
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def run(self, fn, *args):
+        """
+        Run a job and wait for its result.
+
+        Raises:
+            PoolSaturated: If the admission queue is full
+            JobTimeout: If the job takes longer than the pool timeout
+        """
+        return self.wait(self.submit(fn, *args))
+
+    def wait(self, future):
+        """
+        Wait for a submitted job's result.
+
+        Jobs given a deadline stop themselves there, freeing their worker
+        and admission slot; a job that cannot be stopped keeps both until
+        it really ends, since a running process job cannot be cancelled.
+
+        Raises:
+            JobTimeout: If the job takes longer than the pool timeout
+        """
+        try:
+            return future.result(timeout=self.timeout + JOB_GRACE)
+        except JobTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise JobTimeout(f"OCR did not finish within {self.timeout:g} seconds")
+
+    def warm(self, image_bytes):
+        """
+        Start every worker process and run an extraction through the pool,
+        so the first real jobs pay neither for process start nor for
+        loading the OCR engines.
+
+        Args:
+            image_bytes (bytes): Encoded image to read
+        """
+        futures = [self._executor.submit(extract, image_bytes) for _ in range(self.workers)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'avg_job_seconds': self._avg_seconds,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared worker pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OcrWorkerPool()
+            logger.info(f"Started OCR worker pool with {_pool.workers} workers")
+        return _pool
+
+
+def submit_extract(image_bytes, annotate=False):
+    """
+    Admit an `extract` job without waiting for it.
+
+    The job must finish within the pool timeout of its admission, time
+    spent queueing included. When OCR_WORKERS is 0 the job runs inline,
+    within JOB_TIMEOUT, and the returned future is already resolved.
+
+    Args:
+        image_bytes (bytes): Encoded image
+        annotate (bool): Also draw the word boxes, see `extract`
+
+    Returns:
+        concurrent.futures.Future: Future for the `extract` result
+
+    Raises:
+        PoolSaturated: If the admission queue is full
+    """
+    if WORKERS <= 0:
+        future = Future()
+        try:
+            future.set_result(extract(image_bytes, annotate, time.time() + JOB_TIMEOUT))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    pool = get_pool()
+    return pool.submit(extract, image_bytes, annotate, time.time() + pool.timeout)
+
+
+def wait_extract(future):
+    """
+    Wait for a future from `submit_extract`, raising `JobTimeout` if it is late.
+
+    The stage timings measured in the worker are recorded here, in the
+    waiting thread, so they reach the metrics and Server-Timing of the
+    request that asked for them.
+    """
+    if WORKERS <= 0:
+        result = future.result()
+    else:
+        with metrics.span('ocr.wait'):
+            result = get_pool().wait(future)
+    metrics.record_timings(result['timings'], prefix='ocr.')
+    return result
+
+
+def run_extract(image_bytes, annotate=False):
+    """
+    Run `extract` on the shared pool, or inline when OCR_WORKERS is 0.
+
+    Args:
+        image_bytes (bytes): Encoded image
+        annotate (bool): Also draw the word boxes, see `extract`
+
+    Returns:
+        dict: See `extract`
+    """
+    return wait_extract(submit_extract(image_bytes, annotate))